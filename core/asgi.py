@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Bajo ASGI, /api/collect/ usa las vistas async (ORM async + httpx)
+os.environ.setdefault('TRACKING_ASYNC_COLLECT', '1')
 
 application = get_asgi_application()
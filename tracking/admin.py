@@ -1,18 +1,136 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
 from django.db import models
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.forms import Textarea
-from .models import Event, TrackingRule, GA4Rule
+from .models import Event, TrackingRule, GA4Rule, IngestionPolicy
 
 
 # =====================
 # EVENTOS CRUDOS
 # =====================
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator que nunca hace COUNT(*) sobre toda la tabla.
+    Con solo la ventana de tiempo por defecto (`since`) estima las filas
+    por el rango de ids; con otros filtros cuenta como máximo
+    ESTIMATE_CAP filas.
+    """
+    ESTIMATE_CAP = 10000
+
+    def __init__(self, *args, since=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.since = since
+
+    @cached_property
+    def count(self):
+        qs = self.object_list
+        if self.since is not None:
+            return estimate_rows_since(qs.model, self.since)
+        return qs.order_by()[:self.ESTIMATE_CAP].count()
+
+
+def estimate_rows_since(model, since):
+    # Los ids crecen con created_at: primer id de la ventana (índice por
+    # created_at) hasta el último (PK). Dos búsquedas en índices.
+    first = (
+        model.objects.filter(created_at__gte=since)
+        .order_by("created_at")
+        .values_list("id", flat=True)
+        .first()
+    )
+    if first is None:
+        return 0
+    return model.objects.aggregate(top=Max("id"))["top"] - first + 1
+
+
+class EventChangeList(ChangeList):
+    """
+    Changelist acotado: por defecto solo los últimos EVENT_ADMIN_DEFAULT_DAYS
+    días y navegación por keyset (created_at, id) en lugar de OFFSET.
+    """
+
+    def get_queryset(self, request, exclude_parameters=None):
+        qs = super().get_queryset(request, exclude_parameters)
+        cursor = getattr(request, "event_cursor", None)
+
+        # Solo la ventana por defecto: el paginator puede estimar el total
+        request.event_window = None
+        if not any(key.startswith("created_at") for key in self.params):
+            days = getattr(settings, "EVENT_ADMIN_DEFAULT_DAYS", 7)
+            since = timezone.now() - timedelta(days=days)
+            qs = qs.filter(created_at__gte=since)
+            if not self.get_filters_params() and not self.query and not cursor:
+                request.event_window = since
+
+        if cursor:
+            created_at, pk = cursor
+            qs = qs.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+            )
+        return qs
+
+
 @admin.register(Event)
 class EventAdmin(admin.ModelAdmin):
     list_display = ("event", "path", "aid", "created_at")
     readonly_fields = ("aid", "event", "path", "created_at", "user_agent")
-    ordering = ("-created_at",)
-    search_fields = ("event", "path", "aid")
+    ordering = ("-created_at", "-id")
+    # Búsqueda exacta/prefijo sobre columnas indexadas (ver get_search_results)
+    search_fields = ("=aid", "=event", "^path")
+    search_help_text = "aid o evento exactos, o prefijo de path (ej: /checkout)"
+    date_hierarchy = "created_at"
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return EventChangeList
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return self.paginator(
+            queryset, per_page, orphans, allow_empty_first_page,
+            since=getattr(request, "event_window", None),
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.startswith("/"):
+            return queryset.filter(path__startswith=term), False
+        return queryset.filter(Q(aid=term) | Q(event=term)), False
+
+    def changelist_view(self, request, extra_context=None):
+        # El cursor no es un filtro del changelist: se saca de GET
+        request.event_cursor = None
+        if "cursor" in request.GET:
+            params = request.GET.copy()
+            raw = params.pop("cursor")[0]
+            request.GET = params
+            try:
+                created_at, pk = raw.rsplit("_", 1)
+                request.event_cursor = (datetime.fromisoformat(created_at), int(pk))
+            except ValueError:
+                pass
+
+        response = super().changelist_view(request, extra_context)
+        context = getattr(response, "context_data", None)
+        if context and "cl" in context:
+            results = list(context["cl"].result_list)
+            if len(results) >= self.list_per_page:
+                last = results[-1]
+                params = request.GET.copy()
+                params["cursor"] = f"{last.created_at.isoformat()}_{last.pk}"
+                context["next_cursor_query"] = params.urlencode()
+            context["cursor_active"] = request.event_cursor is not None
+            context["first_page_query"] = request.GET.urlencode()
+        return response
 
 
 # =====================
@@ -65,8 +183,8 @@ class TrackingRuleAdmin(admin.ModelAdmin):
 # =====================
 @admin.register(GA4Rule)
 class GA4RuleAdmin(admin.ModelAdmin):
-    list_display = ("listen_event", "fire_event", "url_contains", "active")
-    list_filter = ("listen_event", "active")
+    list_display = ("listen_event", "fire_event", "url_contains", "match_type", "sink", "active")
+    list_filter = ("listen_event", "match_type", "sink", "active")
     search_fields = ("fire_event_toggle",)
 
     formfield_overrides = {
@@ -74,3 +192,14 @@ class GA4RuleAdmin(admin.ModelAdmin):
             "widget": Textarea(attrs={"rows": 4, "style": "font-family: monospace"})
         }
     }
+
+
+# =====================
+# POLÍTICAS DE INGESTA
+# =====================
+@admin.register(IngestionPolicy)
+class IngestionPolicyAdmin(admin.ModelAdmin):
+    list_display = ("event_name", "action", "sample_percent", "active")
+    list_editable = ("action", "sample_percent", "active")
+    list_filter = ("action", "active")
+    search_fields = ("event_name",)
@@ -2,4 +2,15 @@ from django.apps import AppConfig
 
 
 class TrackingConfig(AppConfig):
+    # Igual que las migraciones (todas declaran BigAutoField)
+    default_auto_field = 'django.db.models.BigAutoField'
     name = 'tracking'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
+        from .sinks import get_sinks
+
+        # Los sinks se construyen al arrancar: un TRACKING_SINKS inválido
+        # falla acá y no en cada request de collect. Los hilos de cada
+        # sink se crean recién con el primer evento (después del fork).
+        get_sinks()
@@ -0,0 +1,257 @@
+import json
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+from django.conf import settings
+
+from .stamps import state_dir
+
+# =====================
+# FORMATO COLUMNAR .ctcol
+# =====================
+# MAGIC | grupos de filas | diccionarios | footer JSON | u32 largo | MAGIC
+# Las filas se escriben por grupos (un bloque zlib por columna y grupo):
+# escribir o leer un día no necesita tenerlo entero en memoria. El footer
+# describe columnas, grupos y el largo de cada bloque, en orden:
+#   int64 → [valores int64 little-endian]
+#   dict  → [códigos uint32 little-endian]; el diccionario JSON de cada
+#           columna va una sola vez, después de todos los grupos
+#   str   → [lista JSON]
+MAGIC = b"CTCOL2\n"
+FOOTER_LEN = struct.Struct("<I")
+
+COLUMNS = (
+    ("id", "int64"),
+    ("created_at", "int64"),  # microsegundos desde epoch (UTC)
+    ("aid", "str"),
+    ("event", "dict"),
+    ("path", "dict"),
+    ("user_agent", "dict"),
+    ("utm_source", "dict"),
+    ("utm_medium", "dict"),
+    ("utm_campaign", "dict"),
+)
+
+
+def archive_dir():
+    return getattr(settings, "EVENT_ARCHIVE_DIR", None) or state_dir("archive")
+
+
+def _little_endian(values):
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode, raw):
+    values = array(typecode)
+    values.frombytes(raw)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+class DictColumn:
+    """
+    Columna con diccionario: cada valor distinto se guarda una sola vez
+    (el diccionario es del día; los códigos, del grupo en curso).
+    """
+
+    def __init__(self):
+        self.codes = array("I")
+        self.values = []
+        self._lookup = {}
+
+    def append(self, value):
+        code = self._lookup.get(value)
+        if code is None:
+            code = self._lookup[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+
+class DayWriter:
+    """
+    Escribe las filas de un día en `path` por grupos de `group_rows`
+    filas. close() termina el archivo temporal (`tmp_path`); el archivo
+    final aparece (os.replace) recién en commit().
+    """
+
+    def __init__(self, path, group_rows=5000):
+        self.path = path
+        self.group_rows = group_rows
+        self.rows = 0
+        self.groups = []
+        self.tmp_path = f"{path}.tmp"
+        self._file = open(self.tmp_path, "wb")
+        self._file.write(MAGIC)
+        self.dictionaries = {name: DictColumn() for name, kind in COLUMNS if kind == "dict"}
+        self._reset_group()
+
+    def _reset_group(self):
+        self._group_rows = 0
+        self.columns = {}
+        for name, kind in COLUMNS:
+            if kind == "int64":
+                self.columns[name] = array("q")
+            elif kind == "dict":
+                self.dictionaries[name].codes = array("I")
+                self.columns[name] = self.dictionaries[name]
+            else:
+                self.columns[name] = []
+
+    def append(self, row):
+        """
+        row: dict con las claves de COLUMNS; created_at como datetime.
+        """
+        for name, kind in COLUMNS:
+            value = row[name]
+            if name == "created_at":
+                value = int(value.timestamp() * 1_000_000)
+            self.columns[name].append(value)
+        self.rows += 1
+        self._group_rows += 1
+        if self._group_rows >= self.group_rows:
+            self._flush_group()
+
+    def _write_block(self, raw):
+        block = zlib.compress(raw, 6)
+        self._file.write(block)
+        return len(block)
+
+    def _flush_group(self):
+        if not self._group_rows:
+            return
+        blocks = {}
+        for name, kind in COLUMNS:
+            column = self.columns[name]
+            if kind == "int64":
+                raw = _little_endian(array("q", column))
+            elif kind == "dict":
+                raw = _little_endian(array("I", column.codes))
+            else:
+                raw = json.dumps(column, ensure_ascii=False).encode("utf-8")
+            blocks[name] = self._write_block(raw)
+        self.groups.append({"rows": self._group_rows, "blocks": blocks})
+        self._reset_group()
+
+    def close(self):
+        self._flush_group()
+        footer = {
+            "version": 2,
+            "rows": self.rows,
+            "columns": [{"name": name, "type": kind} for name, kind in COLUMNS],
+            "groups": self.groups,
+            "dictionaries": {
+                name: self._write_block(json.dumps(column.values, ensure_ascii=False).encode("utf-8"))
+                for name, column in self.dictionaries.items()
+            },
+        }
+        encoded = json.dumps(footer).encode("utf-8")
+        self._file.write(encoded)
+        self._file.write(FOOTER_LEN.pack(len(encoded)))
+        self._file.write(MAGIC)
+        self._file.close()
+
+    def commit(self):
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.unlink(self.tmp_path)
+
+
+# =====================
+# LECTURA
+# =====================
+def read_header(path):
+    """
+    Footer del archivo, con "offsets": posición de cada bloque por grupo y
+    de cada diccionario.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} no es un archivo .ctcol")
+        f.seek(-(FOOTER_LEN.size + len(MAGIC)), os.SEEK_END)
+        (length,) = FOOTER_LEN.unpack(f.read(FOOTER_LEN.size))
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} está truncado")
+        f.seek(-(length + FOOTER_LEN.size + len(MAGIC)), os.SEEK_END)
+        header = json.loads(f.read(length))
+
+    offset = len(MAGIC)
+    names = [column["name"] for column in header["columns"]]
+    for group in header["groups"]:
+        group["offsets"] = {}
+        for name in names:
+            group["offsets"][name] = offset
+            offset += group["blocks"][name]
+    header["dictionary_offsets"] = {}
+    for name, size in header["dictionaries"].items():
+        header["dictionary_offsets"][name] = offset
+        offset += size
+    return header
+
+
+def _read_block(f, offset, size):
+    f.seek(offset)
+    return zlib.decompress(f.read(size))
+
+
+def iter_column(path, name, header=None):
+    """
+    Valores de una columna por grupo de filas, descomprimiendo solo esa
+    columna: array("q") para int64, array("I") de códigos para dict y
+    lista para str.
+    """
+    header = header or read_header(path)
+    kind = {column["name"]: column["type"] for column in header["columns"]}[name]
+    with open(path, "rb") as f:
+        for group in header["groups"]:
+            raw = _read_block(f, group["offsets"][name], group["blocks"][name])
+            if kind == "int64":
+                yield _from_little_endian("q", raw)
+            elif kind == "dict":
+                yield _from_little_endian("I", raw)
+            else:
+                yield json.loads(raw)
+
+
+def read_dictionary(path, name, header=None):
+    header = header or read_header(path)
+    with open(path, "rb") as f:
+        return json.loads(_read_block(
+            f, header["dictionary_offsets"][name], header["dictionaries"][name]
+        ))
+
+
+def read_day(path, decode=True):
+    """
+    Carga un archivo diario en arrays de NumPy (análisis ad-hoc).
+
+    Las columnas int64 vuelven como int64. Las de diccionario vuelven
+    decodificadas (dtype object) o, con decode=False, como la tupla
+    (códigos uint32, diccionario) para agrupar sin materializar strings.
+    """
+    import numpy as np
+
+    header = read_header(path)
+    result = {}
+    for column in header["columns"]:
+        name, kind = column["name"], column["type"]
+        groups = list(iter_column(path, name, header))
+        if kind == "int64":
+            result[name] = np.concatenate(groups).astype(np.int64) if groups else np.empty(0, np.int64)
+        elif kind == "dict":
+            dictionary = np.array(read_dictionary(path, name, header), dtype=object)
+            codes = np.concatenate(groups).astype(np.uint32) if groups else np.empty(0, np.uint32)
+            result[name] = dictionary[codes] if decode else (codes, dictionary)
+        else:
+            result[name] = np.array([value for g in groups for value in g], dtype=object)
+
+    result["created_at"] = result["created_at"].astype("datetime64[us]")
+    return result
@@ -0,0 +1,229 @@
+import json
+import platform
+import random
+import subprocess
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import django
+
+# =====================
+# STUB DEL MEASUREMENT PROTOCOL
+# =====================
+class GA4StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+
+        if server.latency:
+            time.sleep(max(0.0, random.gauss(server.latency, server.jitter)))
+
+        if server.error_rate and random.random() < server.error_rate:
+            status = 500
+        elif not self.path.split("?")[0].endswith("/mp/collect"):
+            status = 404
+        else:
+            status = 204
+            try:
+                events = len(json.loads(body).get("events", ()))
+            except (ValueError, AttributeError):
+                status = 400
+                events = 0
+            with server.lock:
+                server.requests += 1
+                server.events += events
+
+        with server.lock:
+            server.statuses[status] = server.statuses.get(status, 0) + 1
+
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class GA4StubServer(ThreadingHTTPServer):
+    """
+    Imita /mp/collect: responde 204 tras `latency` segundos (± jitter) y un
+    500 con probabilidad `error_rate`. Cuenta requests y eventos recibidos.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0):
+        super().__init__((host, port), GA4StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.events = 0
+        self.statuses = {}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/mp/collect"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="ga4-stub", daemon=True)
+        thread.start()
+        return self
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "events": self.events,
+                "statuses": {str(k): v for k, v in self.statuses.items()},
+            }
+
+
+# =====================
+# TRÁFICO DE DATALAYER
+# =====================
+PATHS = ("/", "/planes", "/planes/postpago", "/tienda/celulares", "/checkout", "/ayuda")
+ITEMS = [
+    {"item_id": f"SKU-{i}", "item_name": f"Equipo {i}", "price": 100 + i * 10, "quantity": 1}
+    for i in range(20)
+]
+
+
+def _event(aid, name, path, **params):
+    return {"aid": aid, "event": name, "path": path, "params": params}
+
+
+def session_pageview(rng, aid):
+    path = rng.choice(PATHS)
+    events = [_event(aid, "page_view", path)]
+    for percent in (25, 50, 75, 100)[:rng.randint(0, 4)]:
+        events.append(_event(aid, "scroll_depth", path, percent=percent))
+    for _ in range(rng.randint(0, 3)):
+        events.append(_event(aid, "click", path, tag="a", id=None, text="Ver más"))
+    events.append(_event(aid, "visibility_change", path, state="hidden"))
+    return events
+
+
+def session_ecommerce(rng, aid):
+    path = "/tienda/celulares"
+    items = rng.sample(ITEMS, rng.randint(1, 4))
+    events = [
+        _event(aid, "page_view", path),
+        _event(aid, "view_item_list", path, ecommerce={"items": items}),
+        _event(aid, "view_item", path, ecommerce={"items": items[:1]}),
+    ]
+    if rng.random() < 0.4:
+        events.append(_event(aid, "add_to_cart", path, ecommerce={"items": items[:1]}))
+    if rng.random() < 0.1:
+        events.append(_event(aid, "purchase", "/checkout", ecommerce={
+            "transaction_id": uuid.uuid4().hex[:12], "value": 1000, "items": items[:1],
+        }))
+    return events
+
+
+def session_burst(rng, aid):
+    path = rng.choice(PATHS)
+    events = [_event(aid, "page_view", path)]
+    for _ in range(rng.randint(5, 30)):
+        events.append(_event(aid, "keydown", path, key="a", code="KeyA", count=rng.randint(1, 20)))
+    return events
+
+
+SHAPES = {
+    "pageview": session_pageview,
+    "ecommerce": session_ecommerce,
+    "burst": session_burst,
+}
+# Mezcla aproximada del tráfico real
+DEFAULT_MIX = {"pageview": 0.7, "ecommerce": 0.2, "burst": 0.1}
+
+
+def traffic(seed=1, mix=None, aids=1000):
+    """
+    Generador infinito de eventos (dict) sesión por sesión. Cada evento
+    lleva un ts distinto (como cada ítem del dataLayer en el navegador),
+    así la deduplicación del ingest no descarta clicks repetidos.
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    names, weights = zip(*mix.items())
+    pool = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(aids)]
+    ts = int(time.time() * 1000)
+    while True:
+        shape = SHAPES[rng.choices(names, weights)[0]]
+        for event in shape(rng, rng.choice(pool)):
+            ts += rng.randint(1, 50)
+            event["ts"] = ts
+            yield event
+
+
+# =====================
+# RESULTADOS
+# =====================
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def latency_summary(seconds):
+    values = sorted(seconds)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "count": len(values),
+        "p50_ms": ms(percentile(values, 50)),
+        "p90_ms": ms(percentile(values, 90)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(values[-1] if values else None),
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "platform": platform.platform(),
+        "timestamp": int(time.time()),
+    }
+
+
+def write_results(path, results):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def compare(baseline, current, tolerance=0.1):
+    """
+    Compara dos resultados: menos eventos/s o más p99 que el baseline
+    (más allá de `tolerance`) cuenta como regresión.
+    Devuelve [(nombre, métrica, antes, ahora)].
+    """
+    regressions = []
+    for name, result in current.get("benchmarks", {}).items():
+        before = baseline.get("benchmarks", {}).get(name)
+        if not before:
+            continue
+        if before.get("events_per_sec") and result.get("events_per_sec") is not None:
+            if result["events_per_sec"] < before["events_per_sec"] * (1 - tolerance):
+                regressions.append((name, "events_per_sec", before["events_per_sec"], result["events_per_sec"]))
+        before_p99 = (before.get("latency") or {}).get("p99_ms")
+        p99 = (result.get("latency") or {}).get("p99_ms")
+        if before_p99 and p99 is not None and p99 > before_p99 * (1 + tolerance):
+            regressions.append((name, "p99_ms", before_p99, p99))
+    return regressions
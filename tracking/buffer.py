@@ -0,0 +1,270 @@
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import metrics
+from .models import Event
+from .stamps import state_dir
+from .storage import write_events
+
+logger = logging.getLogger(__name__)
+
+SPOOL_FIELDS = (
+    "aid", "event", "path", "user_agent",
+    "utm_source", "utm_medium", "utm_campaign",
+)
+
+
+def event_to_record(event):
+    record = {field: getattr(event, field) for field in SPOOL_FIELDS}
+    record["created_at"] = event.created_at.isoformat()
+    return record
+
+
+def record_to_event(record):
+    record = dict(record)
+    record["created_at"] = datetime.fromisoformat(record["created_at"])
+    return Event(**record)
+
+
+# =====================
+# SPOOL LOCAL
+# =====================
+def spool_dir():
+    # EVENT_SPOOL_DIR: debe sobrevivir a un reinicio (lo exige la
+    # configuración al activar el write-behind)
+    directory = getattr(settings, "EVENT_SPOOL_DIR", None)
+    if not directory:
+        return state_dir("spool")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _read_spool(handle):
+    handle.seek(0)
+    events = []
+    for line in handle:
+        try:
+            events.append(record_to_event(json.loads(line)))
+        except (ValueError, TypeError):
+            # Última línea cortada por un crash: se ignora
+            continue
+    return events
+
+
+def replay_orphan_spools():
+    """
+    Guarda en la base de datos los spools que dejó un proceso muerto o un
+    flush fallido. Un spool con flock tomado pertenece a un proceso vivo.
+    """
+    directory = spool_dir()
+    replayed = 0
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith((".spool", ".flushing")):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            handle = open(path, "r+", encoding="utf-8")
+        except FileNotFoundError:
+            continue
+        with handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            if not os.path.exists(path):
+                continue  # otro worker lo reprocesó mientras tanto
+            events = _read_spool(handle)
+            if events:
+                write_events(events)
+            os.unlink(path)
+            replayed += len(events)
+
+    if replayed:
+        metrics.inc("events_replayed_total", replayed)
+        logger.warning("♻️ Spool reprocesado: %s eventos", replayed)
+    return replayed
+
+
+# =====================
+# BUFFER WRITE-BEHIND
+# =====================
+class EventBuffer:
+    """
+    Buffer en memoria por proceso, respaldado por un spool append-only.
+
+    add() solo escribe una línea por evento al spool y vuelve. Un hilo
+    vacía el buffer con bulk_create al llegar a `max_events` o cada
+    `max_delay` segundos; tras confirmar, el spool de ese lote se borra.
+    """
+
+    def __init__(self, max_events=500, max_delay=1.0, fsync=False, replay_interval=30):
+        self.max_events = max_events
+        self.max_delay = max_delay
+        self.fsync = fsync
+        self.replay_interval = replay_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._pending = []
+        self._spool = None
+        self._spool_path = None
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_events=getattr(settings, "EVENT_BUFFER_MAX_EVENTS", 500),
+            max_delay=getattr(settings, "EVENT_BUFFER_MAX_DELAY", 1.0),
+            fsync=getattr(settings, "EVENT_SPOOL_FSYNC", False),
+            replay_interval=getattr(settings, "EVENT_SPOOL_REPLAY_INTERVAL", 30),
+        )
+
+    def _open_spool(self):
+        path = os.path.join(
+            spool_dir(), f"events-{os.getpid()}-{uuid.uuid4().hex[:8]}.spool"
+        )
+        handle = open(path, "a+", encoding="utf-8")
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._spool, self._spool_path = handle, path
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pending = []
+            self._open_spool()
+            threading.Thread(target=self._run, name="event-buffer", daemon=True).start()
+            self._pid = os.getpid()
+
+    def depth(self):
+        return len(self._pending)
+
+    def add(self, events):
+        if not events:
+            return
+        self._ensure_started()
+        lines = "".join(
+            json.dumps(event_to_record(event), separators=(",", ":")) + "\n"
+            for event in events
+        )
+        with self._lock:
+            self._spool.write(lines)
+            self._spool.flush()
+            if self.fsync:
+                os.fsync(self._spool.fileno())
+            self._pending.extend(events)
+            full = len(self._pending) >= self.max_events
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Vacía el buffer en la base de datos. Devuelve cuántos eventos guardó.
+        """
+        if self._pid != os.getpid():
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                events, self._pending = self._pending, []
+                spool, spool_path = self._spool, self._spool_path
+                flushing_path = spool_path[:-len(".spool")] + ".flushing"
+                os.replace(spool_path, flushing_path)
+                self._open_spool()
+
+            start = time.perf_counter()
+            try:
+                write_events(events)
+            except Exception:
+                # El spool queda huérfano y se reintenta con replay
+                metrics.inc("event_flush_errors_total")
+                logger.exception("❌ Error guardando lote de %s eventos", len(events))
+                spool.close()
+                return 0
+            finally:
+                metrics.observe("event_flush_seconds", time.perf_counter() - start)
+
+            os.unlink(flushing_path)
+            spool.close()
+            metrics.inc("events_flushed_total", len(events))
+            return len(events)
+
+    def close(self):
+        """
+        Flush final al apagar el proceso. El spool vacío se borra; si el
+        flush falló queda para replay.
+        """
+        if self._pid != os.getpid():
+            return
+        self.flush()
+        with self._lock:
+            if not self._pending and self._spool is not None:
+                os.unlink(self._spool_path)
+                self._spool.close()
+                self._spool = None
+                self._pid = None
+
+    def _run(self):
+        last_replay = None
+        while True:
+            self._wakeup.wait(self.max_delay)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                now = time.monotonic()
+                if last_replay is None or now - last_replay >= self.replay_interval:
+                    last_replay = now
+                    replay_orphan_spools()
+                self.flush()
+            except Exception:
+                logger.exception("❌ Error en el hilo del buffer de eventos")
+
+
+event_buffer = EventBuffer.from_settings()
+metrics.register_gauge("event_buffer_depth", event_buffer.depth)
+atexit.register(event_buffer.close)
+
+
+def persist_events(events):
+    """
+    Punto único de escritura del ingest: buffer write-behind o directo.
+    """
+    if getattr(settings, "EVENT_WRITE_BEHIND", False):
+        event_buffer.add(events)
+    else:
+        write_events(events)
+
+
+async def apersist_events(events):
+    """
+    persist_events() para vistas async. Con write-behind solo se agrega al
+    buffer; en modo directo "orm" se usa abulk_create y el resto (event log,
+    rollups en el ingest) corre en un hilo.
+    """
+    if not events:
+        return
+    if getattr(settings, "EVENT_WRITE_BEHIND", False):
+        event_buffer.add(events)
+    elif (
+        getattr(settings, "TRACKING_EVENT_STORAGE", "orm") == "orm"
+        and getattr(settings, "EVENT_ROLLUPS", "job") != "ingest"
+    ):
+        await Event.objects.abulk_create(
+            events, batch_size=getattr(settings, "EVENT_BULK_BATCH_SIZE", 500)
+        )
+    else:
+        await sync_to_async(write_events)(events)
@@ -0,0 +1,130 @@
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from .rules import tracking_rules_payload, tracking_rules_stamp
+from .stamps import MultiStamp, VersionStamp, VersionedCache
+
+try:
+    import brotli
+except ImportError:  # está en requirements.txt; sin él solo gzip (aviso tracking.W001)
+    brotli = None
+
+
+SOURCE_PATH = os.path.join(
+    settings.BASE_DIR, 'tracking', 'static', 'tracking', 'clarotrack.js'
+)
+
+# Cuántos bundles anteriores se siguen sirviendo tras un cambio de reglas,
+# para los loaders que todavía apuntan al hash viejo.
+KEEP_BUNDLES = 5
+
+Bundle = namedtuple("Bundle", ["hash", "body", "gzip", "br"])
+
+
+# =====================
+# BUNDLE clarotrack.js
+# =====================
+def build_bundle():
+    """
+    clarotrack.js con las TrackingRule activas incrustadas, direccionado
+    por hash de contenido y precomprimido en memoria.
+    """
+    with open(SOURCE_PATH, 'rb') as f:
+        source = f.read()
+
+    rules_body, _ = tracking_rules_payload.get()
+    body = b"window.__CLAROTRACK_RULES__ = " + rules_body + b";\n" + source
+
+    digest = hashlib.sha256(body).hexdigest()[:16]
+    bundle = Bundle(
+        hash=digest,
+        body=body,
+        gzip=gzip.compress(body, compresslevel=9, mtime=0),
+        br=brotli.compress(body, quality=11) if brotli else None,
+    )
+
+    with _history_lock:
+        _history[digest] = bundle
+        _history.move_to_end(digest)
+        while len(_history) > KEEP_BUNDLES:
+            _history.popitem(last=False)
+    return bundle
+
+
+_history = OrderedDict()
+_history_lock = threading.Lock()
+
+source_stamp = VersionStamp("clarotrack_source", path=SOURCE_PATH)
+current_bundle = VersionedCache(
+    MultiStamp(tracking_rules_stamp, source_stamp), build_bundle
+)
+
+
+def get_bundle(digest):
+    """
+    Bundle para un hash ya publicado, o None si ya no está en memoria.
+    """
+    current = current_bundle.get()
+    if digest == current.hash:
+        return current
+    return _history.get(digest)
+
+
+def loader_script(digest):
+    """
+    Loader mínimo que carga el bundle versionado relativo a su propia URL.
+    """
+    return (
+        "(function(){var s=document.currentScript,"
+        "e=document.createElement('script');"
+        f"e.src=new URL('clarotrack.{digest}.js',s&&s.src||location.href).href;"
+        "e.async=true;(document.head||document.documentElement).appendChild(e);})();\n"
+    ).encode()
+
+
+# =====================
+# NEGOCIACIÓN DE Content-Encoding
+# =====================
+def accepted_encodings(header):
+    """
+    Accept-Encoding → {codificación: q}. "br;q=0" significa que el
+    cliente NO acepta br; un q inválido cuenta como 0.
+    """
+    accepted = {}
+    for part in (header or "").split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value.strip())
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def negotiate(bundle, header):
+    """
+    (body, Content-Encoding) del bundle según Accept-Encoding: br, gzip o
+    sin comprimir (encoding None). Entre br y gzip gana el de mayor q.
+    """
+    accepted = accepted_encodings(header)
+    wildcard = accepted.get("*", 0.0)
+    options = []
+    if bundle.br is not None:
+        options.append((accepted.get("br", wildcard), bundle.br, "br"))
+    options.append((accepted.get("gzip", wildcard), bundle.gzip, "gzip"))
+    q, body, encoding = max(options, key=lambda option: option[0])
+    if q <= 0:
+        return bundle.body, None
+    return body, encoding
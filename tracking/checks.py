@@ -0,0 +1,21 @@
+from django.core.checks import Warning, register
+
+
+# =====================
+# CHEQUEOS DE ARRANQUE
+# =====================
+@register()
+def check_brotli(app_configs, **kwargs):
+    """
+    Sin el módulo brotli el bundle se sirve solo en gzip: se avisa en
+    `manage.py check` / runserver en vez de degradar en silencio.
+    """
+    from .bundle import brotli
+
+    if brotli is not None:
+        return []
+    return [Warning(
+        "El módulo brotli no está instalado: clarotrack.js se sirve solo con gzip.",
+        hint="Instala brotli (está en requirements.txt).",
+        id="tracking.W001",
+    )]
@@ -0,0 +1,96 @@
+import hashlib
+import json
+
+from django.conf import settings
+
+from . import metrics
+from .shm import RotatingBloomFilter
+
+# =====================
+# IDEMPOTENCIA DEL INGEST
+# =====================
+# clarotrack.js reenvía el dataLayer existente al iniciar y las redes
+# móviles reintentan fetch: el mismo evento puede llegar varias veces.
+# Cada evento con aid y ts lleva una clave sha1(aid|event|ts|hash del
+# payload) que se busca en un bloom filter rotativo compartido por todos
+# los workers; los repetidos se descartan antes de guardar y de las reglas.
+# La clave se registra recién cuando el evento se guardó (remember()): un
+# evento rechazado por límites o que no llegó a guardarse se puede
+# reintentar. Dos copias simultáneas en workers distintos pueden pasar
+# las dos; los reintentos del cliente llegan después.
+
+DUPLICATE = "duplicate"
+
+_filter = None
+
+
+def enabled():
+    return getattr(settings, "EVENT_DEDUPE", True)
+
+
+def get_filter():
+    global _filter
+    if _filter is None:
+        _filter = RotatingBloomFilter(
+            "dedupe",
+            capacity=getattr(settings, "EVENT_DEDUPE_CAPACITY", 1_000_000),
+            error_rate=getattr(settings, "EVENT_DEDUPE_ERROR_RATE", 0.001),
+            window=getattr(settings, "EVENT_DEDUPE_WINDOW_SECONDS", 900),
+        )
+    return _filter
+
+
+def _payload(data):
+    # Mismo hash sin importar cómo llegó el ítem: el reenvío inicial manda
+    # los params limpios y el push interceptado el ítem completo
+    params = data.get("params", data)
+    if not isinstance(params, dict):
+        return params
+    if isinstance(params.get("params"), dict):
+        params = params["params"]
+    return {key: value for key, value in params.items() if key not in ("event", "ts")}
+
+
+def idempotency_key(data):
+    """
+    Digest sha1 del evento, o None si no trae aid y ts (sin ts dos eventos
+    iguales legítimos serían indistinguibles).
+    """
+    aid = data.get("aid")
+    ts = data.get("ts")
+    if not aid or ts is None:
+        return None
+    payload = json.dumps(
+        _payload(data), sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    payload_hash = hashlib.sha1(payload.encode("utf-8")).hexdigest()
+    return hashlib.sha1(f"{aid}|{data.get('event')}|{ts}|{payload_hash}".encode("utf-8")).digest()
+
+
+def drop_duplicates(pairs):
+    """
+    Separa los (Event, data) ya vistos. Devuelve (pares nuevos, lista de
+    bool "duplicado" alineada con `pairs`). No registra las claves.
+    """
+    if not pairs or not enabled():
+        return pairs, [False] * len(pairs)
+
+    keys = [idempotency_key(data) for _, data in pairs]
+    digests = [key for key in keys if key is not None]
+    seen = iter(get_filter().contains_many(digests))
+    duplicates = [key is not None and next(seen) for key in keys]
+
+    dropped = sum(duplicates)
+    if dropped:
+        metrics.inc("events_duplicate_total", dropped)
+    return [pair for pair, duplicate in zip(pairs, duplicates) if not duplicate], duplicates
+
+
+def remember(pairs):
+    """
+    Registra las claves de los (Event, data) ya aceptados.
+    """
+    if not pairs or not enabled():
+        return
+    digests = [key for key in (idempotency_key(data) for _, data in pairs) if key is not None]
+    get_filter().add_many(digests)
@@ -0,0 +1,367 @@
+import bisect
+import contextlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+
+from .stamps import state_dir
+
+# Registro: [u32 largo][u64 ts_ms][u8 largo nombre][nombre][JSON]
+# El largo cubre todo lo que sigue al propio u32.
+RECORD_HEADER = struct.Struct("<IQB")
+# Índice disperso: [u64 ts_ms máximo visto hasta aquí][u64 offset]
+INDEX_ENTRY = struct.Struct("<QQ")
+
+OPEN_SUFFIX = ".seg.open"
+SEALED_SUFFIX = ".seg"
+
+
+def log_dir():
+    return getattr(settings, "EVENT_LOG_DIR", None) or state_dir("eventlog")
+
+
+def to_ms(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    return int(value)
+
+
+def from_ms(ts_ms):
+    return datetime.fromtimestamp(ts_ms / 1000, tz=dt_timezone.utc)
+
+
+# =====================
+# ESCRITURA
+# =====================
+class SegmentWriter:
+    """
+    Escribe eventos en segmentos append-only que rotan por tamaño o edad.
+
+    Cada proceso escribe sus propios segmentos (el pid va en el nombre).
+    Al rotar, el segmento se renombra con su rango de tiempo
+    `<min_ts_ms>-<max_ts_ms>-<pid>-<seq>.seg` para que los lectores puedan
+    descartarlo sin abrirlo (los ts no llegan ordenados: el rango es el de
+    todos los registros, no el del primero y el último).
+    """
+
+    def __init__(self, directory=None, max_bytes=64 * 1024 * 1024,
+                 max_seconds=3600, index_every=256):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.index_every = index_every
+        self._lock = threading.Lock()
+        self._pid = None
+        self._seq = 0
+        self._data = None
+        self._index = None
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_bytes=getattr(settings, "EVENT_LOG_SEGMENT_MAX_BYTES", 64 * 1024 * 1024),
+            max_seconds=getattr(settings, "EVENT_LOG_SEGMENT_MAX_SECONDS", 3600),
+            index_every=getattr(settings, "EVENT_LOG_INDEX_EVERY", 256),
+        )
+
+    def _open(self, first_ts):
+        directory = self.directory or log_dir()
+        os.makedirs(directory, exist_ok=True)
+        self._seq += 1
+        base = os.path.join(directory, f"{first_ts}-open-{os.getpid()}-{self._seq}")
+        self._base = base
+        self._data = open(base + OPEN_SUFFIX, "ab")
+        self._index = open(base + ".idx.open", "ab")
+        self._min_ts = first_ts
+        self._max_ts = first_ts
+        self._opened_at = time.monotonic()
+        self._count = 0
+        self._size = 0
+
+    def _seal(self):
+        if self._data is None:
+            return
+        self._data.close()
+        self._index.close()
+        directory = os.path.dirname(self._base)
+        sealed = os.path.join(
+            directory, f"{self._min_ts}-{self._max_ts}-{os.getpid()}-{self._seq}"
+        )
+        if self._count:
+            os.replace(self._base + OPEN_SUFFIX, sealed + SEALED_SUFFIX)
+            os.replace(self._base + ".idx.open", sealed + ".idx")
+        else:
+            os.unlink(self._base + OPEN_SUFFIX)
+            os.unlink(self._base + ".idx.open")
+        self._data = self._index = None
+
+    def _should_rotate(self):
+        return (
+            self._size >= self.max_bytes
+            or time.monotonic() - self._opened_at >= self.max_seconds
+        )
+
+    def append(self, records):
+        """
+        records: iterable de (ts_ms, nombre_evento, dict).
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # Tras un fork no se comparte el archivo del padre
+                self._data = self._index = None
+                self._seq = 0
+                self._pid = os.getpid()
+                # Segmentos abiertos que dejaron procesos muertos (o uno
+                # anterior con este mismo pid, p. ej. tras reiniciar el
+                # contenedor)
+                recover_open_segments(self.directory or log_dir(), stale_pids={self._pid})
+
+            for ts_ms, name, payload in records:
+                if self._data is None:
+                    self._open(ts_ms)
+                elif self._should_rotate():
+                    self._seal()
+                    self._open(ts_ms)
+
+                name_bytes = name.encode("utf-8")[:255].decode("utf-8", "ignore").encode("utf-8")
+                body = json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8")
+                length = RECORD_HEADER.size - 4 + len(name_bytes) + len(body)
+                self._min_ts = min(self._min_ts, ts_ms)
+                self._max_ts = max(self._max_ts, ts_ms)
+                if self._count % self.index_every == 0:
+                    self._index.write(INDEX_ENTRY.pack(self._max_ts, self._size))
+                self._data.write(RECORD_HEADER.pack(length, ts_ms, len(name_bytes)))
+                self._data.write(name_bytes)
+                self._data.write(body)
+                self._size += 4 + length
+                self._count += 1
+
+            if self._data is not None:
+                self._data.flush()
+                self._index.flush()
+
+    def close(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                self._seal()
+
+
+# =====================
+# LECTURA (mmap)
+# =====================
+class Segment:
+    def __init__(self, path):
+        self.path = path
+        name = os.path.basename(path)
+        self.sealed = name.endswith(SEALED_SUFFIX) and not name.endswith(OPEN_SUFFIX)
+        parts = name.split(".")[0].split("-")
+        # Abierto: "<ts del primer registro>-open-<pid>-<seq>"; su rango
+        # real se conoce recién al sellarlo
+        self.first_ts = int(parts[0])
+        self.min_ts = int(parts[0]) if self.sealed else None
+        self.last_ts = int(parts[1]) if self.sealed else None
+        self.pid = int(parts[2])
+
+    @property
+    def index_path(self):
+        if self.sealed:
+            return self.path[:-len(SEALED_SUFFIX)] + ".idx"
+        return self.path[:-len(OPEN_SUFFIX)] + ".idx.open"
+
+    def overlaps(self, start_ms, end_ms):
+        if end_ms is not None and self.min_ts is not None and self.min_ts > end_ms:
+            return False
+        if start_ms is not None and self.last_ts is not None and self.last_ts < start_ms:
+            return False
+        return True
+
+    def _start_offset(self, start_ms):
+        # Primera entrada cuyo máximo acumulado alcanza start_ms: todo lo
+        # anterior a la entrada previa es seguro más viejo.
+        if start_ms is None:
+            return 0
+        try:
+            with open(self.index_path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return 0
+        count = len(raw) // INDEX_ENTRY.size
+        maxima = [INDEX_ENTRY.unpack_from(raw, i * INDEX_ENTRY.size) for i in range(count)]
+        pos = bisect.bisect_left([m for m, _ in maxima], start_ms)
+        if pos == 0:
+            return 0
+        return maxima[pos - 1][1]
+
+    def records(self):
+        """
+        Itera (offset, fin, ts_ms, largo del nombre) de los registros
+        completos.
+        """
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offset = 0
+                while offset + RECORD_HEADER.size <= size:
+                    length, ts_ms, name_len = RECORD_HEADER.unpack_from(mm, offset)
+                    end = offset + 4 + length
+                    if end > size:
+                        break
+                    yield offset, end, ts_ms, name_len
+                    offset = end
+
+    def seal(self):
+        """
+        Sella un segmento abierto huérfano: descarta el registro a medio
+        escribir y lo renombra con su rango real. Devuelve el Segment
+        sellado, o None si estaba vacío (se borra) o ya lo selló otro.
+        """
+        count = 0
+        valid_end = 0
+        min_ts = max_ts = None
+        try:
+            for _, end, ts_ms, _ in self.records():
+                count += 1
+                valid_end = end
+                min_ts = ts_ms if min_ts is None else min(min_ts, ts_ms)
+                max_ts = ts_ms if max_ts is None else max(max_ts, ts_ms)
+        except FileNotFoundError:
+            return None
+
+        index_path = self.index_path
+        try:
+            if not count:
+                os.unlink(self.path)
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(index_path)
+                return None
+            os.truncate(self.path, valid_end)
+            name = os.path.basename(self.path)[:-len(OPEN_SUFFIX)].split("-")
+            sealed = os.path.join(
+                os.path.dirname(self.path), f"{min_ts}-{max_ts}-{name[2]}-{name[3]}"
+            )
+            with contextlib.suppress(FileNotFoundError):
+                os.replace(index_path, sealed + ".idx")
+            os.replace(self.path, sealed + SEALED_SUFFIX)
+        except FileNotFoundError:
+            return None
+        return Segment(sealed + SEALED_SUFFIX)
+
+    def scan(self, start_ms=None, end_ms=None, event=None):
+        """
+        Itera (ts_ms, nombre, dict) sin pasar por el ORM. El JSON solo se
+        decodifica para los registros que cumplen el filtro.
+        """
+        event_bytes = event.encode("utf-8") if event is not None else None
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offset = self._start_offset(start_ms)
+                header = RECORD_HEADER.size
+                while offset + header <= size:
+                    length, ts_ms, name_len = RECORD_HEADER.unpack_from(mm, offset)
+                    end = offset + 4 + length
+                    if end > size:
+                        break  # registro a medio escribir
+                    name_start = offset + header
+                    body_start = name_start + name_len
+                    offset = end
+                    if start_ms is not None and ts_ms < start_ms:
+                        continue
+                    if end_ms is not None and ts_ms > end_ms:
+                        continue
+                    if event_bytes is not None and mm[name_start:body_start] != event_bytes:
+                        continue
+                    yield (
+                        ts_ms,
+                        mm[name_start:body_start].decode("utf-8"),
+                        json.loads(mm[body_start:end]),
+                    )
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def recover_open_segments(directory, stale_pids=()):
+    """
+    Sella los segmentos abiertos de procesos que ya no existen (o cuyo pid
+    está en `stale_pids`). Sin esto quedarían abiertos para siempre: se
+    leen completos en cada consulta y la retención no los borra.
+    Devuelve la cantidad de segmentos recuperados.
+    """
+    if not os.path.isdir(directory):
+        return 0
+    recovered = 0
+    for name in os.listdir(directory):
+        if not name.endswith(OPEN_SUFFIX):
+            continue
+        segment = Segment(os.path.join(directory, name))
+        if segment.pid in stale_pids or not _alive(segment.pid):
+            segment.seal()
+            recovered += 1
+    return recovered
+
+
+class EventLogReader:
+    """
+    Lector de los segmentos del event log, por rango de tiempo y/o evento.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or log_dir()
+
+    def segments(self, start=None, end=None):
+        start_ms, end_ms = to_ms(start), to_ms(end)
+        if not os.path.isdir(self.directory):
+            return []
+        found = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SEALED_SUFFIX) or name.endswith(OPEN_SUFFIX):
+                segment = Segment(os.path.join(self.directory, name))
+                if segment.overlaps(start_ms, end_ms):
+                    found.append(segment)
+        return sorted(found, key=lambda s: s.first_ts if s.min_ts is None else s.min_ts)
+
+    def scan(self, start=None, end=None, event=None):
+        start_ms, end_ms = to_ms(start), to_ms(end)
+        for segment in self.segments(start, end):
+            yield from segment.scan(start_ms, end_ms, event)
+
+    def count(self, start=None, end=None, event=None):
+        return sum(1 for _ in self.scan(start, end, event))
+
+    def drop_before(self, cutoff):
+        """
+        Borra los segmentos sellados que terminan antes de `cutoff`.
+        Cada borrado es O(1): no se reescribe nada.
+        """
+        cutoff_ms = to_ms(cutoff)
+        recover_open_segments(self.directory)
+        dropped = 0
+        for segment in self.segments():
+            if segment.sealed and segment.last_ts < cutoff_ms:
+                os.unlink(segment.path)
+                try:
+                    os.unlink(segment.index_path)
+                except FileNotFoundError:
+                    pass
+                dropped += 1
+        return dropped
@@ -0,0 +1,467 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+import weakref
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # solo lo necesita el pipeline async (ASGI)
+    httpx = None
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+GA4_COLLECT_URL = "https://www.google-analytics.com/mp/collect"
+
+
+def collect_url():
+    # Configurable para apuntar al stub local (manage.py ga4_stub)
+    return getattr(settings, "GA4_COLLECT_URL", None) or GA4_COLLECT_URL
+
+
+def build_payload(client_id, events):
+    # Asegurar que client_id sea string válido
+    if not client_id or client_id == "anonymous":
+        client_id = str(uuid.uuid4())
+
+    return {
+        "client_id": str(client_id),  # Forzar string
+        "events": [
+            {"name": name, "params": params or {}}
+            for name, params in events
+        ]
+    }
+
+
+def coalesce_key(client_id):
+    """
+    Clave para agrupar eventos por client_id (siempre texto: 123 y "123"
+    son el mismo cliente). Los anónimos reciben una clave única: no se
+    mezclan y build_payload les asigna un client_id aleatorio.
+    """
+    if not client_id or client_id == "anonymous":
+        return object()
+    return str(client_id)
+
+
+def split_payloads(client_id, events, max_events=25, max_bytes=130000):
+    """
+    Agrupa eventos de un mismo client_id en payloads que respetan los
+    límites del Measurement Protocol (25 eventos y ~130 kB por POST).
+    Devuelve ([(cuerpo JSON en bytes, nº de eventos)], descartados por tamaño).
+    """
+    payload = build_payload(client_id, [])
+    head = json.dumps(payload, separators=(",", ":"))[:-2]  # sin "]}"
+    overhead = len(head.encode()) + 2
+
+    bodies = []
+    dropped = 0
+    chunk, size = [], overhead
+    for name, params in events:
+        encoded = json.dumps(
+            {"name": name, "params": params or {}},
+            separators=(",", ":"),
+            default=str,
+        )
+        item_size = len(encoded.encode()) + 1
+        if overhead + item_size > max_bytes:
+            dropped += 1
+            continue
+        if chunk and (len(chunk) >= max_events or size + item_size > max_bytes):
+            bodies.append(((head + ",".join(chunk) + "]}").encode(), len(chunk)))
+            chunk, size = [], overhead
+        chunk.append(encoded)
+        size += item_size
+    if chunk:
+        bodies.append(((head + ",".join(chunk) + "]}").encode(), len(chunk)))
+    return bodies, dropped
+
+
+# =====================
+# DISPATCHER GA4
+# =====================
+class GA4Dispatcher:
+    """
+    Envía eventos al Measurement Protocol en segundo plano.
+
+    El request solo encola en una cola acotada. Un hilo coalescedor agrupa
+    los eventos por client_id durante una ventana corta (o hasta llenar un
+    payload) y un grupo de hilos envía los payloads multi-evento usando una
+    sesión HTTP por proceso con pool de conexiones.
+    """
+
+    def __init__(self, workers=4, queue_size=10000, pool_size=8, timeout=5,
+                 coalesce_window=0.25, max_events=25, max_bytes=130000):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.coalesce_window = coalesce_window
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._send_queue = None
+        self._session = None
+        self._threads = []
+        self._pending = 0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            workers=getattr(settings, "GA4_DISPATCH_WORKERS", 4),
+            queue_size=getattr(settings, "GA4_DISPATCH_QUEUE_SIZE", 10000),
+            pool_size=getattr(settings, "GA4_HTTP_POOL_SIZE", 8),
+            timeout=getattr(settings, "GA4_HTTP_TIMEOUT", 5),
+            coalesce_window=getattr(settings, "GA4_COALESCE_WINDOW_MS", 250) / 1000,
+            max_events=getattr(settings, "GA4_MAX_EVENTS_PER_REQUEST", 25),
+            max_bytes=getattr(settings, "GA4_MAX_PAYLOAD_BYTES", 130000),
+        )
+
+    def _ensure_started(self):
+        # Gunicorn hace fork después de importar: los hilos y el pool se
+        # crean en cada worker, la primera vez que se usan.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+
+            self._session = session
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._send_queue = queue.Queue(maxsize=self.workers * 4)
+            self._pending = 0
+            self._threads = [
+                threading.Thread(target=self._coalescer, name="ga4-coalesce", daemon=True)
+            ]
+            for i in range(self.workers):
+                self._threads.append(threading.Thread(
+                    target=self._worker, name=f"ga4-dispatch-{i}", daemon=True
+                ))
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _done(self, count):
+        with self._lock:
+            self._pending -= count
+
+    def enqueue(self, event_name, client_id, params=None):
+        """
+        Encola un evento para GA4. Devuelve False si se descartó.
+        """
+        if not settings.GA4_MEASUREMENT_ID or not settings.GA4_API_SECRET:
+            metrics.inc("ga4_dropped_total", reason="no_credentials")
+            logger.error("❌ Credenciales GA4 NO configuradas")
+            return False
+
+        self._ensure_started()
+        with self._lock:
+            self._pending += 1
+        try:
+            self._queue.put_nowait((client_id, event_name, params))
+        except queue.Full:
+            self._done(1)
+            metrics.inc("ga4_dropped_total", reason="queue_full")
+            logger.warning("⚠️ Cola GA4 llena, evento descartado: %s", event_name)
+            return False
+
+        metrics.inc("ga4_enqueued_total")
+        return True
+
+    def _post(self, body):
+        start = time.perf_counter()
+        try:
+            response = self._session.post(
+                collect_url(),
+                params={
+                    "measurement_id": settings.GA4_MEASUREMENT_ID,
+                    "api_secret": settings.GA4_API_SECRET,
+                },
+                data=body,
+                headers={"Content-Type": "application/json"},
+                timeout=self.timeout
+            )
+        except Exception as e:
+            metrics.inc("ga4_send_errors_total")
+            logger.warning("❌ Error enviando a GA4: %s", e)
+            return 500
+        finally:
+            metrics.observe("ga4_send_seconds", time.perf_counter() - start)
+
+        metrics.inc("ga4_requests_total")
+        metrics.inc("ga4_responses_total", status=response.status_code)
+        # GA4 devuelve 204 si todo está OK (sin body)
+        if response.status_code != 204:
+            logger.warning(
+                "⚠️ GA4 status inesperado %s: %s", response.status_code, response.text
+            )
+        return response.status_code
+
+    def _split(self, client_id, events):
+        bodies, dropped = split_payloads(
+            client_id, events, self.max_events, self.max_bytes
+        )
+        if dropped:
+            metrics.inc("ga4_dropped_total", dropped, reason="oversize")
+        return bodies, dropped
+
+    def send(self, client_id, events):
+        """
+        POST síncrono al Measurement Protocol (sin coalescer).
+        Devuelve el último status code.
+        """
+        self._ensure_started()
+        status = 204
+        for body, _ in self._split(client_id, events)[0]:
+            status = self._post(body)
+        return status
+
+    def _flush_bucket(self, client_id, events):
+        bodies, dropped = self._split(client_id, events)
+        if dropped:
+            self._done(dropped)
+        for body, count in bodies:
+            metrics.inc("ga4_events_sent_total", count)
+            self._send_queue.put((body, count))
+
+    def _coalescer(self):
+        q = self._queue
+        buckets = {}
+        deadlines = {}
+        while True:
+            timeout = None
+            if deadlines:
+                timeout = max(0.0, min(deadlines.values()) - time.monotonic())
+            try:
+                client_id, event_name, params = q.get(timeout=timeout)
+            except queue.Empty:
+                pass
+            else:
+                key = coalesce_key(client_id)
+                bucket = buckets.setdefault(key, [])
+                if not bucket:
+                    deadlines[key] = time.monotonic() + self.coalesce_window
+                bucket.append((event_name, params))
+                if len(bucket) >= self.max_events:
+                    deadlines[key] = 0
+
+            now = time.monotonic()
+            for key in [k for k, d in deadlines.items() if d <= now]:
+                del deadlines[key]
+                events = buckets.pop(key)
+                try:
+                    self._flush_bucket(key if isinstance(key, str) else None, events)
+                except Exception:
+                    self._done(len(events))
+                    logger.exception("❌ Error agrupando eventos GA4")
+
+    def _worker(self):
+        q = self._send_queue
+        while True:
+            body, count = q.get()
+            try:
+                self._post(body)
+            except Exception:
+                logger.exception("❌ Error en worker GA4")
+            finally:
+                self._done(count)
+
+    def drain(self, timeout=None):
+        """
+        Espera a que se envíe todo lo encolado (útil en comandos y al apagar).
+        """
+        if self._queue is None or self._pid != os.getpid():
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._pending > 0:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+# =====================
+# CLIENTE GA4 ASYNC (ASGI)
+# =====================
+class AsyncGA4Client:
+    """
+    Envío no bloqueante al Measurement Protocol para las vistas async.
+
+    Cada event loop tiene su propio httpx.AsyncClient (pool de conexiones)
+    y un semáforo que limita los POST simultáneos. Los envíos corren como
+    tareas del loop: la respuesta al navegador no espera a GA4.
+    """
+
+    def __init__(self, concurrency=100, pool_size=100, timeout=5,
+                 max_inflight=10000, max_events=25, max_bytes=130000):
+        self.concurrency = concurrency
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_inflight = max_inflight
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self._loops = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            concurrency=getattr(settings, "GA4_ASYNC_CONCURRENCY", 100),
+            pool_size=getattr(settings, "GA4_ASYNC_POOL_SIZE", 100),
+            timeout=getattr(settings, "GA4_HTTP_TIMEOUT", 5),
+            max_inflight=getattr(settings, "GA4_ASYNC_MAX_INFLIGHT", 10000),
+            max_events=getattr(settings, "GA4_MAX_EVENTS_PER_REQUEST", 25),
+            max_bytes=getattr(settings, "GA4_MAX_PAYLOAD_BYTES", 130000),
+        )
+
+    def _state(self):
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            if httpx is None:
+                raise RuntimeError("httpx no está instalado (requerido bajo ASGI)")
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                ),
+                timeout=self.timeout,
+            )
+            state = self._loops[loop] = {
+                "client": client,
+                "semaphore": asyncio.Semaphore(self.concurrency),
+                "tasks": set(),
+            }
+        return state
+
+    def inflight(self):
+        return sum(len(state["tasks"]) for state in list(self._loops.values()))
+
+    async def _post(self, body):
+        state = self._state()
+        async with state["semaphore"]:
+            start = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(
+                    state["client"].post(
+                        collect_url(),
+                        params={
+                            "measurement_id": settings.GA4_MEASUREMENT_ID,
+                            "api_secret": settings.GA4_API_SECRET,
+                        },
+                        content=body,
+                        headers={"Content-Type": "application/json"},
+                    ),
+                    self.timeout,
+                )
+            except Exception as e:
+                metrics.inc("ga4_send_errors_total")
+                logger.warning("❌ Error enviando a GA4 (async): %r", e)
+                return 500
+            finally:
+                metrics.observe("ga4_send_seconds", time.perf_counter() - start)
+
+        metrics.inc("ga4_requests_total")
+        metrics.inc("ga4_responses_total", status=response.status_code)
+        if response.status_code != 204:
+            logger.warning(
+                "⚠️ GA4 status inesperado %s: %s", response.status_code, response.text
+            )
+        return response.status_code
+
+    async def send(self, client_id, events):
+        """
+        POST de los eventos de un client_id; los payloads van en paralelo.
+        """
+        bodies, dropped = split_payloads(
+            client_id, events, self.max_events, self.max_bytes
+        )
+        if dropped:
+            metrics.inc("ga4_dropped_total", dropped, reason="oversize")
+        for _, count in bodies:
+            metrics.inc("ga4_events_sent_total", count)
+        statuses = await asyncio.gather(*(self._post(body) for body, _ in bodies))
+        return statuses[-1] if statuses else 204
+
+    async def fan_out(self, hits):
+        """
+        Envía (fire_event, client_id, params) agrupados por client_id, todos
+        los grupos a la vez.
+        """
+        groups = {}
+        for fire_event, client_id, params in hits:
+            key = coalesce_key(client_id)
+            groups.setdefault(key, []).append((fire_event, params))
+        results = await asyncio.gather(
+            *(
+                self.send(key if isinstance(key, str) else None, events)
+                for key, events in groups.items()
+            ),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.error("❌ Error en envío GA4 async: %r", result)
+        return results
+
+    def schedule(self, hits):
+        """
+        Lanza fan_out() en segundo plano. Devuelve False si se descartó.
+        """
+        if not hits:
+            return True
+        if not settings.GA4_MEASUREMENT_ID or not settings.GA4_API_SECRET:
+            metrics.inc("ga4_dropped_total", len(hits), reason="no_credentials")
+            logger.error("❌ Credenciales GA4 NO configuradas")
+            return False
+
+        state = self._state()
+        if len(state["tasks"]) >= self.max_inflight:
+            metrics.inc("ga4_dropped_total", len(hits), reason="queue_full")
+            logger.warning("⚠️ Envíos GA4 async saturados, %s eventos descartados", len(hits))
+            return False
+
+        metrics.inc("ga4_enqueued_total", len(hits))
+        task = asyncio.get_running_loop().create_task(self.fan_out(hits))
+        # Referencia fuerte hasta que termine (el loop solo guarda una débil)
+        state["tasks"].add(task)
+        task.add_done_callback(state["tasks"].discard)
+        return True
+
+
+dispatcher = GA4Dispatcher.from_settings()
+async_client = AsyncGA4Client.from_settings()
+metrics.register_gauge("ga4_queue_depth", dispatcher.queue_depth)
+metrics.register_gauge("ga4_async_inflight", async_client.inflight)
+atexit.register(dispatcher.drain, 2)
+
+
+def send_event_to_ga4(event_name, client_id, params=None):
+    """
+    Envío inmediato (bloqueante). El hot path debe usar enqueue_ga4_event.
+    """
+    return dispatcher.send(client_id, [(event_name, params)])
+
+
+def enqueue_ga4_event(event_name, client_id, params=None):
+    return dispatcher.enqueue(event_name, client_id, params)
@@ -0,0 +1,149 @@
+import json
+import uuid
+
+from .models import Event
+from .paths import ParamsMap, PathError, compile_params_map, compile_path
+from .rules import ga4_rules, parse_params_map
+
+
+# =====================
+# PARSEO DE EVENTOS
+# =====================
+def parse_batch_body(body):
+    """
+    Acepta un array JSON o NDJSON (un evento por línea).
+    Lanza ValueError si el cuerpo no es válido.
+    """
+    text = body.decode('utf-8') if isinstance(body, bytes) else body
+    text = text.strip()
+    if not text:
+        return []
+
+    if text.startswith('['):
+        items = json.loads(text)
+        if not isinstance(items, list):
+            raise ValueError("expected a JSON array")
+        return items
+
+    items = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line:
+            items.append(json.loads(line))
+    return items
+
+
+def build_event(data, user_agent=""):
+    """
+    Construye (sin guardar) un Event a partir del payload de clarotrack.js.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("event must be an object")
+
+    event_name = data.get("event")
+    if not event_name:
+        raise ValueError("missing event")
+
+    path = data.get("path") or data.get("page_location")
+    # aid/client_id pueden llegar como número: siempre se guarda texto
+    aid = data.get("aid") or data.get("client_id") or uuid.uuid4()
+
+    return Event(
+        aid=str(aid),
+        event=event_name,
+        path=path or "/",
+        user_agent=user_agent,
+    )
+
+
+def build_batch(items, user_agent=""):
+    """
+    Construye los Event de un lote. Devuelve (resultado por ítem, pares
+    (Event, data) válidos).
+    """
+    results = []
+    pairs = []
+    for index, data in enumerate(items):
+        try:
+            event = build_event(data, user_agent)
+        except ValueError as e:
+            results.append({"index": index, "status": "error", "error": str(e)})
+            continue
+        pairs.append((event, data))
+        results.append({"index": index, "status": "ok"})
+    return results, pairs
+
+
+# =====================
+# REGLAS GA4
+# =====================
+def get_value_by_path(data, path):
+    """
+    Lee valores anidados (ver tracking.paths): ecommerce.items,
+    ecommerce.items[0].item_id, items[*].price...
+    Compatibilidad: la ruta se compila una vez y queda en caché.
+    """
+    try:
+        return compile_path(path).get(data)
+    except PathError:
+        return None
+
+
+def rule_params_map(rule):
+    if isinstance(rule.params_map, ParamsMap):
+        return rule.params_map
+    return compile_params_map(parse_params_map(rule.params_map), strict=False)
+
+
+def event_params(data):
+    return data.get("params", data)
+
+
+def with_ga4_defaults(params, path):
+    # Campos mínimos GA4
+    params.update({
+        "page_location": path,
+        "engagement_time_msec": 1,
+        "debug_mode": True
+    })
+    return params
+
+
+def build_ga4_params(rule, data, path):
+    return with_ga4_defaults(rule_params_map(rule).evaluate(event_params(data)), path)
+
+
+def match_ga4_rules(pairs, index=None):
+    """
+    Evalúa las reglas GA4 activas para un lote de (Event, data) usando el
+    índice en memoria (un UrlMatcher por evento: una pasada sobre el path
+    sin importar cuántas reglas haya). Devuelve (fire_event, client_id,
+    params, sink) en el orden de los eventos; cada params_map se evalúa
+    una vez por lote.
+    """
+    if index is None:
+        index = ga4_rules.get()
+
+    # 1️⃣ Coincidencias por regla
+    slots = []
+    by_rule = {}
+    for event, data in pairs:
+        matcher = index.get(event.event)
+        if not matcher:
+            continue
+        for rule in matcher.match(event.path):
+            matched = by_rule.setdefault(rule.id, (rule, []))[1]
+            matched.append(len(slots))
+            slots.append((rule, event, data))
+
+    # 2️⃣ params_map en lote
+    params = [None] * len(slots)
+    for rule, positions in by_rule.values():
+        payloads = [event_params(slots[position][2]) for position in positions]
+        for position, values in zip(positions, rule_params_map(rule).evaluate_many(payloads)):
+            params[position] = values
+
+    return [
+        (rule.fire_event, event.aid, with_ga4_defaults(values, event.path), rule.sink)
+        for (rule, event, _), values in zip(slots, params)
+    ]
@@ -0,0 +1,147 @@
+import hashlib
+import math
+from collections import Counter
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from . import metrics
+from .buffer import event_buffer
+from .ga4 import async_client
+from .shm import TokenBuckets
+from .sinks import get_sinks
+
+# =====================
+# LÍMITES POR CLIENTE Y CONTROL DE ADMISIÓN
+# =====================
+# 1️⃣ Backlog: si los eventos pendientes del worker (buffer write-behind,
+#    colas de los sinks, envíos GA4 async en vuelo) superan
+#    COLLECT_MAX_BACKLOG, el request se rechaza sin encolar nada.
+# 2️⃣ IP: token bucket por IP del cliente (costo = eventos del request).
+# 3️⃣ aid: token bucket por aid; en un lote solo se descartan los eventos
+#    del aid que se pasó.
+# Los buckets viven en memoria compartida (tracking/shm.py): el límite es
+# por máquina, no por worker.
+
+RATE_LIMITED = "rate_limited"
+
+_buckets = None
+
+
+def enabled():
+    return getattr(settings, "RATE_LIMIT_ENABLED", True)
+
+
+def get_buckets():
+    global _buckets
+    if _buckets is None:
+        _buckets = TokenBuckets("rate_limits", slots=getattr(settings, "RATE_LIMIT_SLOTS", 65536))
+    return _buckets
+
+
+def _digest(kind, value):
+    return hashlib.blake2b(f"{kind}:{value}".encode("utf-8"), digest_size=16).digest()
+
+
+def client_ip(request):
+    """
+    IP del cliente: REMOTE_ADDR, salvo que se configure
+    RATE_LIMIT_PROXY_HOPS (proxies de confianza). En ese caso se toma la
+    entrada de X-Forwarded-For que agregó el más externo (las anteriores
+    las puede inventar el cliente).
+    """
+    hops = getattr(settings, "RATE_LIMIT_PROXY_HOPS", 0)
+    forwarded = request.META.get("HTTP_X_FORWARDED_FOR")
+    if hops and forwarded:
+        chain = [ip.strip() for ip in forwarded.split(",") if ip.strip()]
+        if chain:
+            return chain[-min(hops, len(chain))]
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def backlog():
+    """
+    Eventos aceptados por este worker que todavía no salieron.
+    """
+    depth = event_buffer.depth() + async_client.inflight()
+    for sink in get_sinks().values():
+        depth += sink.depth()
+    return depth
+
+
+metrics.register_gauge("collect_backlog", backlog)
+
+
+def _shed(reason, events):
+    metrics.inc("collect_shed_requests_total", reason=reason)
+    metrics.inc("events_shed_total", events, reason=reason)
+
+
+def admit(request, events):
+    """
+    Control de admisión y límite por IP antes de construir los eventos.
+    Devuelve None si el request pasa, o la respuesta de rechazo.
+    """
+    if backlog() >= getattr(settings, "COLLECT_MAX_BACKLOG", 20000):
+        _shed("backlog", events)
+        return shed_response("overloaded", retry_after=1)
+
+    if not enabled() or not events:
+        return None
+    burst = getattr(settings, "RATE_LIMIT_IP_BURST", 5000)
+    wait, = get_buckets().take_many([(
+        _digest("ip", client_ip(request)),
+        getattr(settings, "RATE_LIMIT_IP_RATE", 200),
+        burst,
+        min(events, burst),
+    )])
+    if wait:
+        _shed("ip", events)
+        return shed_response(RATE_LIMITED, retry_after=wait)
+    return None
+
+
+def limit_aids(pairs):
+    """
+    Token bucket por aid sobre los (Event, data) de un lote. Devuelve
+    (pares admitidos, lista alineada con `pairs` con los segundos que debe
+    esperar el aid: 0 si se admitió).
+    """
+    if not pairs or not enabled():
+        return pairs, [0] * len(pairs)
+
+    rate = getattr(settings, "RATE_LIMIT_AID_RATE", 10)
+    burst = getattr(settings, "RATE_LIMIT_AID_BURST", 200)
+    counts = Counter(event.aid for event, _ in pairs)
+    aids = list(counts)
+    waits = get_buckets().take_many([
+        (_digest("aid", aid), rate, burst, min(counts[aid], burst)) for aid in aids
+    ])
+    denied = {aid: wait for aid, wait in zip(aids, waits) if wait}
+    if not denied:
+        return pairs, [0] * len(pairs)
+
+    limited = [denied.get(event.aid, 0) for event, _ in pairs]
+    _shed("aid", sum(1 for wait in limited if wait))
+    return [pair for pair, wait in zip(pairs, limited) if not wait], limited
+
+
+def retry_after_seconds(wait):
+    """
+    Valor de Retry-After (segundos enteros, mínimo 1) para una espera.
+    """
+    if not math.isfinite(wait):
+        return 60
+    return max(1, math.ceil(wait))
+
+
+def shed_response(reason, retry_after=1):
+    """
+    COLLECT_SHED_MODE = "reject" → 429 con Retry-After;
+    "drop" → 202 (el cliente no reintenta y el lote se descarta).
+    """
+    if getattr(settings, "COLLECT_SHED_MODE", "reject") == "drop":
+        return JsonResponse({"status": "dropped", "reason": reason}, status=202)
+    response = JsonResponse({"error": reason}, status=429)
+    response["Retry-After"] = str(retry_after_seconds(retry_after))
+    return response
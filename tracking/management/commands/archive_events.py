@@ -0,0 +1,136 @@
+import os
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max, Min
+
+from tracking.archive import COLUMNS, DayWriter, archive_dir, iter_column
+from tracking.models import Event
+
+FIELDS = [name for name, _ in COLUMNS]
+
+
+class Command(BaseCommand):
+    help = (
+        'Archiva eventos antiguos en archivos diarios columnares comprimidos '
+        '(.ctcol) y los borra de tracking_event en lotes acotados'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int,
+            default=getattr(settings, "EVENT_ARCHIVE_AFTER_DAYS", 30),
+            help="Archiva eventos con más de N días.",
+        )
+        parser.add_argument("--output", default=None, help="Directorio de salida.")
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument("--delete-batch", type=int, default=1000)
+        parser.add_argument("--no-delete", action="store_true")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        output = options["output"] or archive_dir()
+        os.makedirs(output, exist_ok=True)
+
+        today = datetime.now(dt_timezone.utc).date()
+        cutoff = datetime.combine(
+            today - timedelta(days=options["days"]), time.min, tzinfo=dt_timezone.utc
+        )
+        old = Event.objects.filter(created_at__lt=cutoff)
+
+        first = old.order_by("created_at").values_list("created_at", flat=True).first()
+        total = 0
+        while first is not None:
+            day_start = datetime.combine(
+                first.astimezone(dt_timezone.utc).date(), time.min, tzinfo=dt_timezone.utc
+            )
+            day_end = min(day_start + timedelta(days=1), cutoff)
+            total += self.archive_day(day_start, day_end, output, options)
+
+            # Siguiente día con datos (salta huecos usando el índice)
+            first = (
+                old.filter(created_at__gte=day_end)
+                .order_by("created_at")
+                .values_list("created_at", flat=True)
+                .first()
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Eventos archivados: {total}"))
+
+    def archive_day(self, day_start, day_end, output, options):
+        day = Event.objects.filter(created_at__gte=day_start, created_at__lt=day_end)
+        first_id = day.order_by("pk").values_list("pk", flat=True).first()
+        if first_id is None:
+            return 0
+
+        label = day_start.strftime("%Y-%m-%d")
+        if options["dry_run"]:
+            rows = day.count()
+            self.stdout.write(f"(dry-run) {label}: {rows} eventos")
+            return rows
+
+        # 1️⃣ Leer por chunks de pk (keyset) con .iterator() y escribir cada
+        # chunk como un grupo de filas (sin pisar un archivo previo)
+        path = os.path.join(output, f"events-{label}.ctcol")
+        if os.path.exists(path):
+            path = os.path.join(output, f"events-{label}-{first_id}.ctcol")
+        chunk_size = options["chunk_size"]
+        writer = DayWriter(path, group_rows=chunk_size)
+        last_pk = 0
+        try:
+            while True:
+                chunk = (
+                    day.filter(pk__gt=last_pk)
+                    .order_by("pk")
+                    .values(*FIELDS)[:chunk_size]
+                )
+                count = 0
+                for row in chunk.iterator(chunk_size=chunk_size):
+                    writer.append(row)
+                    last_pk = row["id"]
+                    count += 1
+                if count < chunk_size:
+                    break
+            writer.close()
+
+            # 2️⃣ Verificar contra el archivo temporal ya escrito (no contra
+            # el header): ids descomprimidos vs filas de la base hasta el
+            # último id leído. Sólo si coincide se renombra al nombre final.
+            archived = self.archived_ids(writer.tmp_path)
+            in_db = day.filter(pk__lte=last_pk).aggregate(rows=Count("id"), low=Min("id"), high=Max("id"))
+            expected = (in_db["rows"], in_db["low"], in_db["high"])
+        except BaseException:
+            writer.abort()
+            raise
+        if archived != expected or archived[0] != writer.rows:
+            writer.abort()
+            self.stdout.write(self.style.ERROR(
+                f"❌ {label}: archivo (filas, min id, max id)={archived} "
+                f"db={expected} leídos={writer.rows}; no se archiva ni se borra"
+            ))
+            return 0
+        writer.commit()
+
+        # 3️⃣ Borrar en lotes acotados exactamente los ids archivados
+        if not options["no_delete"]:
+            batch = options["delete_batch"]
+            for ids in iter_column(path, "id"):
+                for i in range(0, len(ids), batch):
+                    Event.objects.filter(pk__in=ids[i:i + batch].tolist()).delete()
+
+        self.stdout.write(self.style.SUCCESS(f"📦 {label}: {writer.rows} eventos → {path}"))
+        return writer.rows
+
+    def archived_ids(self, path):
+        """
+        (filas, id mínimo, id máximo) releídos del archivo.
+        """
+        rows, low, high = 0, None, None
+        for ids in iter_column(path, "id"):
+            if not ids:
+                continue
+            rows += len(ids)
+            low = min(ids) if low is None else min(low, min(ids))
+            high = max(ids) if high is None else max(high, max(ids))
+        return rows, low, high
@@ -0,0 +1,213 @@
+import itertools
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from tracking.bench import GA4StubServer, compare, environment, latency_summary, traffic, write_results
+from tracking.ga4 import GA4Dispatcher
+from tracking.ingest import build_batch, get_value_by_path, match_ga4_rules, parse_batch_body
+from tracking.paths import compile_params_map
+from tracking.matching import MATCH_TYPES, UrlMatcher
+from tracking.rules import CompiledGA4Rule
+from tracking.storage import _bulk_create_write, _copy_write, write_events
+
+BENCHMARKS = (
+    "get_value_by_path", "build_batch", "rule_matching",
+    "persist", "persist_bulk_create", "persist_copy", "ga4_send",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Micro-benchmarks del hot path (params_map, armado de eventos, reglas '
+        'GA4, escritura y envío al stub GA4) con resultados en JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--only", nargs="*", choices=BENCHMARKS, default=None)
+        parser.add_argument("--rounds", type=int, default=200, help="Mediciones por benchmark.")
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--persist-batch-size", type=int, default=1000,
+            help="Eventos por escritura en persist_bulk_create / persist_copy.",
+        )
+        parser.add_argument("--rules", type=int, default=50, help="Reglas GA4 sintéticas por evento.")
+        parser.add_argument("--stub-latency-ms", type=float, default=0.0)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--output", default=None, help="Archivo JSON de resultados.")
+        parser.add_argument("--baseline", default=None, help="JSON previo para comparar.")
+        parser.add_argument("--tolerance", type=float, default=0.1)
+
+    def handle(self, *args, **options):
+        selected = options["only"] or BENCHMARKS
+        self.rounds = options["rounds"]
+        self.batch_size = options["batch_size"]
+        self.items = list(itertools.islice(
+            traffic(seed=options["seed"]), self.rounds * self.batch_size
+        ))
+
+        results = {"environment": environment(), "options": {
+            key: options[key] for key in (
+                "rounds", "batch_size", "persist_batch_size", "rules", "stub_latency_ms", "seed",
+            )
+        }, "benchmarks": {}}
+
+        for name in selected:
+            result = getattr(self, f"bench_{name}")(options)
+            if result.get("skipped"):
+                self.stdout.write(self.style.WARNING(f"⚠️ {name}: {result['skipped']}"))
+                continue
+            results["benchmarks"][name] = result
+            self.stdout.write(
+                f"⏱️ {name}: {result['events_per_sec']:.0f} ev/s, "
+                f"p50={result['latency']['p50_ms']} ms p99={result['latency']['p99_ms']} ms"
+            )
+
+        if options["output"]:
+            write_results(options["output"], results)
+            self.stdout.write(self.style.SUCCESS(f"✅ Resultados en {options['output']}"))
+
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                regressions = compare(json.load(f), results, options["tolerance"])
+            for name, metric, before, now in regressions:
+                self.stdout.write(self.style.ERROR(f"❌ {name}.{metric}: {before} → {now}"))
+            if regressions:
+                raise CommandError(f"{len(regressions)} regresiones contra {options['baseline']}")
+            self.stdout.write(self.style.SUCCESS("✅ Sin regresiones"))
+
+    # =====================
+    # MEDICIÓN
+    # =====================
+    def measure(self, batches, run):
+        """
+        Corre `run(batch)` por cada lote y devuelve eventos/s y latencia por lote.
+        """
+        timings = []
+        events = 0
+        for batch in batches:
+            start = time.perf_counter()
+            events += run(batch)
+            timings.append(time.perf_counter() - start)
+        elapsed = sum(timings)
+        return {
+            "events": events,
+            "events_per_sec": round(events / elapsed, 1) if elapsed else None,
+            "latency": latency_summary(timings),
+        }
+
+    def batches(self):
+        for i in range(0, len(self.items), self.batch_size):
+            yield self.items[i:i + self.batch_size]
+
+    # =====================
+    # BENCHMARKS
+    # =====================
+    def bench_get_value_by_path(self, options):
+        paths = (
+            "ecommerce.items", "ecommerce.transaction_id", "percent", "tag", "missing.key",
+            "ecommerce.items[0].item_id", "ecommerce.items[*].price",
+        )
+
+        def run(batch):
+            for data in batch:
+                params = data["params"]
+                for path in paths:
+                    get_value_by_path(params, path)
+            return len(batch)
+
+        return self.measure(self.batches(), run)
+
+    def bench_build_batch(self, options):
+        bodies = [json.dumps(batch).encode() for batch in self.batches()]
+
+        def run(body):
+            _, pairs = build_batch(parse_batch_body(body), "bench")
+            return len(pairs)
+
+        return self.measure(bodies, run)
+
+    def bench_rule_matching(self, options):
+        names = {item["event"] for item in self.items}
+        index = {
+            name: UrlMatcher(
+                CompiledGA4Rule(
+                    id=i,
+                    listen_event=name,
+                    fire_event=f"{name}_{i}",
+                    url_contains=f"/seccion-{i}" if i else None,
+                    match_type=MATCH_TYPES[i % len(MATCH_TYPES)],
+                    params_map=compile_params_map({
+                        "value": "ecommerce.value",
+                        "items": "ecommerce.items",
+                        "item_id": "ecommerce.items[0].item_id",
+                        "prices": "ecommerce.items[*].price",
+                        "origin": "$const:bench",
+                    }),
+                )
+                for i in range(options["rules"])
+            )
+            for name in names
+        }
+        batches = [build_batch(batch, "bench")[1] for batch in self.batches()]
+
+        def run(pairs):
+            match_ga4_rules(pairs, index)
+            return len(pairs)
+
+        return self.measure(batches, run)
+
+    def persist(self, write, batch_size):
+        events = [event for event, _ in build_batch(self.items, "bench")[1]]
+        batches = [events[i:i + batch_size] for i in range(0, len(events), batch_size)]
+
+        def run(batch):
+            write(batch)
+            return len(batch)
+
+        # Se mide la escritura real y se deshace al final
+        with transaction.atomic():
+            result = self.measure(batches, run)
+            transaction.set_rollback(True)
+        return result
+
+    def bench_persist(self, options):
+        # Camino real del ingest (COPY en PostgreSQL, bulk_create en el resto)
+        return self.persist(write_events, self.batch_size)
+
+    def bench_persist_bulk_create(self, options):
+        return self.persist(_bulk_create_write, options["persist_batch_size"])
+
+    def bench_persist_copy(self, options):
+        if connection.vendor != "postgresql":
+            return {"skipped": f"COPY requiere PostgreSQL (base actual: {connection.vendor})"}
+        return self.persist(_copy_write, options["persist_batch_size"])
+
+    def bench_ga4_send(self, options):
+        server = GA4StubServer(latency=options["stub_latency_ms"] / 1000).start()
+        previous = (
+            getattr(settings, "GA4_COLLECT_URL", None),
+            settings.GA4_MEASUREMENT_ID,
+            settings.GA4_API_SECRET,
+        )
+        settings.GA4_COLLECT_URL = server.url
+        settings.GA4_MEASUREMENT_ID = settings.GA4_MEASUREMENT_ID or "G-BENCH"
+        settings.GA4_API_SECRET = settings.GA4_API_SECRET or "bench"
+        dispatcher = GA4Dispatcher.from_settings()
+        try:
+            batches = [
+                [(item["event"], item["params"]) for item in batch]
+                for batch in self.batches()
+            ]
+
+            def run(events):
+                dispatcher.send("bench-client", events)
+                return len(events)
+
+            return self.measure(batches, run) | {"stub": server.stats()}
+        finally:
+            server.shutdown()
+            settings.GA4_COLLECT_URL, settings.GA4_MEASUREMENT_ID, settings.GA4_API_SECRET = previous
@@ -0,0 +1,325 @@
+import json
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from tracking.eventlog import EventLogReader
+from tracking.models import Event
+
+TABLE = Event._meta.db_table
+LEGACY = f"{TABLE}_legacy"
+DEFAULT = f"{TABLE}_default"
+# Filas por DELETE al aplicar la retención a legacy / default
+DELETE_CHUNK = 10000
+
+
+def period_start(day, granularity):
+    return day.replace(day=1) if granularity == "month" else day
+
+
+def next_period(day, granularity):
+    if granularity == "month":
+        return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+def partition_name(start, granularity):
+    suffix = start.strftime("%Y%m") if granularity == "month" else start.strftime("%Y%m%d")
+    return f"{TABLE}_p{suffix}"
+
+
+def as_utc(day):
+    return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+
+class Command(BaseCommand):
+    help = (
+        'Mantiene particiones por día/mes de tracking_event (PostgreSQL): '
+        'crea las futuras y borra las vencidas en O(1). Con almacenamiento '
+        '"log" aplica la misma retención a los segmentos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--granularity", choices=["day", "month"],
+            default=getattr(settings, "EVENT_PARTITION_GRANULARITY", "month"),
+        )
+        parser.add_argument(
+            "--ahead", type=int, default=3,
+            help="Particiones futuras a crear (sin contar la actual).",
+        )
+        parser.add_argument(
+            "--retention-days", type=int,
+            default=getattr(settings, "EVENT_RETENTION_DAYS", None),
+            help="Borra particiones/segmentos que terminan antes de hoy - N días.",
+        )
+        parser.add_argument(
+            "--convert", action="store_true",
+            help="Convierte tracking_event en tabla particionada (una sola vez).",
+        )
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        self.dry_run = options["dry_run"]
+        granularity = options["granularity"]
+        retention = options["retention_days"]
+        today = datetime.now(dt_timezone.utc).date()
+
+        if getattr(settings, "TRACKING_EVENT_STORAGE", "orm") == "log" and retention:
+            cutoff = as_utc(today - timedelta(days=retention))
+            if self.dry_run:
+                self.stdout.write(f"(dry-run) segmentos anteriores a {cutoff} se borrarían")
+            else:
+                dropped = EventLogReader().drop_before(cutoff)
+                self.stdout.write(self.style.SUCCESS(f"🗑️ Segmentos borrados: {dropped}"))
+
+        if connection.vendor != "postgresql":
+            self.stdout.write(self.style.WARNING(
+                f"⚠️ Particionado de tablas no soportado en {connection.vendor}; "
+                "solo se usan los índices por tiempo."
+            ))
+            return
+
+        if options["convert"]:
+            self.convert(today, granularity)
+
+        if not self.is_partitioned():
+            if self.dry_run and options["convert"]:
+                return
+            raise CommandError(
+                f"{TABLE} no está particionada. Ejecuta primero con --convert."
+            )
+
+        self.create_future(today, granularity, options["ahead"])
+        if retention:
+            self.drop_expired(today - timedelta(days=retention), granularity)
+
+    # =====================
+    # SQL
+    # =====================
+    def run_sql(self, sql, params=None):
+        if self.dry_run:
+            self.stdout.write(f"(dry-run) {sql}")
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def is_partitioned(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [TABLE])
+            row = cursor.fetchone()
+        return bool(row) and row[0] == "p"
+
+    def convert(self, today, granularity):
+        """
+        Conversión en línea: la tabla actual pasa a ser la partición
+        `legacy` (MINVALUE → inicio del próximo periodo) sin copiar filas.
+        Los pasos lentos (índice único y validación del CHECK) no bloquean
+        escrituras; el cambio de nombres es instantáneo y ATTACH adopta el
+        índice único como parte de la PK, sin reconstruirlo.
+        """
+        if self.is_partitioned():
+            self.stdout.write(self.style.WARNING(f"⚠️ {TABLE} ya está particionada"))
+            return
+
+        cutoff = as_utc(next_period(today, granularity))
+        index_names = [index.name for index in Event._meta.indexes]
+
+        # 1️⃣ Pasos largos, sin bloquear escrituras
+        self.run_sql(
+            f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "{TABLE}_id_created_uniq" '
+            f'ON "{TABLE}" (id, created_at)'
+        )
+        self.run_sql(
+            f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_legacy_range" '
+            f'CHECK (created_at < %s) NOT VALID',
+            [cutoff],
+        )
+        self.run_sql(f'ALTER TABLE "{TABLE}" VALIDATE CONSTRAINT "{TABLE}_legacy_range"')
+        # ATTACH solo reutiliza un índice que respalde una restricción: un
+        # índice único suelto se reconstruiría bajo ACCESS EXCLUSIVE. Con
+        # el índice ya construido, esto solo toca el catálogo.
+        self.run_sql(
+            f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_id_created_uniq" '
+            f'UNIQUE USING INDEX "{TABLE}_id_created_uniq"'
+        )
+
+        # 2️⃣ Cambio de catálogo (rápido) en una sola transacción
+        with transaction.atomic():
+            self.run_sql(f'ALTER TABLE "{TABLE}" RENAME TO "{LEGACY}"')
+            for name in index_names:
+                self.run_sql(f'ALTER INDEX "{name}" RENAME TO "{name}_legacy"')
+            self.run_sql(
+                f'CREATE TABLE "{TABLE}" (LIKE "{LEGACY}" INCLUDING DEFAULTS '
+                f'INCLUDING IDENTITY) PARTITION BY RANGE (created_at)'
+            )
+            self.run_sql(f'ALTER TABLE "{TABLE}" ADD PRIMARY KEY (id, created_at)')
+            for index in Event._meta.indexes:
+                columns = ", ".join(index.fields)
+                self.run_sql(f'CREATE INDEX "{index.name}" ON "{TABLE}" ({columns})')
+            # Los ids nuevos siguen la secuencia de la tabla original
+            self.run_sql(
+                f'SELECT setval(pg_get_serial_sequence(%s, %s), '
+                f'(SELECT COALESCE(MAX(id), 0) + 1 FROM "{LEGACY}"), false)',
+                [f'"{TABLE}"', "id"],
+            )
+            self.run_sql(
+                f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{LEGACY}" '
+                f'FOR VALUES FROM (MINVALUE) TO (%s)',
+                [cutoff],
+            )
+            self.run_sql(f'CREATE TABLE "{DEFAULT}" PARTITION OF "{TABLE}" DEFAULT')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {TABLE} particionada por {granularity}; histórico en {LEGACY} hasta {cutoff:%Y-%m-%d}"
+        ))
+
+    def partitions(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = %s",
+                [TABLE],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def partition_for(self, moment):
+        """
+        Partición donde PostgreSQL guardaría una fila con created_at =
+        `moment` (o None), tomada del plan con poda de particiones: los
+        límites los evalúa el servidor, no se parsea su texto.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'EXPLAIN (FORMAT JSON) SELECT 1 FROM "{TABLE}" WHERE created_at = %s::timestamptz',
+                [moment],
+            )
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        nodes = [plan[0]["Plan"]]
+        while nodes:
+            node = nodes.pop()
+            if "Relation Name" in node:
+                return node["Relation Name"]
+            nodes.extend(node.get("Plans", []))
+        return None
+
+    def create_future(self, today, granularity, ahead):
+        existing = set(self.partitions())
+        start = period_start(today, granularity)
+        created = 0
+        for _ in range(ahead + 1):
+            end = next_period(start, granularity)
+            name = partition_name(start, granularity)
+            if name not in existing and not self.covered_by_legacy(start):
+                self.create_partition(name, as_utc(start), as_utc(end), DEFAULT in existing)
+                created += 1
+            start = end
+        self.stdout.write(self.style.SUCCESS(f"✅ Particiones creadas: {created}"))
+
+    def create_partition(self, name, start, end, has_default):
+        """
+        Si la partición DEFAULT ya tiene filas del rango (el job no corrió a
+        tiempo), CREATE ... PARTITION OF fallaría: se crea la tabla suelta,
+        se mueven esas filas y se adjunta.
+        """
+        stray = False
+        if has_default and not self.dry_run:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'SELECT EXISTS (SELECT 1 FROM "{DEFAULT}" WHERE created_at >= %s AND created_at < %s)',
+                    [start, end],
+                )
+                stray = cursor.fetchone()[0]
+        if not stray:
+            self.run_sql(
+                f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{TABLE}" '
+                f'FOR VALUES FROM (%s) TO (%s)',
+                [start, end],
+            )
+            return
+
+        with transaction.atomic():
+            self.run_sql(f'CREATE TABLE "{name}" (LIKE "{TABLE}" INCLUDING DEFAULTS)')
+            self.run_sql(
+                f'WITH moved AS (DELETE FROM "{DEFAULT}" WHERE created_at >= %s AND created_at < %s '
+                f'RETURNING *) INSERT INTO "{name}" SELECT * FROM moved',
+                [start, end],
+            )
+            self.run_sql(
+                f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{name}" FOR VALUES FROM (%s) TO (%s)',
+                [start, end],
+            )
+        self.stdout.write(self.style.WARNING(
+            f"⚠️ {name}: filas movidas desde {DEFAULT}"
+        ))
+
+    def covered_by_legacy(self, start):
+        return self.partition_for(as_utc(start)) == LEGACY
+
+    def detach(self, name, has_default):
+        # DETACH ... CONCURRENTLY no se permite si existe una partición
+        # DEFAULT: en ese caso DETACH normal (bloqueo breve de la tabla)
+        concurrently = "" if has_default else " CONCURRENTLY"
+        self.run_sql(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}"{concurrently}')
+        self.run_sql(f'DROP TABLE "{name}"')
+
+    def delete_before(self, name, cutoff):
+        """
+        Borra por tandas las filas vencidas de una partición que no se
+        puede eliminar completa (legacy con filas recientes, default).
+        """
+        deleted = 0
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM "{name}" WHERE ctid IN ('
+                    f'SELECT ctid FROM "{name}" WHERE created_at < %s LIMIT {DELETE_CHUNK})',
+                    [cutoff],
+                )
+                count = cursor.rowcount
+            deleted += count
+            if count < DELETE_CHUNK:
+                return deleted
+
+    def drop_expired(self, cutoff_day, granularity):
+        """
+        DETACH + DROP: no se borran filas una por una. legacy se elimina
+        entera cuando todo su rango venció; mientras tanto (y en default)
+        se borran sus filas vencidas por tandas.
+        """
+        existing = self.partitions()
+        has_default = DEFAULT in existing
+        cutoff = as_utc(cutoff_day)
+        prefix = f"{TABLE}_p"
+        fmt = "%Y%m" if granularity == "month" else "%Y%m%d"
+        dropped = 0
+        for name in sorted(existing):
+            if not name.startswith(prefix):
+                continue
+            try:
+                start = datetime.strptime(name[len(prefix):], fmt).date()
+            except ValueError:
+                continue
+            if next_period(start, granularity) <= cutoff_day:
+                self.detach(name, has_default)
+                dropped += 1
+
+        if LEGACY in existing:
+            # legacy va de MINVALUE a su límite: venció entera si el corte
+            # ya no cae en ella
+            if self.partition_for(cutoff) != LEGACY:
+                self.detach(LEGACY, has_default)
+                dropped += 1
+            elif self.dry_run:
+                self.stdout.write(f"(dry-run) filas de {LEGACY} anteriores a {cutoff} se borrarían")
+            else:
+                self.stdout.write(f"🗑️ Filas borradas de {LEGACY}: {self.delete_before(LEGACY, cutoff)}")
+        if has_default and not self.dry_run:
+            self.stdout.write(f"🗑️ Filas borradas de {DEFAULT}: {self.delete_before(DEFAULT, cutoff)}")
+        self.stdout.write(self.style.SUCCESS(f"🗑️ Particiones borradas: {dropped}"))
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tracking.bench import GA4StubServer
+
+
+class Command(BaseCommand):
+    help = (
+        'Levanta un stub local de /mp/collect con latencia y tasa de error '
+        'configurables (apuntar GA4_COLLECT_URL a la URL que imprime)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency-ms", type=float, default=50.0)
+        parser.add_argument("--jitter-ms", type=float, default=10.0)
+        parser.add_argument(
+            "--error-rate", type=float, default=0.0,
+            help="Fracción de requests que responden 500 (0-1).",
+        )
+        parser.add_argument("--report-every", type=float, default=10.0)
+
+    def handle(self, *args, **options):
+        server = GA4StubServer(
+            host=options["host"],
+            port=options["port"],
+            latency=options["latency_ms"] / 1000,
+            jitter=options["jitter_ms"] / 1000,
+            error_rate=options["error_rate"],
+        ).start()
+        self.stdout.write(self.style.SUCCESS(f"🧪 Stub GA4 escuchando en {server.url}"))
+
+        try:
+            while True:
+                time.sleep(options["report_every"])
+                self.stdout.write(f"📊 {server.stats()}")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+            self.stdout.write(f"📊 {server.stats()}")
@@ -0,0 +1,138 @@
+import itertools
+import json
+import threading
+import time
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from tracking.bench import SHAPES, compare, environment, latency_summary, traffic, write_results
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SHAPES:
+            raise CommandError(f"Forma de tráfico desconocida: {name} ({', '.join(SHAPES)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Command(BaseCommand):
+    help = (
+        'Generador de carga: reproduce tráfico de dataLayer realista contra '
+        '/api/collect/ (o /api/collect/batch/) y reporta eventos/s y latencias'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000/api/")
+        parser.add_argument(
+            "--batch", type=int, default=0,
+            help="Eventos por POST a collect/batch/ (0 = un evento por POST a collect/).",
+        )
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--duration", type=float, default=30.0, help="Segundos.")
+        parser.add_argument("--events", type=int, default=None, help="Tope de eventos.")
+        parser.add_argument("--mix", default="pageview=0.7,ecommerce=0.2,burst=0.1")
+        parser.add_argument("--aids", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--timeout", type=float, default=10.0)
+        parser.add_argument("--output", default=None)
+        parser.add_argument("--baseline", default=None)
+        parser.add_argument("--tolerance", type=float, default=0.1)
+
+    def handle(self, *args, **options):
+        base = options["base_url"].rstrip("/") + "/"
+        batch = options["batch"]
+        url = base + ("collect/batch/" if batch else "collect/")
+        size = max(batch, 1)
+
+        source = traffic(options["seed"], parse_mix(options["mix"]), options["aids"])
+        if options["events"] is not None:
+            source = itertools.islice(source, options["events"])
+        source_lock = threading.Lock()
+        deadline = time.monotonic() + options["duration"]
+
+        lock = threading.Lock()
+        latencies = []
+        statuses = {}
+        sent = [0]
+
+        def next_chunk():
+            with source_lock:
+                return list(itertools.islice(source, size))
+
+        def worker():
+            session = requests.Session()
+            while time.monotonic() < deadline:
+                chunk = next_chunk()
+                if not chunk:
+                    return
+                body = json.dumps(chunk if batch else chunk[0])
+                start = time.perf_counter()
+                try:
+                    response = session.post(
+                        url, data=body, timeout=options["timeout"],
+                        headers={"Content-Type": "text/plain" if batch else "application/json"},
+                    )
+                    status = response.status_code
+                except requests.RequestException:
+                    status = "error"
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[status] = statuses.get(status, 0) + 1
+                    if status == 200:
+                        sent[0] += len(chunk)
+
+        self.stdout.write(
+            f"🚀 {options['concurrency']} hilos → {url} "
+            f"({'lotes de ' + str(batch) if batch else '1 evento por POST'})"
+        )
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(options["concurrency"])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        name = f"loadgen_{'batch' if batch else 'single'}"
+        result = {
+            "url": url,
+            "requests": len(latencies),
+            "events": sent[0],
+            "elapsed_sec": round(elapsed, 3),
+            "events_per_sec": round(sent[0] / elapsed, 1) if elapsed else None,
+            "requests_per_sec": round(len(latencies) / elapsed, 1) if elapsed else None,
+            "statuses": {str(k): v for k, v in statuses.items()},
+            "latency": latency_summary(latencies),
+        }
+        results = {
+            "environment": environment(),
+            "options": {key: options[key] for key in ("batch", "concurrency", "duration", "events", "mix", "seed")},
+            "benchmarks": {name: result},
+        }
+        self.stdout.write(
+            f"⏱️ {result['events_per_sec']} ev/s, {result['requests_per_sec']} req/s, "
+            f"p99={result['latency']['p99_ms']} ms, status={result['statuses']}"
+        )
+        if result["statuses"].get("429") or result["statuses"].get("202"):
+            self.stdout.write(self.style.WARNING(
+                "⚠️ El servidor descartó requests (límites o backlog): para medir "
+                "throughput crudo usar RATE_LIMIT_ENABLED=0 y un COLLECT_MAX_BACKLOG alto"
+            ))
+
+        if options["output"]:
+            write_results(options["output"], results)
+            self.stdout.write(self.style.SUCCESS(f"✅ Resultados en {options['output']}"))
+
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                regressions = compare(json.load(f), results, options["tolerance"])
+            for bench, metric, before, now in regressions:
+                self.stdout.write(self.style.ERROR(f"❌ {bench}.{metric}: {before} → {now}"))
+            if regressions:
+                raise CommandError(f"{len(regressions)} regresiones contra {options['baseline']}")
+            self.stdout.write(self.style.SUCCESS("✅ Sin regresiones"))
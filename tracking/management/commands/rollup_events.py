@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from tracking.rollups import rollup_pending
+
+
+class Command(BaseCommand):
+    help = 'Actualiza los rollups por minuto/hora con los eventos nuevos (watermark)'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50000)
+        parser.add_argument(
+            "--loop", type=float, default=None,
+            help="Repite cada N segundos en lugar de terminar.",
+        )
+
+    def handle(self, *args, **options):
+        if getattr(settings, "EVENT_ROLLUPS", "job") == "ingest":
+            self.stdout.write(self.style.WARNING(
+                '⚠️ EVENT_ROLLUPS = "ingest": los rollups ya se actualizan al guardar; '
+                'correr este job duplicaría los conteos.'
+            ))
+            return
+
+        while True:
+            processed = rollup_pending(options["batch_size"])
+            self.stdout.write(self.style.SUCCESS(f"✅ Eventos agregados: {processed}"))
+            if options["loop"] is None:
+                return
+            close_old_connections()
+            time.sleep(options["loop"])
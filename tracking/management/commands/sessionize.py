@@ -0,0 +1,54 @@
+import time
+from datetime import datetime, time as dt_time, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils.dateparse import parse_date
+
+from tracking.sessions import backfill_sessions, sessionize_pending
+
+
+class Command(BaseCommand):
+    help = 'Arma la tabla de sesiones a partir de los eventos nuevos (watermark) o del histórico (--backfill)'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument(
+            "--loop", type=float, default=None,
+            help="Repite cada N segundos en lugar de terminar.",
+        )
+        parser.add_argument(
+            "--backfill", action="store_true",
+            help="Reconstruye las sesiones de todo el histórico (detener antes el job incremental).",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=4,
+            help="Procesos del backfill (particiones por hash del aid).",
+        )
+        parser.add_argument("--since", default=None, help="Backfill desde esta fecha (YYYY-MM-DD).")
+
+    def handle(self, *args, **options):
+        if options["backfill"]:
+            since = None
+            if options["since"]:
+                day = parse_date(options["since"])
+                if day is None:
+                    raise CommandError(f"Fecha inválida: {options['since']}")
+                since = datetime.combine(day, dt_time.min, tzinfo=dt_timezone.utc)
+            start = time.monotonic()
+            processed, saved = backfill_sessions(max(1, options["workers"]), since)
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ Backfill: {processed} eventos → {saved} sesiones "
+                f"en {time.monotonic() - start:.1f}s"
+            ))
+            return
+
+        while True:
+            processed, saved = sessionize_pending(options["batch_size"])
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ Eventos procesados: {processed}, sesiones cerradas: {saved}"
+            ))
+            if options["loop"] is None:
+                return
+            close_old_connections()
+            time.sleep(options["loop"])
@@ -0,0 +1,207 @@
+import re
+
+# =====================
+# MATCHER DE URLS POR EVENTO
+# =====================
+# Todas las reglas de un listen_event se compilan en una sola estructura:
+#   contains → autómata Aho–Corasick (una pasada sobre el path)
+#   prefix   → trie recorrido desde el inicio del path
+#   regex    → una alternancia combinada descarta el caso común (ningún
+#              regex coincide) en una sola búsqueda; solo si hay
+#              coincidencia se revisan los regex uno a uno (los que tienen
+#              grupos de captura quedan fuera de la alternancia)
+# Cada regla ocupa un bit; match() devuelve las reglas en su orden original.
+
+CONTAINS = "contains"
+PREFIX = "prefix"
+REGEX = "regex"
+MATCH_TYPES = (CONTAINS, PREFIX, REGEX)
+
+
+class _Trie:
+    def __init__(self):
+        self.goto = [{}]
+        self.masks = [0]
+
+    def add(self, pattern, bit):
+        node = 0
+        for char in pattern:
+            nxt = self.goto[node].get(char)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][char] = nxt
+                self.goto.append({})
+                self.masks.append(0)
+            node = nxt
+        self.masks[node] |= bit
+
+
+class AhoCorasick:
+    """
+    Autómata determinista: cada nodo tiene la transición completa para
+    los caracteres que aparecen en algún patrón; los demás vuelven a la
+    raíz. match_mask() une los bits de todos los patrones contenidos.
+    """
+
+    def __init__(self, patterns):
+        trie = _Trie()
+        for pattern, bit in patterns:
+            trie.add(pattern, bit)
+        goto, masks = trie.goto, trie.masks
+        alphabet = {char for edges in goto for char in edges}
+
+        fail = [0] * len(goto)
+        delta = [dict() for _ in goto]
+        order = []
+        for char in alphabet:
+            child = goto[0].get(char)
+            if child is not None:
+                delta[0][char] = child
+                order.append(child)
+
+        # BFS: la transición de un nodo es la propia o la de su fallo
+        i = 0
+        while i < len(order):
+            node = order[i]
+            i += 1
+            masks[node] |= masks[fail[node]]
+            for char in alphabet:
+                child = goto[node].get(char)
+                if child is not None:
+                    fail[child] = delta[fail[node]].get(char, 0)
+                    delta[node][char] = child
+                    order.append(child)
+                else:
+                    target = delta[fail[node]].get(char, 0)
+                    if target:
+                        delta[node][char] = target
+
+        self.delta = delta
+        self.masks = masks
+
+    def match_mask(self, text):
+        delta, masks = self.delta, self.masks
+        node = 0
+        mask = 0
+        for char in text:
+            node = delta[node].get(char, 0)
+            mask |= masks[node]
+        return mask
+
+
+class PrefixTrie:
+    def __init__(self, patterns):
+        self.trie = _Trie()
+        for pattern, bit in patterns:
+            self.trie.add(pattern, bit)
+
+    def match_mask(self, text):
+        goto, masks = self.trie.goto, self.trie.masks
+        node = 0
+        mask = 0
+        for char in text:
+            node = goto[node].get(char)
+            if node is None:
+                break
+            mask |= masks[node]
+        return mask
+
+
+class RegexSet:
+    def __init__(self, patterns):
+        compiled = [(re.compile(pattern), bit) for pattern, bit in patterns]
+        # En la alternancia los grupos se renumeran (\1 apuntaría al grupo
+        # de otro patrón): los patrones con grupos de captura se revisan
+        # siempre uno a uno y solo los demás pasan por el filtro combinado
+        self.grouped = [(regex, bit) for regex, bit in compiled if regex.groups]
+        self.plain = [(regex, bit) for regex, bit in compiled if not regex.groups]
+        self.combined = None
+        if self.plain:
+            try:
+                self.combined = re.compile("|".join(f"(?:{regex.pattern})" for regex, _ in self.plain))
+            except re.error:
+                # Flags globales ((?i)...) fuera del inicio
+                self.combined = None
+
+    def match_mask(self, text):
+        mask = 0
+        if self.combined is None or self.combined.search(text):
+            for regex, bit in self.plain:
+                if regex.search(text):
+                    mask |= bit
+        for regex, bit in self.grouped:
+            if regex.search(text):
+                mask |= bit
+        return mask
+
+
+class UrlMatcher:
+    """
+    Reglas de un listen_event compiladas. Cada regla debe tener
+    `url_contains` (patrón; vacío = cualquier URL) y `match_type`.
+    """
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        self.always = 0
+        by_type = {CONTAINS: [], PREFIX: [], REGEX: []}
+        for position, rule in enumerate(self.rules):
+            bit = 1 << position
+            pattern = rule.url_contains
+            if not pattern:
+                self.always |= bit
+            else:
+                match_type = getattr(rule, "match_type", CONTAINS)
+                by_type[match_type if match_type in by_type else CONTAINS].append((pattern, bit))
+
+        self.matchers = []
+        if by_type[CONTAINS]:
+            self.matchers.append(AhoCorasick(by_type[CONTAINS]))
+        if by_type[PREFIX]:
+            self.matchers.append(PrefixTrie(by_type[PREFIX]))
+        if by_type[REGEX]:
+            self.matchers.append(RegexSet(by_type[REGEX]))
+
+    def __iter__(self):
+        return iter(self.rules)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def match_mask(self, path):
+        mask = self.always
+        for matcher in self.matchers:
+            mask |= matcher.match_mask(path or "")
+        return mask
+
+    def match(self, path):
+        """
+        Reglas que aplican a `path`, en el orden en que se compilaron.
+        """
+        mask = self.match_mask(path)
+        if mask == self.always and not self.matchers:
+            return self.rules
+        rules = self.rules
+        matched = []
+        while mask:
+            low = mask & -mask
+            matched.append(rules[low.bit_length() - 1])
+            mask ^= low
+        return matched
+
+
+def validate_pattern(match_type, pattern):
+    """
+    Mensaje de error si el patrón no compila para su tipo.
+    """
+    if match_type not in MATCH_TYPES:
+        return f"Tipo de coincidencia desconocido: {match_type}"
+    if match_type == REGEX and pattern:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            return f"Regex inválido: {e}"
+    return None
@@ -0,0 +1,343 @@
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from .stamps import state_dir
+
+# =====================
+# MÉTRICAS
+# =====================
+# Contadores, histogramas y gauges para ver qué pasa en el hot path sin
+# depender de los logs. Cada proceso acumula en memoria y un hilo vuelca
+# su estado a <TRACKING_STATE_DIR>/metrics/<pid>.json; /api/metrics suma
+# los archivos de todos los workers de gunicorn.
+
+# Límites superiores (segundos) de los buckets de los histogramas
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+PREFIX = "clarotrack_"
+DEAD_FILE = "dead.json"
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_histograms = {}
+_gauge_callbacks = {}
+_writer_pid = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    _ensure_writer()
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def observe(name, seconds, **labels):
+    """
+    Registra una duración en el histograma `name` (buckets en BUCKETS).
+    """
+    _ensure_writer()
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0, 0.0]
+        hist[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+        hist[1] += seconds
+        hist[2] += 1
+        hist[3] = max(hist[3], seconds)
+
+
+def register_gauge(name, callback):
+    """
+    Registra una función que devuelve el valor actual del gauge.
+    Se evalúa solo al leer o volcar las métricas.
+    """
+    _gauge_callbacks[name] = callback
+
+
+class timer:
+    """
+    Context manager que registra la duración del bloque con observe().
+    """
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def _gauges():
+    gauges = {}
+    for name, callback in list(_gauge_callbacks.items()):
+        try:
+            gauges[name] = callback()
+        except Exception:
+            gauges[name] = None
+    return gauges
+
+
+def _format(key):
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+
+def snapshot():
+    """
+    Métricas de este proceso (para /api/status/).
+    """
+    with _lock:
+        counters = {_format(k): v for k, v in _counters.items()}
+        timings = {
+            _format(k): {
+                "count": count,
+                "avg_ms": round(total / count * 1000, 2) if count else 0,
+                "max_ms": round(maximum * 1000, 2),
+            }
+            for k, (_, total, count, maximum) in _histograms.items()
+        }
+    return {"counters": counters, "gauges": _gauges(), "timings": timings}
+
+
+# =====================
+# REGISTRO COMPARTIDO ENTRE WORKERS
+# =====================
+def metrics_dir():
+    return state_dir("metrics")
+
+
+def _sync_interval():
+    return getattr(settings, "METRICS_SYNC_INTERVAL", 5)
+
+
+def _state():
+    with _lock:
+        counters = [[name, list(labels), value] for (name, labels), value in _counters.items()]
+        histograms = [
+            [name, list(labels), list(buckets), total, count]
+            for (name, labels), (buckets, total, count, _) in _histograms.items()
+        ]
+    gauges = [[name, value] for name, value in _gauges().items() if value is not None]
+    return {"counters": counters, "histograms": histograms, "gauges": gauges}
+
+
+def _write(path, state):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def sync():
+    """
+    Vuelca el estado de este proceso a su archivo.
+    """
+    _write(os.path.join(metrics_dir(), f"{os.getpid()}.json"), _state())
+
+
+def _run():
+    while True:
+        time.sleep(_sync_interval())
+        try:
+            sync()
+        except Exception:
+            pass
+
+
+def _ensure_writer():
+    # Un hilo por proceso (los workers de gunicorn nacen por fork)
+    global _writer_pid
+    if _writer_pid == os.getpid():
+        return
+    with _lock:
+        if _writer_pid == os.getpid():
+            return
+        if _writer_pid is not None:
+            # El hijo no hereda los conteos del padre
+            _counters.clear()
+            _histograms.clear()
+        _writer_pid = os.getpid()
+    threading.Thread(target=_run, name="metrics-sync", daemon=True).start()
+
+
+def _pid_alive(pid, mtime):
+    # Un archivo sin actualizar en varios intervalos también está muerto
+    # (pid reutilizado por otro proceso tras un reinicio)
+    if time.time() - mtime > max(60, _sync_interval() * 10):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _merge(total, state, with_gauges=True):
+    for name, labels, value in state.get("counters", ()):
+        total["counters"][_key(name, dict(labels))] += value
+    for name, labels, buckets, hist_sum, count in state.get("histograms", ()):
+        key = _key(name, dict(labels))
+        current = total["histograms"].get(key)
+        if current is None:
+            total["histograms"][key] = [list(buckets), hist_sum, count]
+        else:
+            current[0] = [a + b for a, b in zip(current[0], buckets)]
+            current[1] += hist_sum
+            current[2] += count
+    if with_gauges:
+        for name, value in state.get("gauges", ()):
+            total["gauges"][name] += value
+
+
+def collect():
+    """
+    Suma las métricas de todos los workers de la máquina.
+
+    Los contadores e histogramas de procesos muertos se conservan (se
+    compactan en dead.json para que no decrezcan); sus gauges se descartan.
+    """
+    sync()
+    directory = metrics_dir()
+    total = {
+        "counters": defaultdict(float),
+        "histograms": {},
+        "gauges": defaultdict(float),
+    }
+
+    with open(os.path.join(directory, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead_path = os.path.join(directory, DEAD_FILE)
+        dead = {"counters": defaultdict(float), "histograms": {}, "gauges": defaultdict(float)}
+        _merge(dead, _read(dead_path) or {}, with_gauges=False)
+
+        reaped = []
+        for name in os.listdir(directory):
+            stem, ext = os.path.splitext(name)
+            if ext != ".json" or not stem.isdigit():
+                continue
+            path = os.path.join(directory, name)
+            state = _read(path)
+            if state is None:
+                continue
+            try:
+                mtime = os.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+            if int(stem) == os.getpid() or _pid_alive(int(stem), mtime):
+                _merge(total, state)
+            else:
+                _merge(dead, state, with_gauges=False)
+                reaped.append(path)
+
+        if reaped:
+            _write(dead_path, {
+                "counters": [[n, list(l), v] for (n, l), v in dead["counters"].items()],
+                "histograms": [
+                    [n, list(l), b, s, c] for (n, l), (b, s, c) in dead["histograms"].items()
+                ],
+            })
+            for path in reaped:
+                os.unlink(path)
+
+    _merge(total, {
+        "counters": [[n, list(l), v] for (n, l), v in dead["counters"].items()],
+        "histograms": [[n, list(l), b, s, c] for (n, l), (b, s, c) in dead["histograms"].items()],
+    }, with_gauges=False)
+    return total
+
+
+# =====================
+# FORMATO PROMETHEUS
+# =====================
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def render_prometheus(total=None):
+    """
+    Texto de exposición de Prometheus (versión 0.0.4).
+    """
+    total = total or collect()
+    lines = []
+
+    by_name = defaultdict(list)
+    for (name, labels), value in total["counters"].items():
+        by_name[name].append((labels, value))
+    for name in sorted(by_name):
+        lines.append(f"# TYPE {PREFIX}{name} counter")
+        for labels, value in sorted(by_name[name]):
+            lines.append(f"{PREFIX}{name}{_labels(labels)} {_number(value)}")
+
+    by_name = defaultdict(list)
+    for (name, labels), hist in total["histograms"].items():
+        by_name[name].append((labels, hist))
+    for name in sorted(by_name):
+        lines.append(f"# TYPE {PREFIX}{name} histogram")
+        for labels, (buckets, hist_sum, count) in sorted(by_name[name]):
+            cumulative = 0
+            for bound, n in zip(BUCKETS + (None,), buckets):
+                cumulative += n
+                le = "+Inf" if bound is None else repr(bound)
+                lines.append(
+                    f"{PREFIX}{name}_bucket{_labels(labels, [('le', le)])} {cumulative}"
+                )
+            lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {repr(float(hist_sum))}")
+            lines.append(f"{PREFIX}{name}_count{_labels(labels)} {count}")
+
+    for name in sorted(total["gauges"]):
+        lines.append(f"# TYPE {PREFIX}{name} gauge")
+        lines.append(f"{PREFIX}{name} {_number(total['gauges'][name])}")
+
+    return "\n".join(lines) + "\n"
+
+
+def _final_sync():
+    if _writer_pid == os.getpid():
+        sync()
+
+
+atexit.register(_final_sync)
@@ -0,0 +1,30 @@
+# Generated by Django 6.0 on 2026-10-18 12:18
+
+from django.db import migrations, models
+
+from tracking.operations import AddIndexOnline
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY no puede ir dentro de una transacción
+    atomic = False
+
+    dependencies = [
+        ('tracking', '0003_event_created_at_default'),
+    ]
+
+    operations = [
+        AddIndexOnline(
+            model_name='event',
+            index=models.Index(fields=['event', 'created_at'], name='tracking_ev_event_created_idx'),
+        ),
+        AddIndexOnline(
+            model_name='event',
+            index=models.Index(fields=['aid', 'created_at'], name='tracking_ev_aid_created_idx'),
+        ),
+        AddIndexOnline(
+            model_name='event',
+            index=models.Index(fields=['created_at'], name='tracking_ev_created_idx'),
+        ),
+    ]
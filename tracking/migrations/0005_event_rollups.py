@@ -0,0 +1,65 @@
+# Generated by Django 6.0 on 2026-10-18 12:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0004_event_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupGap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.BigIntegerField(unique=True)),
+                ('seen_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EventRollupHour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('event', models.CharField(max_length=100)),
+                ('path', models.CharField(max_length=255)),
+                ('utm_source', models.CharField(blank=True, default='', max_length=100)),
+                ('utm_medium', models.CharField(blank=True, default='', max_length=100)),
+                ('utm_campaign', models.CharField(blank=True, default='', max_length=100)),
+                ('count', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['event', 'bucket'], name='tracking_rh_event_bucket_idx')],
+                'constraints': [models.UniqueConstraint(fields=('bucket', 'event', 'path', 'utm_source', 'utm_medium', 'utm_campaign'), name='tracking_rollup_hour_key')],
+            },
+        ),
+        migrations.CreateModel(
+            name='EventRollupMinute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('event', models.CharField(max_length=100)),
+                ('path', models.CharField(max_length=255)),
+                ('utm_source', models.CharField(blank=True, default='', max_length=100)),
+                ('utm_medium', models.CharField(blank=True, default='', max_length=100)),
+                ('utm_campaign', models.CharField(blank=True, default='', max_length=100)),
+                ('count', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['event', 'bucket'], name='tracking_rm_event_bucket_idx')],
+                'constraints': [models.UniqueConstraint(fields=('bucket', 'event', 'path', 'utm_source', 'utm_medium', 'utm_campaign'), name='tracking_rollup_minute_key')],
+            },
+        ),
+    ]
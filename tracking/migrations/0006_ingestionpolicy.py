@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-18 12:22
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0005_event_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionPolicy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_name', models.CharField(max_length=100, unique=True)),
+                ('action', models.CharField(choices=[('keep', 'Guardar'), ('drop', 'Descartar'), ('sample', 'Muestrear (N%)'), ('aggregate', 'Solo contadores (rollups)')], default='keep', max_length=20)),
+                ('sample_percent', models.PositiveSmallIntegerField(default=100, help_text="Solo para 'Muestrear': porcentaje de aids que se guardan", validators=[django.core.validators.MaxValueValidator(100)])),
+                ('active', models.BooleanField(default=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 12:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0006_ingestionpolicy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ga4rule',
+            name='sink',
+            field=models.CharField(default='ga4', max_length=50),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0007_ga4rule_sink'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ga4rule',
+            name='match_type',
+            field=models.CharField(choices=[('contains', 'Contiene'), ('prefix', 'Empieza con'), ('regex', 'Regex')], default='contains', max_length=10),
+        ),
+    ]
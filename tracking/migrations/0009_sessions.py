@@ -0,0 +1,40 @@
+# Generated by Django 6.0 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0008_ga4rule_match_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Session',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('aid', models.CharField(max_length=64)),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField()),
+                ('event_count', models.PositiveIntegerField(default=0)),
+                ('page_views', models.PositiveIntegerField(default=0)),
+                ('landing_path', models.CharField(max_length=255)),
+                ('exit_path', models.CharField(max_length=255)),
+                ('utm_source', models.CharField(blank=True, default='', max_length=100)),
+                ('utm_medium', models.CharField(blank=True, default='', max_length=100)),
+                ('utm_campaign', models.CharField(blank=True, default='', max_length=100)),
+                ('first_event_id', models.BigIntegerField()),
+                ('last_event_id', models.BigIntegerField()),
+                ('is_open', models.BooleanField(default=False)),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['started_at'], name='tracking_session_started_idx'),
+                    models.Index(condition=models.Q(('is_open', True)), fields=['aid'], name='tracking_session_open_aid_idx'),
+                    models.Index(condition=models.Q(('is_open', True)), fields=['ended_at'], name='tracking_session_open_end_idx'),
+                ],
+                'constraints': [models.UniqueConstraint(fields=('aid', 'started_at'), name='tracking_session_key')],
+            },
+        ),
+    ]
@@ -1,4 +1,22 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator
 from django.db import models
+from django.utils import timezone
+
+from .matching import CONTAINS, PREFIX, REGEX, validate_pattern
+from .paths import PathError, compile_params_map
+
+
+def validate_params_map(params_map):
+    """
+    Mensaje de error si alguna fuente del params_map no compila.
+    """
+    try:
+        compile_params_map(params_map)
+    except PathError as e:
+        return f"params_map inválido: {e}"
+    return None
 
 class Event(models.Model):
     aid = models.CharField(max_length=64)
@@ -11,7 +29,16 @@ class Event(models.Model):
     utm_medium = models.CharField(max_length=100, null=True, blank=True)
     utm_campaign = models.CharField(max_length=100, null=True, blank=True)
 
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Se fija al recibir el evento (no al escribirlo): el buffer
+    # write-behind y el spool guardan el lote más tarde.
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["event", "created_at"], name="tracking_ev_event_created_idx"),
+            models.Index(fields=["aid", "created_at"], name="tracking_ev_aid_created_idx"),
+            models.Index(fields=["created_at"], name="tracking_ev_created_idx"),
+        ]
 
     def __str__(self):
         return f"{self.event} | {self.path}"
@@ -38,17 +65,192 @@ class TrackingRule(models.Model):
     def __str__(self):
         return f"{self.listen_event} → {self.fire_event}"
 
+    def clean(self):
+        params_error = validate_params_map(self.params_map)
+        if params_error:
+            raise ValidationError({"params_map": params_error})
+
 
 # tracking/models.py
 class GA4Rule(models.Model):
+    MATCH_TYPE_CHOICES = [
+        (CONTAINS, "Contiene"),
+        (PREFIX, "Empieza con"),
+        (REGEX, "Regex"),
+    ]
+
     listen_event = models.CharField(max_length=100)
     fire_event = models.CharField(max_length=100)
     url_contains = models.CharField(max_length=255, blank=True, null=True)
+    # Cómo se compara url_contains con el path del evento
+    match_type = models.CharField(max_length=10, choices=MATCH_TYPE_CHOICES, default=CONTAINS)
     params_map = models.JSONField(default=dict)
+    # Nombre del sink de salida (settings.TRACKING_SINKS)
+    sink = models.CharField(max_length=50, default="ga4")
     active = models.BooleanField(default=True)
 
     def __str__(self):
         return f"{self.listen_event} → GA4:{self.fire_event}"
 
+    def clean(self):
+        errors = {}
+        params_error = validate_params_map(self.params_map)
+        if params_error:
+            errors["params_map"] = params_error
+        pattern_error = validate_pattern(self.match_type, self.url_contains)
+        if pattern_error:
+            errors["url_contains"] = pattern_error
+        sinks = getattr(settings, "TRACKING_SINKS", None) or {"ga4": {}}
+        if self.sink not in sinks:
+            errors["sink"] = f"Sink desconocido. Disponibles: {', '.join(sorted(sinks))}"
+        if errors:
+            raise ValidationError(errors)
+
+
+  
+
+# =====================
+# ROLLUPS (agregados por minuto / hora)
+# =====================
+class EventRollup(models.Model):
+    bucket = models.DateTimeField()
+    event = models.CharField(max_length=100)
+    path = models.CharField(max_length=255)
+    # "" en lugar de NULL para que la clave única funcione en todos los motores
+    utm_source = models.CharField(max_length=100, blank=True, default="")
+    utm_medium = models.CharField(max_length=100, blank=True, default="")
+    utm_campaign = models.CharField(max_length=100, blank=True, default="")
+    count = models.PositiveBigIntegerField(default=0)
+
+    KEY_FIELDS = ("bucket", "event", "path", "utm_source", "utm_medium", "utm_campaign")
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return f"{self.bucket:%Y-%m-%d %H:%M} | {self.event} | {self.count}"
+
+
+class EventRollupMinute(EventRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=EventRollup.KEY_FIELDS, name="tracking_rollup_minute_key"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["event", "bucket"], name="tracking_rm_event_bucket_idx"),
+        ]
+
+
+class EventRollupHour(EventRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=EventRollup.KEY_FIELDS, name="tracking_rollup_hour_key"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["event", "bucket"], name="tracking_rh_event_bucket_idx"),
+        ]
+
 
-  
\ No newline at end of file
+class Watermark(models.Model):
+    """
+    Último Event.id procesado por un job incremental.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_id}"
+
+
+class RollupGap(models.Model):
+    """
+    Event.id por debajo del watermark de rollups que faltaba al avanzarlo:
+    un insert todavía sin confirmar (o un lote revertido). El job lo vuelve
+    a buscar durante EVENT_ROLLUP_GAP_SECONDS.
+    """
+    event_id = models.BigIntegerField(unique=True)
+    seen_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"gap {self.event_id}"
+
+
+# =====================
+# SESIONES
+# =====================
+class Session(models.Model):
+    """
+    Eventos seguidos de un aid sin pausas mayores a SESSION_TIMEOUT_MINUTES.
+    La arma tracking.sessions (manage.py sessionize) a partir de Event.
+    Las sesiones que todavía pueden recibir eventos quedan con is_open.
+    """
+    aid = models.CharField(max_length=64)
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField()
+    event_count = models.PositiveIntegerField(default=0)
+    page_views = models.PositiveIntegerField(default=0)
+    landing_path = models.CharField(max_length=255)
+    exit_path = models.CharField(max_length=255)
+    utm_source = models.CharField(max_length=100, blank=True, default="")
+    utm_medium = models.CharField(max_length=100, blank=True, default="")
+    utm_campaign = models.CharField(max_length=100, blank=True, default="")
+    first_event_id = models.BigIntegerField()
+    last_event_id = models.BigIntegerField()
+    is_open = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            # Reprocesar (backfill, reintentos) no duplica sesiones
+            models.UniqueConstraint(fields=["aid", "started_at"], name="tracking_session_key"),
+        ]
+        indexes = [
+            models.Index(fields=["started_at"], name="tracking_session_started_idx"),
+            # Parciales: solo las sesiones abiertas (una por aid activo)
+            models.Index(
+                fields=["aid"], condition=models.Q(is_open=True), name="tracking_session_open_aid_idx"
+            ),
+            models.Index(
+                fields=["ended_at"], condition=models.Q(is_open=True), name="tracking_session_open_end_idx"
+            ),
+        ]
+
+    @property
+    def duration_seconds(self):
+        return (self.ended_at - self.started_at).total_seconds()
+
+    def __str__(self):
+        return f"{self.aid} | {self.started_at:%Y-%m-%d %H:%M} | {self.event_count} eventos"
+
+
+# =====================
+# POLÍTICAS DE INGESTA
+# =====================
+class IngestionPolicy(models.Model):
+    KEEP = "keep"
+    DROP = "drop"
+    SAMPLE = "sample"
+    AGGREGATE = "aggregate"
+    ACTION_CHOICES = [
+        (KEEP, "Guardar"),
+        (DROP, "Descartar"),
+        (SAMPLE, "Muestrear (N%)"),
+        (AGGREGATE, "Solo contadores (rollups)"),
+    ]
+
+    event_name = models.CharField(max_length=100, unique=True)
+    action = models.CharField(max_length=20, choices=ACTION_CHOICES, default=KEEP)
+    sample_percent = models.PositiveSmallIntegerField(
+        default=100, validators=[MaxValueValidator(100)],
+        help_text="Solo para 'Muestrear': porcentaje de aids que se guardan"
+    )
+    active = models.BooleanField(default=True)
+
+    def __str__(self):
+        if self.action == self.SAMPLE:
+            return f"{self.event_name} → {self.action} {self.sample_percent}%"
+        return f"{self.event_name} → {self.action}"
@@ -0,0 +1,298 @@
+import json
+import re
+from functools import lru_cache
+
+# =====================
+# EXPRESIONES DE PARAMS_MAP
+# =====================
+# Sintaxis de las fuentes de params_map:
+#   ecommerce.value                 claves con punto
+#   ecommerce.items[0].item_id      índice (también negativo: [-1])
+#   ecommerce.items[*].price        comodín: devuelve una lista
+#   items[?item_category=phones]    filtro simple (=, !=, >, >=, <, <=)
+#   $const:valor                    constante, resuelta al compilar
+#
+# Cada expresión se compila una sola vez (al cargar las reglas) en un
+# accessor; una expresión inválida se rechaza al guardar la regla.
+
+CONST_PREFIX = "$const:"
+FILTER_RE = re.compile(r"^\s*([^\s=!<>]+)\s*(==|=|!=|>=|<=|>|<)\s*(.+?)\s*$")
+
+
+class PathError(ValueError):
+    pass
+
+
+class Key:
+    fan_out = False
+
+    def __init__(self, name):
+        self.name = name
+
+    def one(self, value):
+        return value.get(self.name) if isinstance(value, dict) else None
+
+
+class Index:
+    fan_out = False
+
+    def __init__(self, position):
+        self.position = position
+
+    def one(self, value):
+        if isinstance(value, (list, tuple)):
+            try:
+                return value[self.position]
+            except IndexError:
+                return None
+        return None
+
+
+class Wildcard:
+    fan_out = True
+
+    def many(self, value):
+        if isinstance(value, (list, tuple)):
+            return list(value)
+        if isinstance(value, dict):
+            return list(value.values())
+        return []
+
+
+class Filter:
+    fan_out = True
+
+    def __init__(self, field, op, expected):
+        self.field = field
+        self.op = op
+        self.expected = expected
+
+    def matches(self, item):
+        value = self.field.get(item)
+        if self.op in ("=", "=="):
+            return value == self.expected
+        if self.op == "!=":
+            return value != self.expected
+        numbers = (int, float)
+        if not (
+            isinstance(value, numbers) and isinstance(self.expected, numbers)
+            or isinstance(value, str) and isinstance(self.expected, str)
+        ) or isinstance(value, bool):
+            return False
+        if self.op == ">":
+            return value > self.expected
+        if self.op == ">=":
+            return value >= self.expected
+        if self.op == "<":
+            return value < self.expected
+        return value <= self.expected
+
+    def many(self, value):
+        if not isinstance(value, (list, tuple)):
+            return []
+        return [item for item in value if self.matches(item)]
+
+
+def _literal(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def _parse(expr):
+    if not isinstance(expr, str):
+        raise PathError(f"la ruta debe ser texto, no {type(expr).__name__}")
+    steps = []
+    i, n = 0, len(expr)
+    while i < n:
+        char = expr[i]
+        if char == "[":
+            end = expr.find("]", i)
+            if end == -1:
+                raise PathError(f"falta ']' en {expr!r}")
+            inner = expr[i + 1:end]
+            if inner == "*":
+                steps.append(Wildcard())
+            elif inner.startswith("?"):
+                match = FILTER_RE.match(inner[1:])
+                if not match:
+                    raise PathError(f"filtro inválido [{inner}] en {expr!r}")
+                field, op, expected = match.groups()
+                sub = compile_path(field)
+                if sub.many:
+                    raise PathError(f"el campo del filtro no puede usar comodines: {field!r}")
+                steps.append(Filter(sub, op, _literal(expected)))
+            else:
+                try:
+                    steps.append(Index(int(inner)))
+                except ValueError:
+                    raise PathError(f"índice inválido [{inner}] en {expr!r}") from None
+            i = end + 1
+            if i < n and expr[i] == ".":
+                i += 1
+                if i == n:
+                    raise PathError(f"ruta terminada en '.': {expr!r}")
+            elif i < n and expr[i] != "[":
+                raise PathError(f"falta '.' después de ']' en {expr!r}")
+        elif char in ".]":
+            raise PathError(f"'{char}' inesperado en la posición {i} de {expr!r}")
+        else:
+            end = i
+            while end < n and expr[end] not in ".[]":
+                end += 1
+            steps.append(Key(expr[i:end]))
+            i = end
+            if i < n and expr[i] == ".":
+                i += 1
+                if i == n or expr[i] in ".[":
+                    raise PathError(f"clave vacía en {expr!r}")
+    if not steps:
+        raise PathError("ruta vacía")
+    return steps
+
+
+class Path:
+    """
+    Ruta compilada. get() devuelve un valor, o una lista si la ruta tiene
+    comodines o filtros (`many`).
+    """
+
+    def __init__(self, expr, steps):
+        self.expr = expr
+        self.steps = tuple(steps)
+        self.many = any(step.fan_out for step in steps)
+
+    def __repr__(self):
+        return f"Path({self.expr!r})"
+
+    def get(self, data):
+        if not self.many:
+            value = data
+            for step in self.steps:
+                value = step.one(value)
+                if value is None:
+                    return None
+            return value
+
+        values = [data]
+        for step in self.steps:
+            if step.fan_out:
+                values = [item for value in values for item in step.many(value)]
+            else:
+                values = [v for v in (step.one(value) for value in values) if v is not None]
+            if not values:
+                break
+        return values
+
+    def get_many(self, datas):
+        """
+        Evalúa la ruta sobre un lote: cada paso se aplica a todo el lote.
+        """
+        if self.many:
+            return [self.get(data) for data in datas]
+        values = list(datas)
+        for step in self.steps:
+            values = [None if value is None else step.one(value) for value in values]
+        return values
+
+
+class Const:
+    many = False
+
+    def __init__(self, value):
+        self.value = value
+        self.expr = CONST_PREFIX + value
+
+    def __repr__(self):
+        return f"Const({self.value!r})"
+
+    def get(self, data):
+        return self.value
+
+    def get_many(self, datas):
+        return [self.value] * len(datas)
+
+
+@lru_cache(maxsize=4096)
+def compile_path(expr):
+    """
+    Compila una fuente de params_map (ruta o $const:). Lanza PathError.
+    """
+    if isinstance(expr, str) and expr.startswith(CONST_PREFIX):
+        return Const(expr[len(CONST_PREFIX):])
+    return Path(expr, _parse(expr))
+
+
+def _compile_source(source):
+    # lru_cache requiere claves hashables
+    if not isinstance(source, str):
+        raise PathError(f"la ruta debe ser texto, no {type(source).__name__}")
+    return compile_path(source)
+
+
+# =====================
+# PARAMS_MAP COMPILADO
+# =====================
+class ParamsMap:
+    """
+    params_map compilado: {param_ga4: accessor}.
+    """
+
+    def __init__(self, accessors):
+        self.accessors = tuple(accessors)
+
+    def __len__(self):
+        return len(self.accessors)
+
+    def __iter__(self):
+        return iter(self.accessors)
+
+    @staticmethod
+    def _keep(accessor, value):
+        # Sin valor, o comodín/filtro sin coincidencias → el parámetro no se
+        # envía. Una lista vacía del payload en una ruta simple se envía tal cual.
+        if value is None:
+            return False
+        return not (accessor.many and value == [])
+
+    def evaluate(self, data):
+        params = {}
+        for name, accessor in self.accessors:
+            value = accessor.get(data)
+            if self._keep(accessor, value):
+                params[name] = value
+        return params
+
+    def evaluate_many(self, datas):
+        """
+        Evalúa el map sobre un lote de payloads, columna por columna.
+        """
+        results = [{} for _ in datas]
+        for name, accessor in self.accessors:
+            for params, value in zip(results, accessor.get_many(datas)):
+                if self._keep(accessor, value):
+                    params[name] = value
+        return results
+
+
+def compile_params_map(params_map, strict=True):
+    """
+    Compila un dict {param: fuente}. Con strict=False las fuentes inválidas
+    se omiten; con strict=True se lanza PathError con todos los errores.
+    """
+    if params_map is None:
+        params_map = {}
+    if not isinstance(params_map, dict):
+        raise PathError("params_map debe ser un objeto JSON {param: ruta}")
+
+    accessors = []
+    errors = []
+    for name, source in params_map.items():
+        try:
+            accessors.append((name, _compile_source(source)))
+        except PathError as e:
+            errors.append(f"{name}: {e}")
+    if errors and strict:
+        raise PathError("; ".join(errors))
+    return ParamsMap(accessors)
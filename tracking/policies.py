@@ -0,0 +1,158 @@
+import atexit
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from . import metrics
+from .models import IngestionPolicy
+from .rollups import apply_counts, count_events
+from .stamps import VersionStamp, VersionedCache
+from .storage import writer_lock
+
+logger = logging.getLogger(__name__)
+
+KEPT = "ok"
+DROPPED = "dropped"
+SAMPLED_OUT = "sampled_out"
+AGGREGATED = "aggregated"
+
+
+def build_policy_index():
+    return {
+        policy.event_name: (policy.action, policy.sample_percent)
+        for policy in IngestionPolicy.objects.filter(active=True)
+    }
+
+
+policies_stamp = VersionStamp("ingestion_policies")
+policies = VersionedCache(policies_stamp, build_policy_index)
+
+
+def in_sample(aid, percent):
+    # Por aid: un usuario muestreado conserva todo su recorrido
+    return zlib.crc32(str(aid).encode("utf-8")) % 100 < percent
+
+
+def decide(event, index=None):
+    """
+    Destino de un evento según su IngestionPolicy (por defecto se guarda).
+    """
+    if index is None:
+        index = policies.get()
+    action, percent = index.get(event.event, (IngestionPolicy.KEEP, 100))
+    if action == IngestionPolicy.KEEP:
+        outcome = KEPT
+    elif action == IngestionPolicy.DROP:
+        outcome = DROPPED
+    elif action == IngestionPolicy.SAMPLE:
+        outcome = KEPT if in_sample(event.aid, percent) else SAMPLED_OUT
+    else:
+        outcome = AGGREGATED
+    metrics.inc("ingest_policy_total", action=action, outcome=outcome)
+    return outcome
+
+
+# =====================
+# CONTADORES DE EVENTOS AGREGADOS
+# =====================
+class PendingCounts:
+    """
+    Conteos de eventos "solo contadores" acumulados en memoria y volcados
+    a los rollups por lotes: un hilo por proceso los vuelca cada
+    EVENT_AGGREGATE_FLUSH_INTERVAL segundos (con o sin buffer write-behind).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._pid = None
+
+    def _ensure_started(self):
+        # El hilo se crea en cada worker de gunicorn (después del fork)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._counts = Counter()
+            threading.Thread(target=self._run, name="pending-counts", daemon=True).start()
+            self._pid = os.getpid()
+
+    def add(self, events):
+        counts = count_events(events)
+        self._ensure_started()
+        with self._lock:
+            self._counts.update(counts)
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        if counts:
+            try:
+                with writer_lock(), transaction.atomic():
+                    apply_counts(counts)
+            except Exception:
+                with self._lock:
+                    self._counts.update(counts)
+                raise
+        return sum(counts.values())
+
+    def close(self):
+        if self._pid == os.getpid():
+            self.flush()
+
+    def _run(self):
+        while True:
+            time.sleep(getattr(settings, "EVENT_AGGREGATE_FLUSH_INTERVAL", 1.0))
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("❌ Error volcando contadores agregados")
+
+
+pending_counts = PendingCounts()
+atexit.register(pending_counts.close)
+
+
+def aggregate_events(events):
+    """
+    Eventos "solo contadores": se suman en memoria; nunca se escribe en los
+    rollups dentro del request.
+    """
+    if not events or getattr(settings, "EVENT_ROLLUPS", "job") == "off":
+        return
+    pending_counts.add(events)
+
+
+def partition_by_policy(pairs, index=None):
+    """
+    Separa pares (Event, data) en (a guardar, solo contadores, resultado por par).
+    """
+    if index is None:
+        index = policies.get()
+    kept, aggregated, outcomes = [], [], []
+    for event, data in pairs:
+        outcome = decide(event, index)
+        outcomes.append(outcome)
+        if outcome == KEPT:
+            kept.append((event, data))
+        elif outcome == AGGREGATED:
+            aggregated.append(event)
+    return kept, aggregated, outcomes
+
+
+def apply_policies(pairs):
+    """
+    Filtra pares (Event, data) antes de cualquier escritura o regla GA4.
+    Devuelve (pares a guardar, resultado por par).
+    """
+    kept, aggregated, outcomes = partition_by_policy(pairs)
+    aggregate_events(aggregated)
+    return kept, outcomes
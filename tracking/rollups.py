@@ -0,0 +1,179 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Event, EventRollupHour, EventRollupMinute, RollupGap, Watermark
+
+ROLLUP_MODELS = {
+    "minute": EventRollupMinute,
+    "hour": EventRollupHour,
+}
+UTM_FIELDS = ("utm_source", "utm_medium", "utm_campaign")
+WATERMARK = "rollups"
+
+
+def _key(bucket, event, path, utm_source, utm_medium, utm_campaign):
+    return (
+        bucket, event[:100], (path or "/")[:255],
+        utm_source or "", utm_medium or "", utm_campaign or "",
+    )
+
+
+def count_events(events):
+    """
+    Cuenta un lote de Event (guardados o no) por minuto y clave.
+    """
+    counts = Counter()
+    for event in events:
+        bucket = event.created_at.replace(second=0, microsecond=0)
+        counts[_key(
+            bucket, event.event, event.path,
+            event.utm_source, event.utm_medium, event.utm_campaign,
+        )] += 1
+    return counts
+
+
+def apply_counts(minute_counts):
+    """
+    Suma conteos por minuto a las tablas de minuto y de hora.
+    Un UPDATE por clave; INSERT solo la primera vez que aparece.
+    """
+    hour_counts = Counter()
+    for key, n in minute_counts.items():
+        hour_counts[(key[0].replace(minute=0),) + key[1:]] += n
+
+    for model, counts in ((EventRollupMinute, minute_counts), (EventRollupHour, hour_counts)):
+        for key, n in counts.items():
+            lookup = dict(zip(model.KEY_FIELDS, key))
+            if model.objects.filter(**lookup).update(count=F("count") + n):
+                continue
+            try:
+                with transaction.atomic():
+                    model.objects.create(count=n, **lookup)
+            except IntegrityError:
+                # Otro worker la creó entre el UPDATE y el INSERT
+                model.objects.filter(**lookup).update(count=F("count") + n)
+
+
+def record_events(events):
+    """
+    Actualización en el ingest (EVENT_ROLLUPS = "ingest").
+    """
+    if getattr(settings, "EVENT_ROLLUPS", "job") == "ingest" and events:
+        apply_counts(count_events(events))
+
+
+# =====================
+# JOB INCREMENTAL (watermark)
+# =====================
+# Los ids se asignan al insertar pero se ven recién al confirmar: una
+# transacción lenta puede confirmar ids menores que el watermark ya
+# avanzado. Los ids que faltan en cada tramo quedan en RollupGap y se
+# vuelven a buscar en cada corrida durante EVENT_ROLLUP_GAP_SECONDS
+# (un hueco por rollback nunca aparece y vence).
+ROW_FIELDS = ("id", "created_at", "event", "path", *UTM_FIELDS)
+
+
+def _count_rows(rows):
+    counts = Counter()
+    for _, created_at, event, path, *utms in rows:
+        counts[_key(created_at.replace(second=0, microsecond=0), event, path, *utms)] += 1
+    return counts
+
+
+def _missing_ids(last_id, ids, limit):
+    """
+    Ids entre last_id y ids[-1] que no están en `ids` (ordenados), los
+    `limit` más altos.
+    """
+    missing = []
+    upper = ids[-1]
+    for lower in reversed([last_id] + ids[:-1]):
+        for gap in range(upper - 1, lower, -1):
+            if len(missing) >= limit:
+                return missing
+            missing.append(gap)
+        upper = lower
+    return missing
+
+
+def rollup_gaps():
+    """
+    Cuenta los eventos que se confirmaron después de que el watermark
+    pasara su id. Devuelve cuántos encontró.
+    """
+    ttl = timedelta(seconds=getattr(settings, "EVENT_ROLLUP_GAP_SECONDS", 600))
+    with transaction.atomic():
+        RollupGap.objects.filter(seen_at__lt=timezone.now() - ttl).delete()
+        gaps = list(RollupGap.objects.select_for_update().values_list("event_id", flat=True))
+        if not gaps:
+            return 0
+        rows = list(Event.objects.filter(id__in=gaps).values_list(*ROW_FIELDS))
+        if not rows:
+            return 0
+        apply_counts(_count_rows(rows))
+        RollupGap.objects.filter(event_id__in=[row[0] for row in rows]).delete()
+    return len(rows)
+
+
+def rollup_pending(batch_size=50000):
+    """
+    Agrega los Event con id > watermark (solo el delta, nunca toda la
+    tabla) y avanza el watermark en la misma transacción, anotando los ids
+    que faltaban. Devuelve cuántos eventos se procesaron.
+    """
+    max_gaps = getattr(settings, "EVENT_ROLLUP_MAX_GAPS", 10000)
+    processed = rollup_gaps()
+    while True:
+        with transaction.atomic():
+            mark, _ = Watermark.objects.select_for_update().get_or_create(name=WATERMARK)
+            # Una sola consulta: los ids contados y los faltantes salen de la
+            # misma foto de la tabla
+            rows = list(
+                Event.objects.filter(id__gt=mark.last_id)
+                .order_by("id")
+                .values_list(*ROW_FIELDS)[:batch_size]
+            )
+            if not rows:
+                return processed
+
+            ids = [row[0] for row in rows]
+            apply_counts(_count_rows(rows))
+            missing = _missing_ids(mark.last_id, ids, max_gaps)
+            RollupGap.objects.bulk_create(
+                [RollupGap(event_id=gap) for gap in missing], ignore_conflicts=True
+            )
+
+            processed += len(rows)
+            mark.last_id = ids[-1]
+            mark.save(update_fields=["last_id", "updated_at"])
+
+
+# =====================
+# CONSULTAS
+# =====================
+def query_rollups(granularity, start, end, event=None, filters=None, group_by=(), limit=10000):
+    """
+    Serie temporal desde las tablas de rollup, nunca desde Event.
+    """
+    model = ROLLUP_MODELS[granularity]
+    qs = model.objects.filter(bucket__gte=start, bucket__lt=end)
+    if event:
+        qs = qs.filter(event=event)
+    if filters:
+        qs = qs.filter(**filters)
+    fields = ["bucket", *group_by]
+    rows = (
+        qs.values(*fields)
+        .annotate(total=Sum("count"))
+        .order_by(*fields)[:limit]
+    )
+    return [
+        {**{f: row[f] for f in group_by}, "bucket": row["bucket"].isoformat(), "count": row["total"]}
+        for row in rows
+    ]
+
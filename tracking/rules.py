@@ -0,0 +1,108 @@
+import hashlib
+import json
+import logging
+from collections import namedtuple
+
+from .matching import UrlMatcher, validate_pattern
+from .models import GA4Rule, TrackingRule
+from .paths import PathError, compile_params_map
+from .stamps import VersionStamp, VersionedCache
+
+logger = logging.getLogger(__name__)
+
+
+CompiledGA4Rule = namedtuple(
+    "CompiledGA4Rule",
+    ["id", "listen_event", "fire_event", "url_contains", "params_map", "sink", "match_type"],
+    defaults=("ga4", "contains"),
+)
+
+
+def parse_params_map(params_map):
+    params_map = params_map or {}
+    if isinstance(params_map, str):
+        try:
+            params_map = json.loads(params_map)
+        except Exception:
+            params_map = {}
+    return params_map if isinstance(params_map, dict) else {}
+
+
+def compile_rule_params(rule):
+    """
+    params_map de una regla ya compilado. Las reglas guardadas antes de la
+    validación conservan las fuentes válidas y se avisa del resto.
+    """
+    params_map = parse_params_map(rule.params_map)
+    try:
+        return compile_params_map(params_map)
+    except PathError as e:
+        logger.warning("⚠️ params_map inválido en GA4Rule %s: %s", rule.id, e)
+        return compile_params_map(params_map, strict=False)
+
+
+# =====================
+# ÍNDICE DE REGLAS GA4
+# =====================
+def build_ga4_index():
+    """
+    Carga las reglas GA4 activas una sola vez y las agrupa por listen_event,
+    con los patrones de URL de cada evento compilados en un UrlMatcher.
+    """
+    index = {}
+    for rule in GA4Rule.objects.filter(active=True).order_by("id"):
+        pattern_error = validate_pattern(rule.match_type, rule.url_contains)
+        if pattern_error:
+            logger.warning("⚠️ GA4Rule %s omitida: %s", rule.id, pattern_error)
+            continue
+        index.setdefault(rule.listen_event, []).append(CompiledGA4Rule(
+            id=rule.id,
+            listen_event=rule.listen_event,
+            fire_event=rule.fire_event,
+            url_contains=rule.url_contains or None,
+            params_map=compile_rule_params(rule),
+            sink=rule.sink,
+            match_type=rule.match_type,
+        ))
+    return {name: UrlMatcher(rules) for name, rules in index.items()}
+
+
+ga4_rules_stamp = VersionStamp("ga4_rules")
+ga4_rules = VersionedCache(ga4_rules_stamp, build_ga4_index)
+
+
+def ga4_rules_for(event_name):
+    """
+    Reglas GA4 activas para un evento, sin consultar la base de datos
+    (salvo cuando la versión cambió).
+    """
+    matcher = ga4_rules.get().get(event_name)
+    return matcher.rules if matcher else ()
+
+
+# =====================
+# RESPUESTA DE TRACKING RULES
+# =====================
+def build_tracking_rules_payload():
+    """
+    Serializa las TrackingRule activas una sola vez por versión.
+    Devuelve (cuerpo JSON en bytes, ETag fuerte).
+    """
+    data = [
+        {
+            "listen_event": r.listen_event,
+            "selector": r.selector,
+            "url_contains": r.url_contains,
+            "fire_event": r.fire_event,
+            "params_map": r.params_map,
+            "custom_js": r.custom_js
+        }
+        for r in TrackingRule.objects.filter(active=True).order_by("id")
+    ]
+    body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+    return body, etag
+
+
+tracking_rules_stamp = VersionStamp("tracking_rules")
+tracking_rules_payload = VersionedCache(tracking_rules_stamp, build_tracking_rules_payload)
@@ -0,0 +1,366 @@
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Event, Session, Watermark
+from .storage import writer_lock
+
+WATERMARK = "sessions"
+FIELDS = ("id", "aid", "event", "path", "created_at", "utm_source", "utm_medium", "utm_campaign")
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+# Sesión en curso: una lista por aid (más liviana que un modelo por
+# evento). Tiempos en microsegundos desde epoch; PK es el id de la fila
+# Session con is_open, o None si todavía no se guardó.
+STARTED, LAST, FIRST_ID, LAST_ID, EVENTS, PAGE_VIEWS, LANDING, EXIT, SOURCE, MEDIUM, CAMPAIGN, PK = range(12)
+# Filtros aid__in acotados (límite de parámetros de SQLite)
+AID_CHUNK = 500
+
+
+def _micros(dt):
+    return (dt - EPOCH) // MICROSECOND
+
+
+def _datetime(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def session_timeout():
+    """
+    Inactividad máxima dentro de una sesión, en microsegundos.
+    """
+    return getattr(settings, "SESSION_TIMEOUT_MINUTES", 30) * 60 * 1_000_000
+
+
+def _lag():
+    # Margen para inserts aún sin confirmar (mismo criterio que los rollups)
+    return timedelta(seconds=getattr(settings, "EVENT_ROLLUP_LAG_SECONDS", 30))
+
+
+# =====================
+# SESSIONIZER
+# =====================
+class Sessionizer:
+    """
+    Arma sesiones a partir de filas de Event (tuplas en el orden de
+    FIELDS). Una sesión se cierra cuando llega un evento del mismo aid
+    después de `timeout`, o con expire() cuando ya no puede recibir más.
+    Un evento que llega tarde y es anterior al inicio de la sesión abierta
+    en más de `timeout` no se une a ella: queda en `late`.
+    """
+
+    def __init__(self, open_sessions=None, timeout=None):
+        self.open = open_sessions or {}
+        self.timeout = timeout or session_timeout()
+        self.closed = []
+        self.late = []
+        # Evento más reciente visto (tiempo del stream)
+        self.latest = None
+
+    def feed(self, rows):
+        count = 0
+        for row in rows:
+            event_id, aid, event, path, created_at, utm_source, utm_medium, utm_campaign = row
+            count += 1
+            ts = _micros(created_at)
+            if self.latest is None or ts > self.latest:
+                self.latest = ts
+            page_view = 1 if event == "page_view" else 0
+            session = self.open.get(aid)
+            if session is not None and session[STARTED] - ts > self.timeout:
+                self.late.append(row)
+                continue
+            if session is not None and ts - session[LAST] > self.timeout:
+                self.closed.append((aid, session))
+                session = None
+            if session is None:
+                self.open[aid] = [
+                    ts, ts, event_id, event_id, 1, page_view, path, path,
+                    utm_source or "", utm_medium or "", utm_campaign or "", None,
+                ]
+                continue
+
+            session[EVENTS] += 1
+            session[PAGE_VIEWS] += page_view
+            session[LAST_ID] = max(session[LAST_ID], event_id)
+            session[FIRST_ID] = min(session[FIRST_ID], event_id)
+            if ts >= session[LAST]:
+                session[LAST] = ts
+                session[EXIT] = path
+            elif ts < session[STARTED]:
+                # Llegó tarde (write-behind de otro worker)
+                session[STARTED] = ts
+                session[LANDING] = path
+        return count
+
+    def expire(self, horizon):
+        """
+        Cierra las sesiones sin eventos desde antes de horizon - timeout
+        (horizon en microsegundos: todo lo anterior ya se procesó).
+        """
+        limit = horizon - self.timeout
+        for aid in [aid for aid, session in self.open.items() if session[LAST] < limit]:
+            self.closed.append((aid, self.open.pop(aid)))
+
+    def pop_closed(self):
+        closed, self.closed = self.closed, []
+        return [to_model(aid, s, is_open=False) for aid, s in closed]
+
+    def open_models(self):
+        return [to_model(aid, s, is_open=True) for aid, s in self.open.items()]
+
+
+def to_model(aid, s, is_open):
+    return Session(
+        pk=s[PK],
+        aid=aid,
+        started_at=_datetime(s[STARTED]),
+        ended_at=_datetime(s[LAST]),
+        event_count=s[EVENTS],
+        page_views=s[PAGE_VIEWS],
+        landing_path=s[LANDING],
+        exit_path=s[EXIT],
+        utm_source=s[SOURCE],
+        utm_medium=s[MEDIUM],
+        utm_campaign=s[CAMPAIGN],
+        first_event_id=s[FIRST_ID],
+        last_event_id=s[LAST_ID],
+        is_open=is_open,
+    )
+
+
+def from_model(session):
+    return [
+        _micros(session.started_at), _micros(session.ended_at),
+        session.first_event_id, session.last_event_id,
+        session.event_count, session.page_views,
+        session.landing_path, session.exit_path,
+        session.utm_source, session.utm_medium, session.utm_campaign,
+        session.pk,
+    ]
+
+
+SESSION_FIELDS = [
+    "started_at", "ended_at", "event_count", "page_views", "landing_path", "exit_path",
+    "utm_source", "utm_medium", "utm_campaign", "first_event_id", "last_event_id", "is_open",
+]
+
+
+def save_sessions(sessions):
+    """
+    Inserta las sesiones nuevas y actualiza las que ya tenían fila (las
+    abiertas cargadas de la base).
+    """
+    new = [session for session in sessions if session.pk is None]
+    existing = [session for session in sessions if session.pk is not None]
+    # ignore_conflicts + clave (aid, started_at): reprocesar es idempotente
+    Session.objects.bulk_create(new, batch_size=1000, ignore_conflicts=True)
+    Session.objects.bulk_update(existing, SESSION_FIELDS, batch_size=1000)
+    return len(sessions)
+
+
+def load_current(rows, timeout=None):
+    """
+    Sesión actual de cada aid de la tanda, en el formato del Sessionizer:
+    la abierta o, si no tiene, la última ya cerrada que algún evento de la
+    tanda todavía puede extender (llegó tarde).
+    """
+    window = timedelta(microseconds=timeout or session_timeout())
+    aids = list({row[1] for row in rows})
+    oldest = min(row[4] for row in rows) - window
+    current = {}
+    for i in range(0, len(aids), AID_CHUNK):
+        chunk = aids[i:i + AID_CHUNK]
+        for session in Session.objects.filter(is_open=True, aid__in=chunk):
+            current[session.aid] = session
+        missing = [aid for aid in chunk if aid not in current]
+        if missing:
+            recent = Session.objects.filter(aid__in=missing, ended_at__gte=oldest).order_by("started_at")
+            for session in recent:
+                current[session.aid] = session
+    return {aid: from_model(session) for aid, session in current.items()}
+
+
+def close_expired(clock, timeout=None):
+    """
+    Marca cerradas las sesiones abiertas sin eventos desde antes de
+    clock - timeout (microsegundos). Devuelve cuántas cerró.
+    """
+    limit = _datetime(clock - (timeout or session_timeout()))
+    return Session.objects.filter(is_open=True, ended_at__lt=limit).update(is_open=False)
+
+
+def merge_late(rows, timeout=None):
+    """
+    Eventos tardíos que no entran en la sesión abierta de su aid: se unen
+    a la sesión guardada que tenga a menos de `timeout` (de cualquier
+    lado), o forman una sesión propia ya cerrada.
+    """
+    window = timedelta(microseconds=timeout or session_timeout())
+    created = 0
+    for event_id, aid, event, path, created_at, utm_source, utm_medium, utm_campaign in rows:
+        page_view = 1 if event == "page_view" else 0
+        session = (
+            Session.objects.filter(
+                aid=aid, started_at__lte=created_at + window, ended_at__gte=created_at - window
+            )
+            .order_by("started_at")
+            .first()
+        )
+        if session is None:
+            Session.objects.bulk_create([Session(
+                aid=aid, started_at=created_at, ended_at=created_at,
+                event_count=1, page_views=page_view, landing_path=path, exit_path=path,
+                utm_source=utm_source or "", utm_medium=utm_medium or "",
+                utm_campaign=utm_campaign or "",
+                first_event_id=event_id, last_event_id=event_id,
+            )], ignore_conflicts=True)
+            created += 1
+            continue
+        session.event_count += 1
+        session.page_views += page_view
+        session.first_event_id = min(session.first_event_id, event_id)
+        session.last_event_id = max(session.last_event_id, event_id)
+        if created_at < session.started_at:
+            session.started_at = created_at
+            session.landing_path = path
+        elif created_at > session.ended_at:
+            session.ended_at = created_at
+            session.exit_path = path
+        session.save(update_fields=SESSION_FIELDS)
+    return created
+
+
+# =====================
+# JOB INCREMENTAL (watermark)
+# =====================
+def sessionize_pending(batch_size=2000):
+    """
+    Procesa los Event con id > watermark en orden de id, por tandas chicas
+    (cada una con su lock y su transacción). Las sesiones abiertas viven
+    en Session (is_open): cada tanda carga solo las de sus aids. Una
+    sesión ya cerrada que un evento tardío extiende se reabre y vuelve a
+    cerrarse con close_expired().
+    Devuelve (eventos procesados, sesiones cerradas).
+    """
+    processed = 0
+    saved = 0
+    while True:
+        with writer_lock(), transaction.atomic():
+            mark, _ = Watermark.objects.select_for_update().get_or_create(name=WATERMARK)
+            horizon = timezone.now() - _lag()
+            pending = Event.objects.filter(id__gt=mark.last_id, created_at__lt=horizon)
+            ids = list(pending.order_by("id").values_list("id", flat=True)[batch_size - 1:batch_size])
+            upper = ids[0] if ids else pending.aggregate(top=Max("id"))["top"]
+
+            latest = None
+            if upper is not None:
+                rows = list(
+                    Event.objects.filter(id__gt=mark.last_id, id__lte=upper)
+                    .order_by("id")
+                    .values_list(*FIELDS)
+                )
+                sessionizer = Sessionizer(load_current(rows))
+                processed += sessionizer.feed(rows)
+                closed = sessionizer.pop_closed()
+                save_sessions(closed + sessionizer.open_models())
+                saved += len(closed) + merge_late(sessionizer.late)
+                latest = sessionizer.latest
+                mark.last_id = upper
+            # Con más tandas pendientes (poniéndose al día) el reloj es el
+            # del stream, no el de pared: los eventos siguientes aún pueden
+            # extender sesiones que a esta hora ya estarían vencidas
+            clock = _micros(horizon)
+            if ids and latest is not None:
+                clock = min(clock, latest - _lag() // MICROSECOND)
+            saved += close_expired(clock)
+            mark.save(update_fields=["last_id", "updated_at"])
+        if upper is None:
+            return processed, saved
+
+
+# =====================
+# BACKFILL EN PARALELO
+# =====================
+def partition_of(aid, partitions):
+    return zlib.crc32(aid.encode("utf-8")) % partitions
+
+
+def backfill_partition(aids, upper, horizon, since=None, chunk_size=500):
+    """
+    Sesiones de una lista de aids con todos sus eventos hasta `upper`,
+    leídos por (aid, created_at): cada aid se recorre completo y sus
+    sesiones se cierran antes de pasar al siguiente bloque.
+    Devuelve (eventos, sesiones guardadas, sesiones aún abiertas).
+    """
+    sessionizer = Sessionizer()
+    processed = 0
+    saved = 0
+    for i in range(0, len(aids), chunk_size):
+        rows = Event.objects.filter(aid__in=aids[i:i + chunk_size], id__lte=upper)
+        if since is not None:
+            rows = rows.filter(created_at__gte=since)
+        rows = rows.order_by("aid", "created_at", "id").values_list(*FIELDS)
+        processed += sessionizer.feed(rows.iterator(chunk_size=5000))
+        sessionizer.expire(horizon)
+        closed = sessionizer.pop_closed()
+        with writer_lock(), transaction.atomic():
+            saved += save_sessions(closed)
+    return processed, saved, sessionizer.open
+
+
+def _backfill_worker(args):
+    # Proceso hijo: conexiones propias (las del padre se cerraron antes del fork)
+    try:
+        return backfill_partition(*args)
+    finally:
+        connections.close_all()
+
+
+def backfill_sessions(workers=4, since=None):
+    """
+    Reconstruye las sesiones de todos los eventos existentes repartiendo
+    los aids por hash entre `workers` procesos. Al terminar guarda las
+    sesiones abiertas (is_open) y deja el watermark en el último evento
+    procesado, para que sessionize_pending siga desde ahí.
+    Devuelve (eventos procesados, sesiones guardadas).
+    """
+    upper = Event.objects.aggregate(top=Max("id"))["top"]
+    if upper is None:
+        return 0, 0
+    horizon = _micros(timezone.now() - _lag())
+
+    events = Event.objects.filter(id__lte=upper)
+    if since is not None:
+        events = events.filter(created_at__gte=since)
+    partitions = [[] for _ in range(workers)]
+    for aid in events.order_by().values_list("aid", flat=True).distinct().iterator():
+        partitions[partition_of(aid, workers)].append(aid)
+
+    jobs = [(aids, upper, horizon, since) for aids in partitions if aids]
+    if workers == 1 or len(jobs) <= 1:
+        results = [backfill_partition(*job) for job in jobs]
+    else:
+        connections.close_all()
+        with ProcessPoolExecutor(len(jobs), mp_context=get_context("fork")) as pool:
+            results = list(pool.map(_backfill_worker, jobs))
+
+    sessionizer = Sessionizer()
+    for _, _, partition_open in results:
+        sessionizer.open.update(partition_open)
+    with writer_lock(), transaction.atomic():
+        # Las abiertas se reconstruyeron desde los eventos
+        Session.objects.filter(is_open=True).delete()
+        save_sessions(sessionizer.open_models())
+        mark, _ = Watermark.objects.select_for_update().get_or_create(name=WATERMARK)
+        mark.last_id = upper
+        mark.save(update_fields=["last_id", "updated_at"])
+
+    return sum(r[0] for r in results), sum(r[1] for r in results)
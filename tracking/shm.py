@@ -0,0 +1,255 @@
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from .stamps import state_dir
+
+# =====================
+# MEMORIA COMPARTIDA ENTRE WORKERS
+# =====================
+# Archivos de tamaño fijo en <TRACKING_STATE_DIR>/shm mapeados con mmap por
+# cada worker. Toda lectura/escritura va bajo flock: las operaciones se
+# hacen por lote para tomar el lock una vez por request.
+
+
+class SharedMemory:
+    """
+    Región de `size` bytes respaldada por un archivo. `header` identifica
+    el formato y va (como hash) en el nombre del archivo: otra
+    configuración usa otro archivo y nunca se trunca uno que algún worker
+    tenga mapeado (eso lo mataría con SIGBUS o le borraría el estado).
+    """
+
+    def __init__(self, name, size, header):
+        self.name = name
+        self.size = size
+        self.header = header
+        self._lock = threading.Lock()
+        self._pid = None
+        self._file = None
+        self._buf = None
+
+    @property
+    def path(self):
+        version = hashlib.sha1(self.header + struct.pack("<Q", self.size)).hexdigest()[:12]
+        return os.path.join(state_dir("shm"), f"{self.name}-{version}.shm")
+
+    def _create(self, path, replace=False):
+        # Se arma completo en un temporal y aparece de una vez: os.link no
+        # pisa el que haya creado otro worker; os.replace (archivo dañado)
+        # deja a los que ya lo tenían mapeado con el inodo anterior
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{self.name}-")
+        try:
+            with os.fdopen(fd, "r+b") as f:
+                f.truncate(self.size)
+                f.write(self.header)
+            if replace:
+                os.replace(tmp, path)
+                return
+            try:
+                os.link(tmp, path)
+            except FileExistsError:
+                pass
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def _valid(self, f):
+        f.seek(0)
+        return os.fstat(f.fileno()).st_size == self.size and f.read(len(self.header)) == self.header
+
+    def _open(self):
+        # flock es por descripción de archivo: tras el fork cada worker
+        # necesita la suya o compartiría el lock con el padre
+        if self._pid == os.getpid():
+            return
+        path = self.path
+        if not os.path.exists(path):
+            self._create(path)
+        f = open(path, "r+b")
+        if not self._valid(f):
+            f.close()
+            self._create(path, replace=True)
+            f = open(path, "r+b")
+        self._file = f
+        self._buf = mmap.mmap(f.fileno(), self.size)
+        self._pid = os.getpid()
+
+    @contextmanager
+    def locked(self):
+        """
+        Acceso exclusivo a la región (entre hilos y entre procesos).
+        """
+        with self._lock:
+            self._open()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                yield self._buf
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+
+# =====================
+# BLOOM FILTER ROTATIVO
+# =====================
+class RotatingBloomFilter:
+    """
+    Conjunto aproximado con ventana de tiempo y memoria fija: dos bloom
+    filters que se alternan cada `window` segundos. Una clave se recuerda
+    entre `window` y 2 × `window` segundos.
+
+    `capacity` son las claves esperadas por ventana y `error_rate` la
+    probabilidad de falso positivo de cada filtro (un falso positivo
+    descarta un evento legítimo).
+    """
+
+    MAGIC = b"CTBLOOM1"
+    # magic, bits por filtro, hashes, ventana, época de cada filtro
+    HEADER = struct.Struct("<8sQIdqq")
+
+    def __init__(self, name, capacity=1_000_000, error_rate=0.001, window=900):
+        self.bits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.window = window
+        self.slice_bytes = (self.bits + 7) // 8
+        header = self.HEADER.pack(self.MAGIC, self.bits, self.hashes, float(window), 0, 0)
+        self.memory = SharedMemory(
+            name, self.HEADER.size + 2 * self.slice_bytes, header[:self.HEADER.size - 16]
+        )
+
+    def _positions(self, digest):
+        # Doble hashing sobre un digest ya uniforme (sha1 / blake2)
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in range(self.hashes)]
+
+    def _rotate(self, buf, epoch):
+        epochs = list(struct.unpack_from("<qq", buf, self.HEADER.size - 16))
+        current = epoch % 2
+        if epochs[current] != epoch:
+            start = self.HEADER.size + current * self.slice_bytes
+            buf[start:start + self.slice_bytes] = bytes(self.slice_bytes)
+            epochs[current] = epoch
+            struct.pack_into("<qq", buf, self.HEADER.size - 16, *epochs)
+        return current, epochs[1 - current] == epoch - 1
+
+    def _contains(self, buf, offset, positions):
+        for position in positions:
+            if not buf[offset + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def _lookup(self, digests, add):
+        if not digests:
+            return []
+        epoch = int(time.time() // self.window)
+        seen = []
+        batch = set()
+        with self.memory.locked() as buf:
+            current, previous_valid = self._rotate(buf, epoch)
+            current_offset = self.HEADER.size + current * self.slice_bytes
+            previous_offset = self.HEADER.size + (1 - current) * self.slice_bytes
+            for digest in digests:
+                positions = self._positions(digest)
+                if digest in batch or self._contains(buf, current_offset, positions) or (
+                    previous_valid and self._contains(buf, previous_offset, positions)
+                ):
+                    seen.append(True)
+                    continue
+                batch.add(digest)
+                if add:
+                    for position in positions:
+                        index = current_offset + (position >> 3)
+                        buf[index] |= 1 << (position & 7)
+                seen.append(False)
+        return seen
+
+    def contains_many(self, digests):
+        """
+        Por cada clave, si ya estaba (dentro de la ventana o antes en el
+        mismo lote), sin agregarla.
+        """
+        return self._lookup(digests, add=False)
+
+    def add_many(self, digests):
+        """
+        Agrega las claves y devuelve, por cada una, si ya estaba (dentro de
+        la ventana o antes en el mismo lote).
+        """
+        return self._lookup(digests, add=True)
+
+
+# =====================
+# TOKEN BUCKETS
+# =====================
+class TokenBuckets:
+    """
+    Tabla hash de token buckets de tamaño fijo: `slots` entradas
+    (clave, tokens, última recarga) con sondeo lineal de `probes`
+    posiciones. Si no hay lugar se reemplaza la entrada más vieja del
+    sondeo (vuelve a empezar con la ráfaga completa, lo mismo que tendría
+    tras estar inactiva).
+    """
+
+    MAGIC = b"CTBUCKET"
+    HEADER = struct.Struct("<8sII")
+    SLOT = struct.Struct("<Qdd")
+
+    def __init__(self, name, slots=65536, probes=8):
+        self.slots = slots
+        self.probes = probes
+        header = self.HEADER.pack(self.MAGIC, slots, probes)
+        self.memory = SharedMemory(name, self.HEADER.size + slots * self.SLOT.size, header)
+
+    def _offset(self, index):
+        return self.HEADER.size + index * self.SLOT.size
+
+    def _find(self, buf, key):
+        base = key % self.slots
+        empty = oldest = None
+        oldest_at = None
+        for i in range(self.probes):
+            offset = self._offset((base + i) % self.slots)
+            slot_key, tokens, updated = self.SLOT.unpack_from(buf, offset)
+            if slot_key == key:
+                return offset, tokens, updated
+            if slot_key == 0:
+                if empty is None:
+                    empty = offset
+            elif oldest_at is None or updated < oldest_at:
+                oldest, oldest_at = offset, updated
+        return (empty if empty is not None else oldest), None, None
+
+    def take_many(self, requests):
+        """
+        requests: [(digest, tokens por segundo, ráfaga, costo)]. Descuenta
+        el costo completo o nada. Devuelve, por cada uno, 0 si se admitió o
+        los segundos que faltan para tener tokens suficientes.
+        """
+        if not requests:
+            return []
+        now = time.time()
+        waits = []
+        with self.memory.locked() as buf:
+            for digest, rate, burst, cost in requests:
+                key = int.from_bytes(digest[:8], "little") or 1
+                offset, tokens, updated = self._find(buf, key)
+                if tokens is None:
+                    tokens = float(burst)
+                else:
+                    tokens = min(float(burst), tokens + max(0.0, now - updated) * rate)
+                if tokens >= cost:
+                    tokens -= cost
+                    waits.append(0)
+                else:
+                    waits.append((cost - tokens) / rate if rate > 0 else float("inf"))
+                self.SLOT.pack_into(buf, offset, key, tokens, now)
+        return waits
@@ -0,0 +1,24 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import GA4Rule, IngestionPolicy, TrackingRule
+from .policies import policies_stamp
+from .rules import ga4_rules_stamp, tracking_rules_stamp
+
+
+@receiver([post_save, post_delete], sender=GA4Rule)
+def ga4_rule_changed(sender, **kwargs):
+    # Nuevo stamp al confirmar: este proceso recarga al instante y los
+    # demás workers en cuanto revisan la versión.
+    transaction.on_commit(ga4_rules_stamp.bump)
+
+
+@receiver([post_save, post_delete], sender=TrackingRule)
+def tracking_rule_changed(sender, **kwargs):
+    transaction.on_commit(tracking_rules_stamp.bump)
+
+
+@receiver([post_save, post_delete], sender=IngestionPolicy)
+def ingestion_policy_changed(sender, **kwargs):
+    transaction.on_commit(policies_stamp.bump)
@@ -0,0 +1,329 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+from .ga4 import dispatcher
+from .stamps import state_dir
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SINK = "ga4"
+
+
+# =====================
+# BASE
+# =====================
+class Sink:
+    """
+    Destino de eventos con su propia cola acotada, grupo de workers y
+    política de lotes. Un sink lento o caído solo llena (y descarta) su
+    cola: nunca frena el ingest ni a los demás sinks.
+
+    Las subclases implementan write_batch(records). Cada record es un dict
+    con name, client_id, params, path y ts.
+    """
+
+    def __init__(self, name, workers=1, queue_size=10000, batch_size=100,
+                 batch_wait=0.5, mirror=False):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.mirror = mirror
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._pending = 0
+
+    def _ensure_started(self):
+        # Los hilos se crean en cada worker de gunicorn (después del fork)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._pending = 0
+            self.setup()
+            for i in range(self.workers):
+                threading.Thread(
+                    target=self._worker, name=f"sink-{self.name}-{i}", daemon=True
+                ).start()
+            self._pid = os.getpid()
+
+    def setup(self):
+        """
+        Recursos por proceso (sesiones HTTP, archivos). Corre tras el fork.
+        """
+
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def emit(self, record):
+        """
+        Encola un record. Devuelve False si se descartó (cola llena).
+        """
+        self._ensure_started()
+        with self._lock:
+            self._pending += 1
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self._pending -= 1
+            metrics.inc("sink_dropped_total", sink=self.name, reason="queue_full")
+            return False
+        metrics.inc("sink_enqueued_total", sink=self.name)
+        return True
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._next_batch()
+            start = time.perf_counter()
+            try:
+                self.write_batch(batch)
+            except Exception:
+                metrics.inc("sink_errors_total", sink=self.name)
+                metrics.inc("sink_dropped_total", len(batch), sink=self.name, reason="error")
+                logger.exception("❌ Error en sink %s (%s eventos)", self.name, len(batch))
+            else:
+                metrics.inc("sink_written_total", len(batch), sink=self.name)
+            finally:
+                metrics.observe("sink_batch_seconds", time.perf_counter() - start, sink=self.name)
+                with self._lock:
+                    self._pending -= len(batch)
+
+    def write_batch(self, records):
+        raise NotImplementedError
+
+    def drain(self, timeout=None):
+        if self._queue is None or self._pid != os.getpid():
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._pending > 0:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+# =====================
+# SINKS
+# =====================
+class GA4Sink(Sink):
+    """
+    Measurement Protocol. Usa el dispatcher de tracking.ga4, que ya tiene
+    su cola, coalescedor por client_id y pool HTTP propios.
+    """
+
+    def __init__(self, name, **options):
+        super().__init__(name, **options)
+        self.dispatcher = dispatcher
+
+    def emit(self, record):
+        return self.dispatcher.enqueue(
+            event_name=record["name"],
+            client_id=record["client_id"],
+            params=record["params"],
+        )
+
+    def depth(self):
+        return self.dispatcher.queue_depth()
+
+    def drain(self, timeout=None):
+        return self.dispatcher.drain(timeout)
+
+
+class WebhookSink(Sink):
+    """
+    POST de cada lote como array JSON a `url`.
+    """
+
+    def __init__(self, name, url, headers=None, timeout=5, **options):
+        super().__init__(name, **options)
+        self.url = url
+        self.headers = {"Content-Type": "application/json", **(headers or {})}
+        self.timeout = timeout
+        self._session = None
+
+    def setup(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self._session = session
+
+    def write_batch(self, records):
+        response = self._session.post(
+            self.url,
+            data=json.dumps(records, separators=(",", ":"), default=str),
+            headers=self.headers,
+            timeout=self.timeout,
+        )
+        metrics.inc("sink_responses_total", sink=self.name, status=response.status_code)
+        response.raise_for_status()
+
+
+class NDJSONFileSink(Sink):
+    """
+    Un archivo NDJSON por día y proceso: <directory>/<prefijo>-YYYY-MM-DD-<pid>.ndjson
+    """
+
+    def __init__(self, name, directory=None, prefix="events", **options):
+        options["workers"] = 1  # un escritor por archivo
+        super().__init__(name, **options)
+        self.directory = directory
+        self.prefix = prefix
+
+    def _path(self):
+        directory = self.directory or state_dir("sinks", self.name)
+        os.makedirs(directory, exist_ok=True)
+        day = datetime.now(dt_timezone.utc).strftime("%Y-%m-%d")
+        return os.path.join(directory, f"{self.prefix}-{day}-{os.getpid()}.ndjson")
+
+    def write_batch(self, records):
+        lines = "".join(
+            json.dumps(record, separators=(",", ":"), ensure_ascii=False, default=str) + "\n"
+            for record in records
+        )
+        with open(self._path(), "a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+class NullSink(Sink):
+    """
+    Descarta todo (pruebas de carga sin destinos externos).
+    """
+
+    def write_batch(self, records):
+        pass
+
+
+# =====================
+# REGISTRO
+# =====================
+_sinks = None
+_sinks_lock = threading.Lock()
+
+
+def build_sinks(config):
+    """
+    Construye los sinks de TRACKING_SINKS ({nombre: {"class": ..., opciones}}).
+    Una configuración inválida lanza ImproperlyConfigured.
+    """
+    if not isinstance(config, dict):
+        raise ImproperlyConfigured("TRACKING_SINKS debe ser un objeto {nombre: opciones}")
+    sinks = {}
+    for name, options in config.items():
+        if not isinstance(options, dict) or not isinstance(options.get("class"), str):
+            raise ImproperlyConfigured(
+                f"TRACKING_SINKS[{name!r}] debe ser un objeto con 'class'"
+            )
+        options = dict(options)
+        path = options.pop("class")
+        try:
+            cls = import_string(path)
+        except ImportError as e:
+            raise ImproperlyConfigured(f"TRACKING_SINKS[{name!r}]: {e}") from e
+        if not (isinstance(cls, type) and issubclass(cls, Sink)):
+            raise ImproperlyConfigured(f"TRACKING_SINKS[{name!r}]: {path} no es un Sink")
+        try:
+            sinks[name] = cls(name, **options)
+        except (TypeError, ValueError) as e:
+            raise ImproperlyConfigured(f"TRACKING_SINKS[{name!r}]: {e}") from e
+    return sinks
+
+
+def get_sinks():
+    global _sinks
+    if _sinks is None:
+        with _sinks_lock:
+            if _sinks is None:
+                sinks = build_sinks(getattr(settings, "TRACKING_SINKS", {}) or {
+                    DEFAULT_SINK: {"class": "tracking.sinks.GA4Sink"},
+                })
+                for name, sink in sinks.items():
+                    metrics.register_gauge(f"sink_{name}_queue_depth", sink.depth)
+                _sinks = sinks
+    return _sinks
+
+
+def get_sink(name):
+    return get_sinks().get(name or DEFAULT_SINK)
+
+
+def is_ga4_sink(name):
+    return isinstance(get_sink(name), GA4Sink)
+
+
+def make_record(name, client_id, params, path=None, ts=None):
+    return {
+        "name": name,
+        "client_id": client_id,
+        "params": params or {},
+        "path": path,
+        "ts": (ts or datetime.now(dt_timezone.utc)).isoformat(),
+    }
+
+
+def dispatch_hits(hits):
+    """
+    Envía (fire_event, client_id, params, sink) de las reglas GA4 a su sink.
+    """
+    for fire_event, client_id, params, sink_name in hits:
+        sink = get_sink(sink_name)
+        if sink is None:
+            metrics.inc("sink_dropped_total", sink=sink_name, reason="unknown_sink")
+            logger.warning("⚠️ Sink desconocido: %s", sink_name)
+            continue
+        sink.emit(make_record(fire_event, client_id, params, params.get("page_location")))
+
+
+def mirror_events(pairs):
+    """
+    Copia cada evento guardado a los sinks con mirror=True.
+    """
+    mirrors = [sink for sink in get_sinks().values() if sink.mirror]
+    if not mirrors:
+        return
+    for event, data in pairs:
+        params = data.get("params", data) if isinstance(data, dict) else {}
+        record = make_record(event.event, event.aid, params, event.path, event.created_at)
+        for sink in mirrors:
+            sink.emit(record)
+
+
+def drain_all(timeout=2):
+    if _sinks is None:
+        return
+    for sink in _sinks.values():
+        sink.drain(timeout)
+
+
+atexit.register(drain_all)
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+
+def state_dir(*parts):
+    """
+    Directorio local compartido por todos los workers de la máquina.
+    """
+    base = getattr(settings, "TRACKING_STATE_DIR", None) or os.path.join(
+        tempfile.gettempdir(), "clarotrack"
+    )
+    path = os.path.join(base, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+# =====================
+# VERSIONES ENTRE WORKERS
+# =====================
+class VersionStamp:
+    """
+    Marca de versión basada en un archivo. bump() lo reemplaza y los demás
+    workers lo detectan con un os.stat() como máximo cada `interval` segundos.
+    """
+
+    def __init__(self, name, interval=None, path=None):
+        self.name = name
+        self.interval = interval
+        self._path = path
+        self._value = None
+        self._checked = None
+
+    @property
+    def path(self):
+        if self._path is not None:
+            return str(self._path)
+        return os.path.join(state_dir(), f"{self.name}.version")
+
+    def _interval(self):
+        if self.interval is not None:
+            return self.interval
+        return getattr(settings, "RULES_VERSION_CHECK_INTERVAL", 2)
+
+    def _read(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def current(self):
+        now = time.monotonic()
+        if self._checked is None or now - self._checked >= self._interval():
+            self._value = self._read()
+            self._checked = now
+        return self._value
+
+    def bump(self):
+        path = self.path
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(tmp, path)
+        self._value = self._read()
+        self._checked = time.monotonic()
+
+
+class MultiStamp:
+    """
+    Combina varios stamps: la versión cambia si cambia cualquiera.
+    """
+
+    def __init__(self, *stamps):
+        self.stamps = stamps
+
+    def current(self):
+        return tuple(stamp.current() for stamp in self.stamps)
+
+
+class VersionedCache:
+    """
+    Guarda el resultado de `build()` y lo reconstruye solo cuando cambia la
+    versión del stamp (o tras invalidate() en este proceso).
+    """
+
+    def __init__(self, stamp, build):
+        self.stamp = stamp
+        self.build = build
+        self._lock = threading.Lock()
+        self._version = None
+        self._value = None
+        self._valid = False
+
+    def get(self):
+        version = self.stamp.current()
+        if self._valid and version == self._version:
+            return self._value
+        with self._lock:
+            version = self.stamp.current()
+            if not (self._valid and version == self._version):
+                self._value = self.build()
+                self._version = version
+                self._valid = True
+            return self._value
+
+    async def aget(self):
+        """
+        get() para vistas async: si la versión no cambió no sale del event
+        loop; si hay que reconstruir, build() corre en un hilo.
+        """
+        if self._valid and self.stamp.current() == self._version:
+            return self._value
+        return await sync_to_async(self.get)()
+
+    def invalidate(self):
+        self._valid = False
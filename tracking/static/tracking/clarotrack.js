@@ -36,11 +36,10 @@ async function isGA4ReallyWorking() {
   }
 
 
-  async function initClaroTrack() {
+  // Una sola sonda GA4: el resultado se reutiliza en la inicialización
+  function initClaroTrack(ga4Works) {
     console.log('🚀 [ClaroTrack] Inicializando sistema de tracking...');
 
-  const ga4Works = await isGA4ReallyWorking();
-
   console.log('🔍 [ClaroTrack] GA4 realmente funcional:', ga4Works);
 
   if (ga4Works) {
@@ -50,7 +49,13 @@ async function isGA4ReallyWorking() {
 
   console.log('✅ [ClaroTrack] GA4 BLOQUEADO → ClaroTrack toma control');
 
-    const API = 'https://claro-tracker.onrender.com/api/collect/';
+    const API = 'https://claro-tracker.onrender.com/api/collect/batch/';
+
+    // Cola de envío: un POST por lote en vez de uno por evento
+    const MAX_BATCH = 20;
+    const FLUSH_MS = 5000;
+    // Ventana para agrupar eventos repetidos (teclado, touchmove, mouse)
+    const COALESCE_MS = 1000;
 
     // =========================
     // ID anónimo
@@ -78,21 +83,105 @@ async function isGA4ReallyWorking() {
 
 
     // =========================
-    // Enviar evento
+    // Enviar evento (cola + lote)
     // =========================
-    function send(eventName, params = {}) {
-  fetch(API, {
-    method: 'POST',
-    headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({
-      aid: getAid(),
-      event: eventName,
-      params,               // 👈 limpio
-      path: location.pathname,
-      ts: Date.now()
-    })
-  }).catch(() => {});
-}
+    let queue = [];
+    let flushTimer = null;
+
+    // ts fijo por ítem del dataLayer (propiedad no enumerable): el reenvío
+    // inicial, el push interceptado y un segundo ClaroTrack en la página
+    // mandan el mismo ts y el servidor descarta los repetidos
+    function stampTs(item) {
+      if (!item || typeof item !== 'object') return Date.now();
+      if (item.__ctTs === undefined) {
+        try {
+          Object.defineProperty(item, '__ctTs', { value: Date.now() });
+        } catch {
+          return Date.now();
+        }
+      }
+      return item.__ctTs;
+    }
+
+    function send(eventName, params = {}, ts = Date.now()) {
+      queue.push({
+        aid: getAid(),
+        event: eventName,
+        params,               // 👈 limpio
+        path: location.pathname,
+        ts
+      });
+
+      if (queue.length >= MAX_BATCH) {
+        flush();
+      } else if (!flushTimer) {
+        flushTimer = setTimeout(flush, FLUSH_MS);
+      }
+    }
+
+    function flush() {
+      clearTimeout(flushTimer);
+      flushTimer = null;
+      if (!queue.length) return;
+
+      const batch = queue;
+      queue = [];
+
+      // text/plain: petición CORS simple (sin preflight); el servidor
+      // lee el cuerpo crudo como array JSON
+      const body = JSON.stringify(batch);
+      const blob = new Blob([body], { type: 'text/plain' });
+
+      if (navigator.sendBeacon && navigator.sendBeacon(API, blob)) return;
+
+      fetch(API, {
+        method: 'POST',
+        headers: { 'Content-Type': 'text/plain' },
+        body,
+        keepalive: true
+      }).catch(() => {});
+    }
+
+    // =========================
+    // Helpers de frecuencia
+    // =========================
+    const coalesced = {};
+
+    // Acumula repeticiones y emite un solo evento con `count`
+    function coalesce(eventName, params = {}) {
+      const entry = coalesced[eventName] ||
+        (coalesced[eventName] = { count: 0, params: null, timer: null });
+      entry.count += 1;
+      entry.params = params;
+      if (!entry.timer) {
+        entry.timer = setTimeout(() => emitCoalesced(eventName), COALESCE_MS);
+      }
+    }
+
+    function emitCoalesced(eventName) {
+      const entry = coalesced[eventName];
+      if (!entry || !entry.count) return;
+      clearTimeout(entry.timer);
+      pushEvent(eventName, { ...entry.params, count: entry.count });
+      delete coalesced[eventName];
+    }
+
+    function emitAllCoalesced() {
+      Object.keys(coalesced).forEach(emitCoalesced);
+    }
+
+    // Como mucho una ejecución por frame
+    function rafThrottle(fn) {
+      let scheduled = false;
+      return (...args) => {
+        if (scheduled) return;
+        scheduled = true;
+        requestAnimationFrame(() => {
+          scheduled = false;
+          fn(...args);
+        });
+      };
+    }
 
 
     // =========================
@@ -120,6 +209,13 @@ async function isGA4ReallyWorking() {
     }
 
     async function loadRules() {
+      // Bundle versionado: las reglas ya vienen incrustadas
+      if (Array.isArray(window.__CLAROTRACK_RULES__)) {
+        dynamicRules = window.__CLAROTRACK_RULES__;
+        console.log('📜 [ClaroTrack] Reglas incrustadas:', dynamicRules.length);
+        return;
+      }
+
       try {
         const res = await fetch(
           'https://claro-tracker.onrender.com/api/tracking_rules/'
@@ -143,7 +239,7 @@ async function isGA4ReallyWorking() {
     // =========================
     window.dataLayer.forEach(item => {
       if (item && item.event) {
-        send(item.event, extractParams(item));
+        send(item.event, extractParams(item), stampTs(item));
         applyRules(item.event, item);
       }
     });
@@ -156,7 +252,7 @@ async function isGA4ReallyWorking() {
     window.dataLayer.push = function (...args) {
       args.forEach(item => {
         if (item && item.event) {
-          send(item.event, item);
+          send(item.event, item, stampTs(item));
           applyRules(item.event, item);
         }
       });
@@ -183,11 +279,23 @@ async function isGA4ReallyWorking() {
       window.addEventListener('load', firePageView);
     }
 
-    window.addEventListener('beforeunload', () => pushEvent('page_unload'));
+    // Al ocultarse la página se vacían resúmenes y cola (sendBeacon
+    // sobrevive a la descarga; beforeunload no es fiable en móviles)
+    function flushAll() {
+      emitAllCoalesced();
+      emitScrollSummary();
+      flush();
+    }
+
+    window.addEventListener('pagehide', () => {
+      pushEvent('page_unload');
+      flushAll();
+    });
 
-    document.addEventListener('visibilitychange', () =>
-      pushEvent('visibility_change', { state: document.visibilityState })
-    );
+    document.addEventListener('visibilitychange', () => {
+      pushEvent('visibility_change', { state: document.visibilityState });
+      if (document.visibilityState === 'hidden') flushAll();
+    });
 
     window.addEventListener('hashchange', () =>
       pushEvent('hash_change', { hash: location.hash })
@@ -200,16 +308,22 @@ async function isGA4ReallyWorking() {
     // =========================
     // 4️⃣ Click & Interaction
     // =========================
-    ['click', 'dblclick', 'contextmenu', 'mousedown', 'mouseup'].forEach(ev =>
-      document.addEventListener(ev, e => {
-        const el = e.target;
-        pushEvent(ev, {
-          tag: el.tagName?.toLowerCase(),
-          id: el.id || null,
-          classes: el.className || null,
-          text: el.innerText?.trim().slice(0, 50) || null
-        });
-      })
+    function clickParams(el) {
+      return {
+        tag: el.tagName?.toLowerCase(),
+        id: el.id || null,
+        classes: el.className || null,
+        text: el.innerText?.trim().slice(0, 50) || null
+      };
+    }
+
+    ['click', 'dblclick', 'contextmenu'].forEach(ev =>
+      document.addEventListener(ev, e => pushEvent(ev, clickParams(e.target)))
+    );
+
+    // mousedown/mouseup acompañan a cada click: se agrupan
+    ['mousedown', 'mouseup'].forEach(ev =>
+      document.addEventListener(ev, e => coalesce(ev, { tag: e.target.tagName?.toLowerCase() }))
     );
 
     ['input', 'change', 'submit', 'focus', 'blur'].forEach(ev =>
@@ -227,15 +341,29 @@ async function isGA4ReallyWorking() {
     // =========================
     // 5️⃣ Scroll
     // =========================
+    // Un solo evento `scroll` con la profundidad máxima (al ocultarse la
+    // página) + los hitos de scroll_depth; el cálculo va a 1 por frame
     let firedScroll = {};
+    let maxScroll = 0;
+    let reportedScroll = 0;
+
+    function emitScrollSummary() {
+      if (maxScroll > reportedScroll) {
+        reportedScroll = maxScroll;
+        pushEvent('scroll', { scroll_percent: maxScroll });
+      }
+    }
 
-    window.addEventListener('scroll', () => {
+    window.addEventListener('scroll', rafThrottle(() => {
       const scrollTop = window.scrollY;
       const docHeight =
         document.documentElement.scrollHeight - window.innerHeight;
-      const percent = Math.round((scrollTop / docHeight) * 100);
+      const percent = docHeight > 0
+        ? Math.min(100, Math.round((scrollTop / docHeight) * 100))
+        : 100;
 
-      pushEvent('scroll', { scroll_percent: percent });
+      if (percent <= maxScroll) return;
+      maxScroll = percent;
 
       [25, 50, 75, 100].forEach(p => {
         if (percent >= p && !firedScroll[p]) {
@@ -243,7 +371,7 @@ async function isGA4ReallyWorking() {
           pushEvent('scroll_depth', { percent: p });
         }
       });
-    });
+    }), { passive: true });
 
     // =========================
     // 6️⃣ Element visibility
@@ -268,9 +396,10 @@ async function isGA4ReallyWorking() {
     // =========================
     // 7️⃣ Keyboard
     // =========================
+    // Una ráfaga de teclas = un evento por tipo con `count`
     ['keydown', 'keyup', 'keypress'].forEach(ev =>
       document.addEventListener(ev, e =>
-        pushEvent(ev, { key: e.key, code: e.code })
+        coalesce(ev, { key: e.key, code: e.code })
       )
     );
 
@@ -292,12 +421,16 @@ async function isGA4ReallyWorking() {
     // =========================
     // 9️⃣ Touch
     // =========================
-    ['touchstart', 'touchend', 'touchmove'].forEach(ev =>
+    ['touchstart', 'touchend'].forEach(ev =>
       document.addEventListener(ev, e =>
         pushEvent(ev, { touches: e.touches.length })
-      )
+      , { passive: true })
     );
 
+    document.addEventListener('touchmove', e =>
+      coalesce('touchmove', { touches: e.touches.length })
+    , { passive: true });
+
     // =========================
     // 🔟 Network / errors
     // =========================
@@ -315,13 +448,14 @@ async function isGA4ReallyWorking() {
     // API pública
     // =========================
     window.ClaroTrack = {
-      track: (event, data = {}) => pushEvent(event, data)
+      track: (event, data = {}) => pushEvent(event, data),
+      flush: flushAll
     };
 
     console.log('✅ [ClaroTrack] Sistema activo');
   }
 
-  initClaroTrack();
+  initClaroTrack(ga4Works);
 
 })();
 
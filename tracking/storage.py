@@ -0,0 +1,168 @@
+import atexit
+import contextlib
+import fcntl
+import io
+import os
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .eventlog import SegmentWriter, to_ms
+from .models import Event
+from .rollups import record_events
+from .stamps import state_dir
+
+LOG_FIELDS = (
+    "aid", "path", "user_agent",
+    "utm_source", "utm_medium", "utm_campaign",
+)
+
+COPY_FIELDS = LOG_FIELDS + ("event", "created_at")
+
+segment_writer = SegmentWriter.from_settings()
+atexit.register(segment_writer.close)
+
+
+# =====================
+# BACKENDS DE EVENTOS
+# =====================
+def _bulk_create_write(events):
+    Event.objects.bulk_create(
+        events, batch_size=getattr(settings, "EVENT_BULK_BATCH_SIZE", 500)
+    )
+
+
+def _copy_text(value):
+    # Formato text de COPY: \N es NULL; \, tab y saltos de línea se escapan
+    if value is None:
+        return "\\N"
+    if hasattr(value, "isoformat"):
+        value = value.isoformat()
+    return (
+        str(value).replace("\\", "\\\\").replace("\t", "\\t")
+        .replace("\n", "\\n").replace("\r", "\\r")
+    )
+
+
+def copy_sql():
+    quote = connection.ops.quote_name
+    columns = ", ".join(quote(Event._meta.get_field(name).column) for name in COPY_FIELDS)
+    return f"COPY {quote(Event._meta.db_table)} ({columns}) FROM STDIN"
+
+
+def _copy_write(events):
+    """
+    Carga con COPY ... FROM STDIN (PostgreSQL), en lotes de
+    EVENT_COPY_BATCH_SIZE filas. A diferencia de bulk_create, los Event
+    no reciben su id.
+    """
+    sql = copy_sql()
+    batch_size = getattr(settings, "EVENT_COPY_BATCH_SIZE", 10000)
+    with connection.cursor() as cursor:
+        raw = cursor.cursor
+        for start in range(0, len(events), batch_size):
+            rows = [
+                tuple(getattr(event, name) for name in COPY_FIELDS)
+                for event in events[start:start + batch_size]
+            ]
+            if hasattr(raw, "copy"):
+                # psycopg 3
+                with raw.copy(sql) as copy:
+                    for row in rows:
+                        copy.write_row(row)
+            else:
+                # psycopg2
+                buffer = io.StringIO("".join(
+                    "\t".join(_copy_text(value) for value in row) + "\n" for row in rows
+                ))
+                raw.copy_expert(sql, buffer)
+
+
+def use_copy():
+    return (
+        connection.vendor == "postgresql"
+        and getattr(settings, "EVENT_COPY_ENABLED", True)
+    )
+
+
+def _orm_write(events):
+    if use_copy():
+        _copy_write(events)
+    else:
+        _bulk_create_write(events)
+
+
+def _log_write(events):
+    segment_writer.append(
+        (
+            to_ms(event.created_at),
+            event.event,
+            {field: getattr(event, field) for field in LOG_FIELDS},
+        )
+        for event in events
+    )
+
+
+# =====================
+# ESCRITOR ÚNICO (SQLite)
+# =====================
+_writer_thread_lock = threading.Lock()
+_writer_file = None
+_writer_pid = None
+
+
+def single_writer():
+    return (
+        connection.vendor == "sqlite"
+        and getattr(settings, "SQLITE_HIGH_CONCURRENCY", False)
+    )
+
+
+@contextlib.contextmanager
+def writer_lock():
+    """
+    En modo SQLite de alta concurrencia serializa las transacciones de
+    escritura de todos los procesos con un flock (cola justa en lugar de
+    reintentos contra "database is locked"). En otros motores no hace nada.
+    """
+    global _writer_file, _writer_pid
+    if not single_writer():
+        yield
+        return
+    with _writer_thread_lock:
+        if _writer_pid != os.getpid():
+            _writer_file = open(os.path.join(state_dir(), "sqlite-writer.lock"), "a")
+            _writer_pid = os.getpid()
+        fcntl.flock(_writer_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(_writer_file, fcntl.LOCK_UN)
+
+
+def write_events(events):
+    """
+    Escritura final de un lote según TRACKING_EVENT_STORAGE:
+    - "orm": todo a la tabla tracking_event.
+    - "log": todo al event log segmentado; además, los eventos listados en
+      EVENT_LOG_ORM_EVENTS se guardan también en la tabla para consultarlos.
+    """
+    if not events:
+        return
+    relational = events
+    log = getattr(settings, "TRACKING_EVENT_STORAGE", "orm") == "log"
+    if log:
+        names = set(getattr(settings, "EVENT_LOG_ORM_EVENTS", ()))
+        relational = [event for event in events if event.event in names]
+
+    # Filas y rollups en la misma transacción: un reintento no duplica conteos
+    with writer_lock(), transaction.atomic():
+        if relational:
+            _orm_write(relational)
+        record_events(events)
+        if log:
+            # Al log recién tras el commit: si el ORM falla y el lote vuelve
+            # desde el spool, no quedan registros duplicados. robust=True:
+            # un error del log ya no puede provocar un reintento del lote.
+            transaction.on_commit(lambda: _log_write(events), robust=True)
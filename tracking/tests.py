@@ -1,3 +1,1698 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import dedupe, limits
+from .models import Event
+from .policies import pending_counts
+
+
+class StateDirMixin:
+    """
+    Directorio de estado propio por test (memoria compartida, stamps,
+    spool) y singletons de módulo reiniciados.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.state_dir, ignore_errors=True)
+        settings_override = override_settings(TRACKING_STATE_DIR=self.state_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        dedupe._filter = None
+        limits._buckets = None
+        self.addCleanup(setattr, dedupe, "_filter", None)
+        self.addCleanup(setattr, limits, "_buckets", None)
+
+
+def post_json(client, url, payload, **extra):
+    return client.post(url, json.dumps(payload), content_type="application/json", **extra)
+
+
+# =====================
+# LÍMITES Y DEDUPLICACIÓN EN EL COLLECT
+# =====================
+@override_settings(
+    EVENT_WRITE_BEHIND=False,
+    RATE_LIMIT_AID_RATE=0.5,
+    RATE_LIMIT_AID_BURST=1,
+    RATE_LIMIT_PROXY_HOPS=0,
+)
+class CollectLimitsTests(StateDirMixin, TestCase):
+    def event(self, ts):
+        return {"event": "page_view", "aid": "a1", "ts": ts, "path": "/"}
+
+    def test_rate_limited_event_is_not_remembered_as_duplicate(self):
+        self.assertEqual(post_json(self.client, "/api/collect/", self.event(1)).json()["status"], "ok")
+
+        response = post_json(self.client, "/api/collect/", self.event(2))
+        self.assertEqual(response.status_code, 429)
+        # Bucket de 0.5 tokens/s vacío: faltan 2 s para el próximo
+        self.assertEqual(response["Retry-After"], "2")
+
+        limits._buckets = None
+        with override_settings(RATE_LIMIT_ENABLED=False):
+            response = post_json(self.client, "/api/collect/", self.event(2))
+        self.assertEqual(response.json()["status"], "ok")
+        self.assertEqual(Event.objects.count(), 2)
+
+    def test_repeated_event_is_duplicate(self):
+        with override_settings(RATE_LIMIT_ENABLED=False):
+            post_json(self.client, "/api/collect/", self.event(1))
+            response = post_json(self.client, "/api/collect/", self.event(1))
+        self.assertEqual(response.json()["status"], dedupe.DUPLICATE)
+        self.assertEqual(Event.objects.count(), 1)
+
+    def test_batch_marks_rate_limited_with_retry_after(self):
+        post_json(self.client, "/api/collect/", self.event(1))
+        response = self.client.post(
+            "/api/collect/batch/",
+            json.dumps([self.event(2), self.event(3)]),
+            content_type="application/json",
+        )
+        body = response.json()
+        self.assertEqual(body["rate_limited"], 2)
+        self.assertEqual(body["results"][1]["status"], limits.RATE_LIMITED)
+        self.assertGreaterEqual(body["results"][1]["retry_after"], 1)
+
+    def test_list_body_is_rejected(self):
+        response = post_json(self.client, "/api/collect/", [self.event(1)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Event.objects.count(), 0)
+
+    def test_async_list_body_is_rejected(self):
+        from asgiref.sync import async_to_sync
+
+        from .views import collect_event_async
+
+        request = RequestFactory().post(
+            "/api/collect/", json.dumps([self.event(1)]), content_type="application/json"
+        )
+        self.assertEqual(async_to_sync(collect_event_async)(request).status_code, 400)
+
+    def test_duplicates_inside_batch(self):
+        with override_settings(RATE_LIMIT_ENABLED=False):
+            response = self.client.post(
+                "/api/collect/batch/",
+                json.dumps([self.event(1), self.event(1), self.event(2)]),
+                content_type="application/json",
+            )
+        self.assertEqual(response.json()["duplicates"], 1)
+        self.assertEqual(Event.objects.count(), 2)
+
+
+class ClientIpTests(SimpleTestCase):
+    def request(self):
+        return RequestFactory().post(
+            "/api/collect/", REMOTE_ADDR="10.0.0.1", HTTP_X_FORWARDED_FOR="1.1.1.1, 2.2.2.2"
+        )
+
+    def test_forwarded_for_ignored_by_default(self):
+        self.assertEqual(limits.client_ip(self.request()), "10.0.0.1")
+
+    @override_settings(RATE_LIMIT_PROXY_HOPS=1)
+    def test_forwarded_for_entry_added_by_trusted_proxy(self):
+        self.assertEqual(limits.client_ip(self.request()), "2.2.2.2")
+
+
+# =====================
+# COLLECT EN LOTE
+# =====================
+@override_settings(EVENT_WRITE_BEHIND=False, RATE_LIMIT_ENABLED=False, COLLECT_BATCH_MAX_EVENTS=3)
+class CollectBatchTests(StateDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        from .models import GA4Rule
+        from .rules import ga4_rules
+
+        GA4Rule.objects.create(
+            listen_event="click", fire_event="ga_click", url_contains="/promo",
+            params_map={"label": "label"},
+        )
+        ga4_rules.invalidate()
+        self.addCleanup(ga4_rules.invalidate)
+
+    def post(self, body, content_type="application/json"):
+        with mock.patch("tracking.views.dispatch_hits") as dispatch:
+            response = self.client.post("/api/collect/batch/", body, content_type=content_type)
+        self.dispatched = [hit for call in dispatch.call_args_list for hit in call.args[0]]
+        self.dispatch_calls = dispatch.call_count
+        return response
+
+    def test_json_array_is_written_at_once_and_matched_once(self):
+        items = [
+            {"event": "click", "aid": "a", "path": "/promo/1", "label": "x", "ts": 1},
+            {"event": "click", "aid": "b", "path": "/home", "ts": 2},
+            {"aid": "c"},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            body = self.post(json.dumps(items)).json()
+        inserts = [q["sql"] for q in queries.captured_queries if q["sql"].startswith("INSERT")]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual((body["received"], body["accepted"]), (3, 2))
+        self.assertEqual(body["results"][2], {"index": 2, "status": "error", "error": "missing event"})
+        self.assertEqual(Event.objects.count(), 2)
+        self.assertEqual(self.dispatch_calls, 1)
+        self.assertEqual(len(self.dispatched), 1)
+        fire_event, client_id, params, sink = self.dispatched[0]
+        self.assertEqual((fire_event, client_id, sink), ("ga_click", "a", "ga4"))
+        self.assertEqual(params["label"], "x")
+        self.assertEqual(params["page_location"], "/promo/1")
+
+    def test_ndjson_body(self):
+        body = '{"event": "page_view", "aid": "a", "ts": 1}\n\n{"event": "page_view", "aid": "b", "ts": 1}\n'
+        response = self.post(body, content_type="application/x-ndjson")
+        self.assertEqual(response.json()["accepted"], 2)
+
+    def test_beacon_body_from_clarotrack(self):
+        # clarotrack.js manda el lote como text/plain (sendBeacon / fetch
+        # keepalive, sin preflight CORS) con los eventos agrupados en params
+        items = [
+            {"aid": "a", "event": "click", "path": "/promo/2", "ts": 1, "params": {"label": "y", "count": 3}},
+            {"aid": "a", "event": "scroll", "path": "/promo/2", "ts": 2, "params": {"percent": 90}},
+        ]
+        body = self.post(json.dumps(items), content_type="text/plain;charset=UTF-8").json()
+        self.assertEqual(body["accepted"], 2)
+        (_, _, params, _), = self.dispatched
+        self.assertEqual(params["label"], "y")
+
+    def test_invalid_and_oversized_batches(self):
+        self.assertEqual(self.post("{not json").status_code, 400)
+        self.assertEqual(self.post('[{"event": "click"}').status_code, 400)
+        response = self.post(json.dumps([{"event": "click", "ts": i} for i in range(4)]))
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(Event.objects.count(), 0)
+
+
+# =====================
+# PIPELINE ASYNC
+# =====================
+@override_settings(
+    EVENT_WRITE_BEHIND=False, RATE_LIMIT_ENABLED=False,
+    GA4_MEASUREMENT_ID="G-TEST", GA4_API_SECRET="secret",
+)
+class AsyncCollectTests(StateDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        from .models import GA4Rule
+        from .rules import ga4_rules
+
+        GA4Rule.objects.create(listen_event="click", fire_event="ga_click", params_map={"v": "value"})
+        GA4Rule.objects.create(
+            listen_event="click", fire_event="mirror_click", sink="ndjson",
+        )
+        ga4_rules.invalidate()
+        self.addCleanup(ga4_rules.invalidate)
+
+    def call(self, view, body):
+        from asgiref.sync import async_to_sync
+
+        request = RequestFactory().post("/api/collect/batch/", body, content_type="application/json")
+        with mock.patch("tracking.views.async_client.schedule") as schedule, \
+                mock.patch("tracking.views.dispatch_hits") as dispatch:
+            response = async_to_sync(view)(request)
+        self.scheduled = [hit for call in schedule.call_args_list for hit in call.args[0]]
+        self.dispatched = [hit for call in dispatch.call_args_list for hit in call.args[0]]
+        return response
+
+    def test_async_batch_persists_and_schedules_ga4(self):
+        from .views import collect_batch_async
+
+        items = [
+            {"event": "click", "aid": 5, "value": 1, "ts": 1},
+            {"event": "page_view", "aid": "b", "ts": 1},
+            {"aid": "c"},
+        ]
+        response = self.call(collect_batch_async, json.dumps(items))
+        body = json.loads(response.content)
+        self.assertEqual((body["received"], body["accepted"]), (3, 2))
+        self.assertEqual(body["results"][2]["status"], "error")
+        self.assertEqual(sorted(Event.objects.values_list("aid", flat=True)), ["5", "b"])
+        # GA4 por httpx en el loop; el resto de sinks por sus colas
+        self.assertEqual([(name, aid, params["v"]) for name, aid, params in self.scheduled], [("ga_click", "5", 1)])
+        self.assertEqual([hit[0] for hit in self.dispatched], ["mirror_click"])
+
+    def test_async_single_event_and_errors(self):
+        from .views import collect_event_async
+
+        response = self.call(collect_event_async, json.dumps({"event": "page_view", "aid": "a", "ts": 1}))
+        self.assertEqual(json.loads(response.content), {"status": "ok"})
+        self.assertEqual(self.call(collect_event_async, "{bad").status_code, 400)
+        self.assertEqual(self.call(collect_event_async, json.dumps({"aid": "a"})).status_code, 400)
+        self.assertEqual(Event.objects.count(), 1)
+
+
+class AsyncGA4ClientTests(SimpleTestCase):
+    def test_fan_out_groups_hits_per_client(self):
+        from asgiref.sync import async_to_sync
+
+        from .ga4 import AsyncGA4Client
+
+        client = AsyncGA4Client(max_events=2)
+        bodies = []
+
+        async def post(body):
+            bodies.append(json.loads(body))
+            return 204
+
+        with mock.patch.object(client, "_post", side_effect=post):
+            async_to_sync(client.fan_out)([
+                ("a", "c1", {}), ("b", 7, {}), ("c", "c1", {}), ("d", "c1", {}), ("e", "7", {}),
+            ])
+        self.assertEqual(
+            sorted((body["client_id"], [e["name"] for e in body["events"]]) for body in bodies),
+            [("7", ["b", "e"]), ("c1", ["a", "c"]), ("c1", ["d"])],
+        )
+
+# =====================
+# PARTICIONES
+# =====================
+class EventPartitionsTests(TestCase):
+    def test_periods(self):
+        from .management.commands import event_partitions as cmd
+
+        self.assertEqual(cmd.next_period(date(2026, 1, 31), "month"), date(2026, 2, 1))
+        self.assertEqual(cmd.next_period(date(2026, 12, 5), "month"), date(2027, 1, 1))
+        self.assertEqual(cmd.next_period(date(2026, 2, 28), "day"), date(2026, 3, 1))
+        self.assertEqual(cmd.partition_name(date(2026, 3, 1), "month"), "tracking_event_p202603")
+        self.assertEqual(cmd.partition_name(date(2026, 3, 9), "day"), "tracking_event_p20260309")
+
+    def test_other_databases_only_warn(self):
+        out = StringIO()
+        call_command("event_partitions", "--retention-days", "30", stdout=out)
+        self.assertIn("no soportado", out.getvalue())
+
+
+@skipUnless(connection.vendor == "postgresql", "particionado solo en PostgreSQL")
+class EventPartitionsPostgresTests(TransactionTestCase):
+    """
+    Convierte la tabla real, crea y suelta una partición, y deja
+    tracking_event como estaba para el resto de los tests.
+    """
+
+    def setUp(self):
+        from .management.commands import event_partitions as cmd
+
+        self.cmd = cmd
+        Event.objects.create(aid="old", event="page_view", path="/", created_at=timezone.now() - timedelta(days=400))
+        self.addCleanup(self.unpartition)
+
+    def unpartition(self):
+        cmd = self.cmd
+        command = cmd.Command()
+        if not command.is_partitioned():
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE "{cmd.TABLE}" DETACH PARTITION "{cmd.LEGACY}"')
+            cursor.execute(f'DROP TABLE "{cmd.TABLE}" CASCADE')
+            cursor.execute(f'ALTER TABLE "{cmd.LEGACY}" RENAME TO "{cmd.TABLE}"')
+            for index in Event._meta.indexes:
+                cursor.execute(f'ALTER INDEX "{index.name}_legacy" RENAME TO "{index.name}"')
+            cursor.execute(f'ALTER TABLE "{cmd.TABLE}" DROP CONSTRAINT "{cmd.TABLE}_legacy_range"')
+            cursor.execute(f'ALTER TABLE "{cmd.TABLE}" DROP CONSTRAINT "{cmd.TABLE}_id_created_uniq"')
+
+    def attached(self, relname):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT EXISTS (SELECT 1 FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid WHERE c.relname = %s)",
+                [relname],
+            )
+            return cursor.fetchone()[0]
+
+    def test_convert_create_and_detach(self):
+        cmd = self.cmd
+        call_command(
+            "event_partitions", "--convert", "--granularity", "month", "--ahead", "1", stdout=StringIO(),
+        )
+
+        command = cmd.Command()
+        command.dry_run = False
+        command.stdout = StringIO()
+        self.assertTrue(command.is_partitioned())
+        # El índice único de legacy quedó adjunto a la PK (no reconstruido)
+        self.assertTrue(self.attached(f"{cmd.TABLE}_id_created_uniq"))
+
+        partitions = set(command.partitions())
+        today = timezone.now().date()
+        future = cmd.partition_name(cmd.next_period(today, "month"), "month")
+        self.assertEqual(partitions, {cmd.LEGACY, cmd.DEFAULT, future})
+        self.assertEqual(command.partition_for(timezone.now()), cmd.LEGACY)
+
+        event = Event.objects.create(aid="new", event="page_view", path="/")
+        self.assertEqual(Event.objects.count(), 2)
+        self.assertGreater(event.pk, Event.objects.get(aid="old").pk)
+
+        command.detach(future, has_default=True)
+        self.assertNotIn(future, command.partitions())
+        self.assertEqual(Event.objects.count(), 2)
+
+
+# =====================
+# EVENT LOG
+# =====================
+class EventLogTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def writer(self, **kwargs):
+        from .eventlog import SegmentWriter
+
+        return SegmentWriter(directory=self.directory, **kwargs)
+
+    def scan(self, start=None, end=None, event=None):
+        from .eventlog import EventLogReader
+
+        return [ts for ts, _, _ in EventLogReader(self.directory).scan(start, end, event)]
+
+    def test_out_of_order_records_are_found(self):
+        writer = self.writer()
+        writer.append([(2000, "a", {}), (1000, "a", {}), (3000, "a", {})])
+        self.assertEqual(self.scan(start=0, end=1500), [1000])
+        writer.close()
+        self.assertEqual(self.scan(start=0, end=1500), [1000])
+        self.assertEqual(self.scan(start=2500), [3000])
+        self.assertIn("1000-3000-", " ".join(os.listdir(self.directory)))
+
+    def test_seek_with_sparse_index(self):
+        writer = self.writer(index_every=4)
+        writer.append([(ts, "page_view" if ts % 2 else "click", {"n": ts}) for ts in range(100)])
+        writer.close()
+        self.assertEqual(self.scan(start=90), list(range(90, 100)))
+        self.assertEqual(self.scan(start=10, end=15, event="click"), [10, 12, 14])
+
+    def test_rotation_by_size(self):
+        writer = self.writer(max_bytes=200)
+        writer.append([(ts, "a", {"pad": "x" * 50}) for ts in range(20)])
+        writer.close()
+        sealed = [name for name in os.listdir(self.directory) if name.endswith(".seg")]
+        self.assertGreater(len(sealed), 1)
+        self.assertEqual(self.scan(), list(range(20)))
+
+    def test_orphan_open_segment_is_sealed_and_dropped(self):
+        from .eventlog import EventLogReader, OPEN_SUFFIX
+
+        writer = self.writer()
+        writer.append([(5000, "a", {}), (4000, "a", {})])
+        writer._data.close()
+        writer._index.close()
+        # Proceso muerto a mitad de un registro
+        with open(writer._base + OPEN_SUFFIX, "ab") as f:
+            f.write(b"\x01\x02")
+        ts, _, _, seq = os.path.basename(writer._base).split("-")
+        dead = os.path.join(self.directory, f"{ts}-open-4194305-{seq}")
+        os.rename(writer._base + OPEN_SUFFIX, dead + OPEN_SUFFIX)
+        os.rename(writer._base + ".idx.open", dead + ".idx.open")
+
+        self.assertEqual(EventLogReader(self.directory).drop_before(4500), 0)
+        self.assertEqual(sorted(os.listdir(self.directory)), ["4000-5000-4194305-1.idx", "4000-5000-4194305-1.seg"])
+        self.assertEqual(self.scan(), [5000, 4000])
+        self.assertEqual(EventLogReader(self.directory).drop_before(6000), 1)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+@override_settings(TRACKING_EVENT_STORAGE="log", EVENT_LOG_ORM_EVENTS=("purchase",))
+class EventLogStorageTests(TestCase):
+    def test_log_backend_keeps_listed_events_in_the_table(self):
+        from . import storage
+        from .eventlog import EventLogReader, SegmentWriter, to_ms
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        now = timezone.now()
+        with mock.patch.object(storage, "segment_writer", SegmentWriter(directory=directory)):
+            with self.captureOnCommitCallbacks(execute=True):
+                storage.write_events([
+                    Event(aid="a", event="page_view", path="/", created_at=now),
+                    Event(aid="a", event="purchase", path="/checkout", created_at=now),
+                ])
+            storage.segment_writer.close()
+
+        self.assertEqual(list(Event.objects.values_list("event", flat=True)), ["purchase"])
+        records = list(EventLogReader(directory).scan(start=now - timedelta(seconds=1)))
+        self.assertEqual([(ts, name) for ts, name, _ in records], [
+            (to_ms(now), "page_view"), (to_ms(now), "purchase"),
+        ])
+        self.assertEqual(records[1][2]["path"], "/checkout")
+        self.assertEqual(EventLogReader(directory).count(event="page_view"), 1)
+
+    def test_failed_orm_write_leaves_no_log_records(self):
+        from . import storage
+        from .eventlog import EventLogReader, SegmentWriter
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        now = timezone.now()
+        events = [Event(aid="a", event="purchase", path="/checkout", created_at=now)]
+        with mock.patch.object(storage, "segment_writer", SegmentWriter(directory=directory)):
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                with mock.patch.object(storage, "_orm_write", side_effect=RuntimeError("db")):
+                    with self.assertRaises(RuntimeError):
+                        storage.write_events(events)
+            self.assertEqual(callbacks, [])
+
+            # Reintento (replay del spool): un único registro en el log
+            with self.captureOnCommitCallbacks(execute=True):
+                storage.write_events(events)
+            storage.segment_writer.close()
+
+        self.assertEqual(EventLogReader(directory).count(event="purchase"), 1)
+        self.assertEqual(Event.objects.count(), 1)
+
+# =====================
+# AID NUMÉRICO
+# =====================
+@override_settings(EVENT_WRITE_BEHIND=False, RATE_LIMIT_ENABLED=False)
+class NumericAidTests(StateDirMixin, TestCase):
+    def test_int_aid_is_stored_as_text(self):
+        response = post_json(self.client, "/api/collect/", {"event": "page_view", "aid": 123, "ts": 1})
+        self.assertEqual(response.json()["status"], "ok")
+        self.assertEqual(Event.objects.get().aid, "123")
+
+    def test_int_client_id_in_batch(self):
+        from .ingest import build_batch
+
+        _, pairs = build_batch([{"event": "click", "client_id": 7}])
+        self.assertEqual(pairs[0][0].aid, "7")
+
+    def test_sampling_policy_with_int_aid(self):
+        from .models import IngestionPolicy
+        from .policies import KEPT, SAMPLED_OUT, decide, in_sample
+
+        self.assertIs(in_sample(123, 100), True)
+        event = Event(aid=123, event="page_view")
+        index = {"page_view": (IngestionPolicy.SAMPLE, 0)}
+        self.assertEqual(decide(event, index), SAMPLED_OUT)
+        index = {"page_view": (IngestionPolicy.SAMPLE, 100)}
+        self.assertEqual(decide(event, index), KEPT)
+
+    def test_ga4_coalesces_int_client_id(self):
+        from .ga4 import coalesce_key
+
+        self.assertEqual(coalesce_key(123), "123")
+        self.assertEqual(coalesce_key(123), coalesce_key("123"))
+        self.assertNotEqual(coalesce_key("anonymous"), coalesce_key("anonymous"))
+        self.assertNotIsInstance(coalesce_key(None), str)
+
+
+# =====================
+# ROLLUPS
+# =====================
+class RollupTests(TestCase):
+    def setUp(self):
+        self.hour = (timezone.now() - timedelta(hours=3)).replace(minute=0, second=0, microsecond=0)
+
+    def events(self):
+        return [
+            Event(aid="a", event="page_view", path="/", created_at=self.hour + timedelta(minutes=1, seconds=5)),
+            Event(aid="b", event="page_view", path="/", created_at=self.hour + timedelta(minutes=1, seconds=50)),
+            Event(aid="a", event="page_view", path="/promo", utm_source="mail",
+                  created_at=self.hour + timedelta(minutes=2)),
+            Event(aid="a", event="click", path="/", created_at=self.hour + timedelta(minutes=61)),
+        ]
+
+    def minute_counts(self):
+        from .models import EventRollupMinute
+
+        return sorted(
+            (row.bucket - self.hour, row.event, row.path, row.utm_source, row.count)
+            for row in EventRollupMinute.objects.all()
+        )
+
+    def test_job_is_incremental(self):
+        from .models import EventRollupHour
+        from .rollups import rollup_pending
+
+        events = self.events()
+        Event.objects.bulk_create(events[:3])
+        self.assertEqual(rollup_pending(batch_size=2), 3)
+        self.assertEqual(rollup_pending(), 0)
+        Event.objects.bulk_create(events[3:])
+        self.assertEqual(rollup_pending(), 1)
+
+        minute = timedelta(minutes=1)
+        self.assertEqual(self.minute_counts(), [
+            (minute, "page_view", "/", "", 2),
+            (2 * minute, "page_view", "/promo", "mail", 1),
+            (61 * minute, "click", "/", "", 1),
+        ])
+        self.assertEqual(
+            EventRollupHour.objects.get(bucket=self.hour, event="page_view", path="/").count, 2
+        )
+
+    def test_id_committed_below_the_watermark_is_counted(self):
+        from .models import RollupGap, Watermark
+        from .rollups import rollup_pending
+
+        first, late, last, _ = self.events()
+        first.id, late.id, last.id = 100, 101, 102
+        Event.objects.bulk_create([first, last])
+        self.assertEqual(rollup_pending(), 2)
+        self.assertEqual(Watermark.objects.get(name="rollups").last_id, 102)
+        self.assertIn(101, RollupGap.objects.values_list("event_id", flat=True))
+
+        # Transacción lenta: confirma el id 101 cuando el watermark ya pasó
+        Event.objects.bulk_create([late])
+        self.assertEqual(rollup_pending(), 1)
+        self.assertEqual(rollup_pending(), 0)
+        self.assertFalse(RollupGap.objects.filter(event_id=101).exists())
+        minute = timedelta(minutes=1)
+        self.assertEqual(self.minute_counts(), [
+            (minute, "page_view", "/", "", 2),
+            (2 * minute, "page_view", "/promo", "mail", 1),
+        ])
+
+    def test_old_gaps_expire(self):
+        from .models import RollupGap
+        from .rollups import _missing_ids, rollup_gaps
+
+        self.assertEqual(_missing_ids(10, [12, 13, 16], 100), [15, 14, 11])
+        self.assertEqual(_missing_ids(10, [12, 13, 16], 2), [15, 14])
+        RollupGap.objects.create(event_id=5, seen_at=timezone.now() - timedelta(hours=1))
+        Event.objects.create(id=5, aid="a", event="click", path="/")
+        self.assertEqual(rollup_gaps(), 0)
+        self.assertFalse(RollupGap.objects.exists())
+
+    @override_settings(EVENT_ROLLUPS="ingest")
+    def test_ingest_mode_matches_the_job(self):
+        from .storage import write_events
+
+        write_events(self.events()[:2])
+        write_events(self.events())
+        out = StringIO()
+        call_command("rollup_events", stdout=out)
+        self.assertIn("duplicaría", out.getvalue())
+        self.assertEqual(self.minute_counts()[0], (timedelta(minutes=1), "page_view", "/", "", 4))
+
+    def test_stats_api_reads_rollups(self):
+        from .rollups import rollup_pending
+
+        Event.objects.bulk_create(self.events())
+        rollup_pending()
+        start = self.hour.isoformat()
+        response = self.client.get("/api/stats/", {
+            "granularity": "hour", "start": start, "event": "page_view", "group_by": "path",
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["buckets"], [
+            {"path": "/", "bucket": start, "count": 2},
+            {"path": "/promo", "bucket": start, "count": 1},
+        ])
+
+        response = self.client.get("/api/stats/", {"granularity": "minute", "start": start, "utm_source": "mail"})
+        self.assertEqual([row["count"] for row in response.json()["buckets"]], [1])
+
+        for params in ({"granularity": "day"}, {"start": "yesterday"}, {"group_by": "aid"}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get("/api/stats/", params).status_code, 400)
+
+# =====================
+# POLÍTICAS DE INGESTA
+# =====================
+def pending_counts_reset():
+    pending_counts._counts.clear()
+    pending_counts._pid = None
+
+
+@override_settings(EVENT_WRITE_BEHIND=False, RATE_LIMIT_ENABLED=False)
+class IngestionPolicyTests(StateDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        from .policies import policies
+
+        policies.invalidate()
+        self.addCleanup(policies.invalidate)
+        # Sin hilo de volcado: el test llama a flush()
+        thread = mock.patch("tracking.policies.threading.Thread")
+        thread.start()
+        self.addCleanup(thread.stop)
+        self.addCleanup(pending_counts_reset)
+        pending_counts_reset()
+
+    def policy(self, event_name, action, percent=100):
+        from .models import IngestionPolicy
+
+        with self.captureOnCommitCallbacks(execute=True):
+            return IngestionPolicy.objects.create(
+                event_name=event_name, action=action, sample_percent=percent
+            )
+
+    def test_policies_apply_before_any_write(self):
+        from .models import EventRollupMinute, IngestionPolicy
+        from .policies import AGGREGATED, DROPPED, KEPT, SAMPLED_OUT
+
+        self.policy("scroll", IngestionPolicy.DROP)
+        self.policy("mousemove", IngestionPolicy.AGGREGATE)
+        self.policy("hover", IngestionPolicy.SAMPLE, 0)
+        items = [
+            {"event": name, "aid": "a1", "ts": i}
+            for i, name in enumerate(("scroll", "mousemove", "hover", "click"))
+        ]
+        with mock.patch("tracking.views.dispatch_hits") as dispatch:
+            body = self.client.post(
+                "/api/collect/batch/", json.dumps(items), content_type="application/json"
+            ).json()
+        self.assertEqual(
+            [result["status"] for result in body["results"]],
+            [DROPPED, AGGREGATED, SAMPLED_OUT, KEPT],
+        )
+        self.assertEqual((body["accepted"], body["filtered"]), (1, 3))
+        self.assertEqual(list(Event.objects.values_list("event", flat=True)), ["click"])
+        self.assertEqual(len(dispatch.call_args.args[0]), 0)
+        self.assertFalse(EventRollupMinute.objects.exists())
+        self.assertEqual(pending_counts.flush(), 1)
+        self.assertEqual(EventRollupMinute.objects.get().event, "mousemove")
+
+        response = post_json(self.client, "/api/collect/", {"event": "scroll", "aid": "a1", "ts": 9})
+        self.assertEqual(response.json()["status"], DROPPED)
+
+    def test_aggregate_request_issues_no_rollup_writes(self):
+        from .models import IngestionPolicy
+
+        self.policy("mousemove", IngestionPolicy.AGGREGATE)
+        with CaptureQueriesContext(connection) as queries:
+            response = post_json(self.client, "/api/collect/", {"event": "mousemove", "aid": "a1", "ts": 1})
+        self.assertEqual(response.json()["status"], "aggregated")
+        self.assertEqual(
+            [q["sql"] for q in queries.captured_queries if "tracking_eventrollup" in q["sql"]], []
+        )
+        self.assertEqual(pending_counts.flush(), 1)
+
+    def test_sampling_is_stable_per_aid(self):
+        from .policies import in_sample
+
+        aids = [f"aid-{i}" for i in range(1000)]
+        sampled = [aid for aid in aids if in_sample(aid, 30)]
+        self.assertTrue(250 < len(sampled) < 350)
+        self.assertEqual(sampled, [aid for aid in aids if in_sample(aid, 30)])
+        self.assertTrue(set(sampled) <= {aid for aid in aids if in_sample(aid, 60)})
+
+    def test_policy_change_is_picked_up(self):
+        from .models import IngestionPolicy
+        from .policies import DROPPED, KEPT, decide
+
+        event = Event(aid="a1", event="scroll")
+        self.assertEqual(decide(event), KEPT)
+        policy = self.policy("scroll", IngestionPolicy.DROP)
+        self.assertEqual(decide(event), DROPPED)
+        with self.captureOnCommitCallbacks(execute=True):
+            policy.delete()
+        self.assertEqual(decide(event), KEPT)
+
+# =====================
+# ARCHIVO COLUMNAR
+# =====================
+class ArchiveEventsTests(TestCase):
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output, ignore_errors=True)
+        now = timezone.now()
+        old = now - timedelta(days=40)
+        for i in range(7):
+            Event.objects.create(
+                aid=f"a{i % 2}", event="page_view", path=f"/p{i % 3}",
+                created_at=old - timedelta(days=i // 4),
+            )
+        Event.objects.create(aid="recent", event="page_view", path="/")
+
+    def test_archives_streamed_days_and_deletes_verified_rows(self):
+        from .archive import iter_column, read_day, read_header
+
+        old_ids = sorted(Event.objects.exclude(aid="recent").values_list("id", flat=True))
+        call_command(
+            "archive_events", "--days", "30", "--output", self.output, "--chunk-size", "3",
+            stdout=StringIO(),
+        )
+        self.assertEqual(list(Event.objects.values_list("aid", flat=True)), ["recent"])
+
+        files = sorted(os.listdir(self.output))
+        self.assertEqual(len(files), 2)
+        archived = []
+        for name in files:
+            path = os.path.join(self.output, name)
+            header = read_header(path)
+            self.assertEqual(header["rows"], sum(group["rows"] for group in header["groups"]))
+            archived.extend(id for ids in iter_column(path, "id") for id in ids)
+            day = read_day(path)
+            self.assertEqual(list(day["id"]), [id for ids in iter_column(path, "id") for id in ids])
+            self.assertTrue(set(day["path"]) <= {"/p0", "/p1", "/p2"})
+        self.assertEqual(sorted(archived), old_ids)
+
+    def test_failed_verification_leaves_no_file(self):
+        from .management.commands.archive_events import Command
+
+        with mock.patch.object(Command, "archived_ids", return_value=(0, None, None)):
+            call_command("archive_events", "--days", "30", "--output", self.output, stdout=StringIO())
+        self.assertEqual(os.listdir(self.output), [])
+        self.assertEqual(Event.objects.count(), 8)
+
+    def test_dry_run_keeps_everything(self):
+        call_command("archive_events", "--days", "30", "--output", self.output, "--dry-run", stdout=StringIO())
+        self.assertEqual(Event.objects.count(), 8)
+        self.assertEqual(os.listdir(self.output), [])
+
+
+# =====================
+# SESIONES
+# =====================
+class SessionizeTests(TestCase):
+    def setUp(self):
+        self.base = timezone.now() - timedelta(days=1)
+
+    def add(self, aid, minutes, event="page_view", path="/"):
+        return Event.objects.create(
+            aid=aid, event=event, path=path, created_at=self.base + timedelta(minutes=minutes)
+        )
+
+    def sessions(self, **filters):
+        from .models import Session
+
+        return [
+            (s.aid, round((s.started_at - self.base).total_seconds() / 60), s.event_count, s.is_open)
+            for s in Session.objects.filter(**filters).order_by("aid", "started_at")
+        ]
+
+    def test_splits_on_timeout_and_closes_idle_sessions(self):
+        from .sessions import sessionize_pending
+
+        for minutes in (0, 10, 20, 100, 105):
+            self.add("a", minutes)
+        self.add("b", 50, event="click")
+
+        self.assertEqual(sessionize_pending(batch_size=2), (6, 3))
+        self.assertEqual(self.sessions(), [("a", 0, 3, False), ("a", 100, 2, False), ("b", 50, 1, False)])
+
+    def test_open_sessions_live_in_the_session_table(self):
+        from .models import Session
+        from .sessions import sessionize_pending
+
+        now = timezone.now()
+        Event.objects.create(aid="a", event="page_view", path="/x", created_at=now - timedelta(minutes=5))
+        sessionize_pending()
+        open_session = Session.objects.get()
+        self.assertTrue(open_session.is_open)
+        self.assertEqual(open_session.landing_path, "/x")
+
+        Event.objects.create(aid="a", event="click", path="/y", created_at=now - timedelta(minutes=2))
+        with override_settings(EVENT_ROLLUP_LAG_SECONDS=0):
+            sessionize_pending()
+        session = Session.objects.get()
+        self.assertEqual(session.pk, open_session.pk)
+        self.assertEqual((session.event_count, session.exit_path, session.is_open), (2, "/y", True))
+
+    def test_late_event_does_not_bridge_a_long_gap(self):
+        from .sessions import sessionize_pending
+
+        self.add("a", 0)
+        self.add("a", 100)
+        sessionize_pending()
+        # Llega tarde (id mayor) un evento de la primera sesión
+        self.add("a", 10)
+        self.add("a", 300)
+        sessionize_pending()
+        self.assertEqual(self.sessions(), [("a", 0, 2, False), ("a", 100, 1, False), ("a", 300, 1, False)])
+
+    def test_backfill_matches_incremental(self):
+        from .models import Session
+        from .sessions import backfill_sessions, sessionize_pending
+
+        for i, minutes in enumerate((0, 5, 50, 51, 200, 230, 270)):
+            self.add(f"a{i % 2}", minutes)
+        sessionize_pending(batch_size=3)
+        incremental = self.sessions()
+        Session.objects.all().delete()
+        backfill_sessions(workers=1)
+        self.assertEqual(self.sessions(), incremental)
+
+
+# =====================
+# ADMIN DE EVENTOS
+# =====================
+class EventAdminTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        self.client.force_login(User.objects.create_superuser("admin", "a@example.com", "x"))
+        old = timezone.now() - timedelta(days=30)
+        for i in range(3):
+            Event.objects.create(aid="old", event="click", path="/", created_at=old)
+        for i in range(5):
+            Event.objects.create(aid=f"a{i}", event="page_view" if i % 2 else "click", path="/")
+
+    def changelist(self, query=""):
+        response = self.client.get(f"/admin/tracking/event/{query}")
+        self.assertEqual(response.status_code, 200)
+        return response.context["cl"]
+
+    def test_default_window_uses_id_range_estimate(self):
+        cl = self.changelist()
+        self.assertIsNotNone(cl.paginator.since)
+        self.assertEqual(cl.result_count, 5)
+
+    def test_filters_use_capped_count(self):
+        cl = self.changelist("?event=click")
+        self.assertIsNone(cl.paginator.since)
+        self.assertEqual(cl.result_count, 3)
+        cl = self.changelist("?q=a1")
+        self.assertIsNone(cl.paginator.since)
+        self.assertEqual(cl.result_count, 1)
+
+
+# =====================
+# MATCHER DE URLS
+# =====================
+class UrlMatcherTests(SimpleTestCase):
+    def rules(self, specs):
+        from .rules import CompiledGA4Rule
+
+        return [
+            CompiledGA4Rule(i, "click", "fire", pattern, {}, match_type=match_type)
+            for i, (match_type, pattern) in enumerate(specs)
+        ]
+
+    def naive(self, rules, path):
+        import re
+
+        matched = []
+        for rule in rules:
+            pattern = rule.url_contains
+            if not pattern:
+                ok = True
+            elif rule.match_type == "prefix":
+                ok = path.startswith(pattern)
+            elif rule.match_type == "regex":
+                ok = re.search(pattern, path) is not None
+            else:
+                ok = pattern in path
+            if ok:
+                matched.append(rule)
+        return matched
+
+    def test_matches_like_the_naive_loop(self):
+        import random
+
+        from .matching import UrlMatcher
+
+        rng = random.Random(7)
+        alphabet = "/abc-"
+        specs = [("contains", ""), ("regex", r"^/a+b"), ("regex", r"c-\w")]
+        for i in range(60):
+            pattern = "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 4)))
+            specs.append((("contains", "prefix")[i % 2], pattern))
+        rules = self.rules(specs)
+        matcher = UrlMatcher(rules)
+        for _ in range(500):
+            path = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+            self.assertEqual(list(matcher.match(path)), self.naive(rules, path), path)
+
+    def test_regex_backreferences(self):
+        from .matching import UrlMatcher
+
+        rules = self.rules([("regex", r"/(x)y"), ("regex", r"/(a)\1"), ("regex", r"/(?P<d>\d)(?P=d)")])
+        matcher = UrlMatcher(rules)
+        self.assertEqual([rule.id for rule in matcher.match("/aa")], [1])
+        self.assertEqual([rule.id for rule in matcher.match("/xy/77")], [0, 2])
+        self.assertEqual(matcher.match("/ab"), [])
+
+    def test_validate_pattern(self):
+        from .matching import validate_pattern
+
+        self.assertIsNone(validate_pattern("regex", r"^/p/\d+"))
+        self.assertIn("Regex", validate_pattern("regex", "("))
+        self.assertIsNotNone(validate_pattern("glob", "/x"))
+
+
+# =====================
+# MEMORIA COMPARTIDA
+# =====================
+class SharedMemoryTests(StateDirMixin, SimpleTestCase):
+    def digest(self, value):
+        import hashlib
+
+        return hashlib.sha1(str(value).encode()).digest()
+
+    def test_bloom_filter_remembers_keys_within_window(self):
+        from .shm import RotatingBloomFilter
+
+        bloom = RotatingBloomFilter("test_bloom", capacity=1000, error_rate=0.001, window=10)
+        keys = [self.digest(i) for i in range(200)]
+        with mock.patch("tracking.shm.time.time", return_value=1000.0):
+            self.assertEqual(bloom.contains_many(keys[:2]), [False, False])
+            self.assertEqual(bloom.add_many(keys[:100] + keys[:1]), [False] * 100 + [True])
+            self.assertEqual(bloom.contains_many(keys[:2]), [True, True])
+            false_positives = sum(bloom.contains_many(keys[100:]))
+        self.assertLess(false_positives, 5)
+
+        # Ventana siguiente: el filtro anterior se sigue consultando
+        with mock.patch("tracking.shm.time.time", return_value=1012.0):
+            self.assertEqual(bloom.contains_many(keys[:1]), [True])
+        # Dos ventanas después se olvida
+        with mock.patch("tracking.shm.time.time", return_value=1035.0):
+            self.assertEqual(bloom.contains_many(keys[:1]), [False])
+
+    def test_token_buckets(self):
+        from .shm import TokenBuckets
+
+        buckets = TokenBuckets("test_buckets", slots=64, probes=4)
+        a, b = self.digest("a"), self.digest("b")
+        with mock.patch("tracking.shm.time.time", return_value=100.0):
+            self.assertEqual(buckets.take_many([(a, 1, 3, 2), (b, 1, 3, 3)]), [0, 0])
+            self.assertEqual(buckets.take_many([(a, 1, 3, 1)]), [0])
+            self.assertEqual(buckets.take_many([(a, 1, 3, 2)]), [2.0])
+        with mock.patch("tracking.shm.time.time", return_value=102.0):
+            self.assertEqual(buckets.take_many([(a, 1, 3, 2)]), [0])
+            self.assertEqual(buckets.take_many([(b, 0, 3, 1)]), [float("inf")])
+
+    def test_new_configuration_uses_a_new_file(self):
+        from .shm import RotatingBloomFilter
+
+        old = RotatingBloomFilter("test_swap", capacity=1000, window=60)
+        old.add_many([self.digest("x")])
+        new = RotatingBloomFilter("test_swap", capacity=5000, window=60)
+        self.assertNotEqual(old.memory.path, new.memory.path)
+        self.assertEqual(new.add_many([self.digest("x")]), [False])
+        # El worker con la configuración anterior conserva su estado
+        self.assertEqual(old.contains_many([self.digest("x")]), [True])
+
+    def test_damaged_file_is_replaced_without_truncating_it(self):
+        from .shm import TokenBuckets
+
+        buckets = TokenBuckets("test_damaged", slots=8)
+        path = buckets.memory.path
+        with open(path, "wb") as f:
+            f.write(b"garbage")
+        inode = os.stat(path).st_ino
+        buckets.take_many([(self.digest("a"), 1, 1, 1)])
+        self.assertNotEqual(os.stat(path).st_ino, inode)
+        self.assertEqual(os.path.getsize(path), buckets.memory.size)
+
+
+# =====================
+# BUFFER WRITE-BEHIND
+# =====================
+class WriteBehindTests(StateDirMixin, TestCase):
+    def test_spool_lives_in_event_spool_dir(self):
+        from .buffer import EventBuffer
+        from .ingest import build_event
+
+        spool = os.path.join(self.state_dir, "persistent-spool")
+        buffer = EventBuffer(max_events=100, max_delay=60)
+        with override_settings(EVENT_SPOOL_DIR=spool), \
+                mock.patch("tracking.buffer.threading.Thread"):
+            buffer.add([build_event({"event": "page_view", "aid": "a1"})])
+            self.assertEqual(len(os.listdir(spool)), 1)
+            self.assertEqual(Event.objects.count(), 0)
+            self.assertEqual(buffer.flush(), 1)
+            buffer.close()
+        self.assertEqual(Event.objects.count(), 1)
+        self.assertEqual(os.listdir(spool), [])
+
+    def test_orphan_spool_is_replayed(self):
+        from .buffer import event_to_record, replay_orphan_spools
+
+        spool = os.path.join(self.state_dir, "persistent-spool")
+        os.makedirs(spool)
+        record = event_to_record(Event(aid="a1", event="page_view", path="/", created_at=timezone.now()))
+        with open(os.path.join(spool, "events-4194305-dead.flushing"), "w") as f:
+            f.write(json.dumps(record) + "\n" + json.dumps(record)[:10])
+        with override_settings(EVENT_SPOOL_DIR=spool):
+            self.assertEqual(replay_orphan_spools(), 1)
+        self.assertEqual(Event.objects.get().aid, "a1")
+        self.assertEqual(os.listdir(spool), [])
+
+    def test_write_behind_collect_goes_through_the_buffer(self):
+        with override_settings(EVENT_WRITE_BEHIND=True, RATE_LIMIT_ENABLED=False), \
+                mock.patch("tracking.buffer.event_buffer.add") as add:
+            response = post_json(self.client, "/api/collect/", {"event": "click", "aid": "a1", "ts": 1})
+        self.assertEqual(response.json()["status"], "ok")
+        self.assertEqual([event.aid for event in add.call_args.args[0]], ["a1"])
+        self.assertEqual(Event.objects.count(), 0)
+
+
+# =====================
+# RUTAS DE PARAMS_MAP
+# =====================
+class ParamsMapTests(SimpleTestCase):
+    payload = {
+        "ecommerce": {
+            "value": 10,
+            "coupons": [],
+            "items": [
+                {"item_id": "a", "price": 5, "item_category": "phones"},
+                {"item_id": "b", "price": 7, "item_category": "plans"},
+            ],
+        }
+    }
+
+    def evaluate(self, params_map, data=None):
+        from .paths import compile_params_map
+
+        compiled = compile_params_map(params_map)
+        data = self.payload if data is None else data
+        single = compiled.evaluate(data)
+        self.assertEqual(compiled.evaluate_many([data]), [single])
+        return single
+
+    def test_keys_indexes_wildcards_and_filters(self):
+        params = self.evaluate({
+            "value": "ecommerce.value",
+            "first": "ecommerce.items[0].item_id",
+            "last": "ecommerce.items[-1].item_id",
+            "prices": "ecommerce.items[*].price",
+            "phones": "ecommerce.items[?item_category=phones].item_id",
+            "cheap": "ecommerce.items[?price<6].item_id",
+            "currency": "$const:ARS",
+        })
+        self.assertEqual(params, {
+            "value": 10,
+            "first": "a",
+            "last": "b",
+            "prices": [5, 7],
+            "phones": ["a"],
+            "cheap": ["a"],
+            "currency": "ARS",
+        })
+
+    def test_missing_values_are_not_sent(self):
+        params = self.evaluate({
+            "missing": "ecommerce.tax",
+            "out_of_range": "ecommerce.items[5].item_id",
+            "no_match": "ecommerce.items[?item_category=tv].item_id",
+        })
+        self.assertEqual(params, {})
+
+    def test_empty_list_is_kept_for_plain_paths(self):
+        self.assertEqual(self.evaluate({"coupons": "ecommerce.coupons"}), {"coupons": []})
+
+    def test_invalid_paths_are_rejected(self):
+        from .paths import PathError, compile_params_map
+
+        for source in ("items[", "items[x]", "a..b", "items[?price]", "a.", 5):
+            with self.subTest(source=source), self.assertRaises(PathError):
+                compile_params_map({"p": source})
+        self.assertEqual(len(compile_params_map({"p": "a..b"}, strict=False)), 0)
+
+
+# =====================
+# SINKS
+# =====================
+class SinkConfigTests(SimpleTestCase):
+    def test_valid_config(self):
+        from .sinks import NullSink, build_sinks
+
+        sinks = build_sinks({"null": {"class": "tracking.sinks.NullSink", "batch_size": 10}})
+        self.assertIsInstance(sinks["null"], NullSink)
+        self.assertEqual(sinks["null"].batch_size, 10)
+
+    def test_invalid_config_is_improperly_configured(self):
+        from django.core.exceptions import ImproperlyConfigured
+
+        from .sinks import build_sinks
+
+        for config in (
+            [],
+            {"x": "tracking.sinks.NullSink"},
+            {"x": {"batch_size": 10}},
+            {"x": {"class": "tracking.sinks.Missing"}},
+            {"x": {"class": "tracking.models.Event"}},
+            {"x": {"class": "tracking.sinks.NullSink", "unknown": 1}},
+            {"x": {"class": "tracking.sinks.WebhookSink"}},
+        ):
+            with self.subTest(config=config), self.assertRaises(ImproperlyConfigured):
+                build_sinks(config)
+
+    def test_app_ready_builds_the_sinks(self):
+        from django.apps import apps
+        from django.core.exceptions import ImproperlyConfigured
+
+        from . import sinks
+
+        self.addCleanup(setattr, sinks, "_sinks", sinks._sinks)
+        sinks._sinks = None
+        with override_settings(TRACKING_SINKS={"x": {"class": "tracking.sinks.Missing"}}):
+            with self.assertRaises(ImproperlyConfigured):
+                apps.get_app_config("tracking").ready()
+
+    def test_ndjson_sink_writes_batches(self):
+        from .sinks import NDJSONFileSink, make_record
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        sink = NDJSONFileSink("files", directory=directory, batch_size=10, batch_wait=0.01)
+        for i in range(3):
+            self.assertIs(sink.emit(make_record("click", f"c{i}", {"n": i}, "/p")), True)
+        self.assertIs(sink.drain(timeout=5), True)
+        (name,) = os.listdir(directory)
+        with open(os.path.join(directory, name)) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([record["params"]["n"] for record in records], [0, 1, 2])
+        self.assertEqual(records[0]["path"], "/p")
+
+    def test_failing_sink_does_not_block(self):
+        from .sinks import Sink
+
+        class Broken(Sink):
+            def write_batch(self, records):
+                raise OSError("down")
+
+        sink = Broken("broken", queue_size=1, batch_wait=0.01)
+        with mock.patch("tracking.sinks.threading.Thread"):
+            self.assertIs(sink.emit({}), True)
+            self.assertIs(sink.emit({}), False)
+        sink = Broken("broken", batch_wait=0.01)
+        with self.assertLogs("tracking.sinks", "ERROR"):
+            sink.emit({})
+            self.assertIs(sink.drain(timeout=5), True)
+
+    def test_mirror_and_unknown_sinks(self):
+        from . import sinks
+        from .sinks import NullSink, dispatch_hits, mirror_events
+
+        mirror = NullSink("mirror", mirror=True)
+        plain = NullSink("plain")
+        with mock.patch.object(sinks, "_sinks", {"mirror": mirror, "plain": plain}), \
+                mock.patch.object(NullSink, "emit") as emit, self.assertLogs("tracking.sinks", "WARNING"):
+            dispatch_hits([("ga_click", "c1", {}, "plain"), ("ga_click", "c1", {}, "missing")])
+            self.assertEqual(emit.call_count, 1)
+            mirror_events([(Event(aid="a", event="click", path="/", created_at=timezone.now()), {"params": {"x": 1}})])
+        self.assertEqual(emit.call_args.args[0]["params"], {"x": 1})
+        self.assertEqual(emit.call_count, 2)
+
+
+# =====================
+# BUNDLE clarotrack.js
+# =====================
+class BundleEncodingTests(TestCase):
+    def test_accepted_encodings_parses_q_values(self):
+        from .bundle import accepted_encodings
+
+        self.assertEqual(
+            accepted_encodings("gzip, br;q=0, deflate;q=0.5, *;q=bad"),
+            {"gzip": 1.0, "br": 0.0, "deflate": 0.5, "*": 0.0},
+        )
+        self.assertEqual(accepted_encodings(""), {})
+
+    def test_negotiate(self):
+        from .bundle import Bundle, negotiate
+
+        bundle = Bundle(hash="h", body=b"plain", gzip=b"gz", br=b"br")
+        for header, expected in (
+            ("gzip, br", "br"),
+            ("gzip, br;q=0", "gzip"),
+            ("br;q=0.5, gzip;q=0.8", "gzip"),
+            ("*", "br"),
+            ("*;q=0, gzip", "gzip"),
+            ("identity", None),
+            ("gzip;q=0", None),
+            ("", None),
+        ):
+            with self.subTest(header=header):
+                self.assertEqual(negotiate(bundle, header)[1], expected)
+        # Sin brotli instalado solo queda gzip
+        self.assertEqual(negotiate(bundle._replace(br=None), "br")[1], None)
+        self.assertEqual(negotiate(bundle._replace(br=None), "br, gzip")[1], "gzip")
+
+    def test_bundle_view_serves_brotli(self):
+        from .bundle import build_bundle
+
+        fake = mock.Mock()
+        fake.compress.return_value = b"BR"
+        with mock.patch("tracking.bundle.brotli", fake):
+            bundle = build_bundle()
+        self.assertEqual(bundle.br, b"BR")
+        fake.compress.assert_called_once_with(bundle.body, quality=11)
+
+        with mock.patch("tracking.views.get_bundle", return_value=bundle):
+            response = self.client.get(
+                f"/api/static/tracking/clarotrack.{bundle.hash}.js", HTTP_ACCEPT_ENCODING="gzip, br",
+            )
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(response.content, b"BR")
+
+    def test_missing_brotli_is_reported(self):
+        from .checks import check_brotli
+
+        with mock.patch("tracking.bundle.brotli", None):
+            self.assertEqual([message.id for message in check_brotli(None)], ["tracking.W001"])
+        with mock.patch("tracking.bundle.brotli", mock.Mock()):
+            self.assertEqual(check_brotli(None), [])
+
+    def test_bundle_view_honors_q_zero(self):
+        from .bundle import current_bundle
+
+        url = f"/api/static/tracking/clarotrack.{current_bundle.get().hash}.js"
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip, br;q=0")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="br;q=0")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertTrue(response.content.startswith(b"window.__CLAROTRACK_RULES__"))
+
+    def test_loader_points_to_immutable_bundle(self):
+        from .bundle import current_bundle
+
+        digest = current_bundle.get().hash
+        loader = self.client.get("/api/static/tracking/clarotrack.js")
+        self.assertIn(f"clarotrack.{digest}.js".encode(), loader.content)
+        self.assertNotIn("immutable", loader["Cache-Control"])
+
+        response = self.client.get(f"/api/static/tracking/clarotrack.{digest}.js")
+        self.assertEqual(response["ETag"], f'"{digest}"')
+        self.assertIn("immutable", response["Cache-Control"])
+
+        response = self.client.get("/api/static/tracking/clarotrack.0000000000000000.js")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response["Location"], f"clarotrack.{digest}.js")
+
+
+# =====================
+# DISPATCHER GA4
+# =====================
+@override_settings(GA4_MEASUREMENT_ID="G-TEST", GA4_API_SECRET="secret", GA4_COLLECT_URL="http://ga4.test/mp/collect")
+class GA4DispatcherTests(SimpleTestCase):
+    def dispatcher(self, **kwargs):
+        from .ga4 import GA4Dispatcher
+
+        options = {"workers": 2, "coalesce_window": 0.01}
+        options.update(kwargs)
+        return GA4Dispatcher(**options)
+
+    def test_enqueue_sends_in_background(self):
+        dispatcher = self.dispatcher()
+        with mock.patch("tracking.ga4.requests.Session") as session_cls:
+            post = session_cls.return_value.post
+            post.return_value.status_code = 204
+            self.assertIs(dispatcher.enqueue("purchase", "c1", {"value": 1}), True)
+            self.assertIs(dispatcher.drain(timeout=5), True)
+        self.assertEqual(post.call_count, 1)
+        kwargs = post.call_args.kwargs
+        self.assertEqual(post.call_args.args, ("http://ga4.test/mp/collect",))
+        self.assertEqual(kwargs["params"], {"measurement_id": "G-TEST", "api_secret": "secret"})
+        self.assertEqual(json.loads(kwargs["data"]), {
+            "client_id": "c1", "events": [{"name": "purchase", "params": {"value": 1}}],
+        })
+
+    def test_send_errors_do_not_leak_pending(self):
+        dispatcher = self.dispatcher()
+        with mock.patch("tracking.ga4.requests.Session") as session_cls:
+            session_cls.return_value.post.side_effect = OSError("down")
+            dispatcher.enqueue("click", "c1")
+            self.assertIs(dispatcher.drain(timeout=5), True)
+
+    @override_settings(GA4_API_SECRET="")
+    def test_without_credentials_nothing_is_queued(self):
+        dispatcher = self.dispatcher()
+        self.assertIs(dispatcher.enqueue("click", "c1"), False)
+        self.assertEqual(dispatcher.queue_depth(), 0)
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        dispatcher = self.dispatcher(queue_size=1)
+        with mock.patch("tracking.ga4.threading.Thread"):
+            self.assertIs(dispatcher.enqueue("click", "c1"), True)
+            self.assertIs(dispatcher.enqueue("click", "c1"), False)
+        self.assertEqual(dispatcher._pending, 1)
+
+    def test_hits_of_one_client_are_coalesced(self):
+        dispatcher = self.dispatcher(coalesce_window=0.2, max_events=3)
+        with mock.patch("tracking.ga4.requests.Session") as session_cls:
+            post = session_cls.return_value.post
+            post.return_value.status_code = 204
+            for i in range(4):
+                dispatcher.enqueue("view_item", "c1", {"n": i})
+            dispatcher.enqueue("view_item", 7, {"n": 9})
+            dispatcher.enqueue("view_item", "7", {"n": 10})
+            self.assertIs(dispatcher.drain(timeout=5), True)
+        payloads = sorted(
+            (json.loads(call.kwargs["data"]) for call in post.call_args_list),
+            key=lambda payload: (payload["client_id"], len(payload["events"])),
+        )
+        self.assertEqual(
+            [(payload["client_id"], len(payload["events"])) for payload in payloads],
+            [("7", 2), ("c1", 1), ("c1", 3)],
+        )
+
+
+class SplitPayloadsTests(SimpleTestCase):
+    def test_limits_per_payload(self):
+        from .ga4 import split_payloads
+
+        events = [("e", {"n": i}) for i in range(30)]
+        bodies, dropped = split_payloads("c1", events, max_events=25)
+        self.assertEqual([count for _, count in bodies], [25, 5])
+        self.assertEqual(dropped, 0)
+        sent = [event["params"]["n"] for body, _ in bodies for event in json.loads(body)["events"]]
+        self.assertEqual(sent, list(range(30)))
+
+        bodies, _ = split_payloads("c1", events, max_events=25, max_bytes=200)
+        self.assertTrue(all(len(body) <= 200 for body, _ in bodies))
+        self.assertEqual(sum(count for _, count in bodies), 30)
+
+    def test_oversized_event_is_dropped(self):
+        from .ga4 import split_payloads
+
+        bodies, dropped = split_payloads(
+            "c1", [("big", {"x": "y" * 500}), ("small", {})], max_bytes=200
+        )
+        self.assertEqual(dropped, 1)
+        self.assertEqual([e["name"] for e in json.loads(bodies[0][0])["events"]], ["small"])
+
+    def test_anonymous_client_gets_random_id(self):
+        from .ga4 import split_payloads
+
+        (body, _), = split_payloads("anonymous", [("e", {})])[0]
+        self.assertNotEqual(json.loads(body)["client_id"], "anonymous")
+
+
+# =====================
+# ÍNDICE DE REGLAS GA4
+# =====================
+class GA4RuleIndexTests(StateDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        from .rules import ga4_rules
+
+        ga4_rules.invalidate()
+        self.addCleanup(ga4_rules.invalidate)
+
+    def create_rule(self, **fields):
+        from .models import GA4Rule
+
+        with self.captureOnCommitCallbacks(execute=True):
+            return GA4Rule.objects.create(**fields)
+
+    def test_index_is_cached_and_invalidated_by_signals(self):
+        from .rules import ga4_rules_for
+
+        rule = self.create_rule(listen_event="click", fire_event="ga_click", params_map={"v": "value"})
+        self.assertEqual([r.fire_event for r in ga4_rules_for("click")], ["ga_click"])
+        with self.assertNumQueries(0):
+            ga4_rules_for("click")
+            self.assertEqual(ga4_rules_for("scroll"), ())
+
+        rule.active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            rule.save()
+        self.assertEqual(ga4_rules_for("click"), ())
+
+    def test_match_uses_compiled_rules(self):
+        from .ingest import match_ga4_rules
+        from .matching import PREFIX, REGEX
+
+        self.create_rule(listen_event="click", fire_event="promo", url_contains="/promo", match_type=PREFIX)
+        self.create_rule(listen_event="click", fire_event="any", params_map={"v": "value"})
+        # Regex inválido guardado sin validar: se omite del índice
+        self.create_rule(listen_event="click", fire_event="broken", url_contains="(", match_type=REGEX)
+
+        hits = match_ga4_rules([
+            (Event(aid="a", event="click", path="/promo/x"), {"value": 3}),
+            (Event(aid="b", event="click", path="/home/promo"), {}),
+        ])
+        self.assertEqual(
+            [(fire_event, aid, params.get("v")) for fire_event, aid, params, _ in hits],
+            [("promo", "a", None), ("any", "a", 3), ("any", "b", None)],
+        )
+
+
+# =====================
+# TRACKING RULES
+# =====================
+class TrackingRulesViewTests(StateDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        from .rules import tracking_rules_payload
+
+        tracking_rules_payload.invalidate()
+        self.addCleanup(tracking_rules_payload.invalidate)
+
+    def create_rule(self, **fields):
+        from .models import TrackingRule
+
+        with self.captureOnCommitCallbacks(execute=True):
+            return TrackingRule.objects.create(**fields)
+
+    def test_etag_and_not_modified(self):
+        self.create_rule(listen_event="click", selector="#buy", fire_event="buy")
+        response = self.client.get("/api/tracking_rules/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([rule["fire_event"] for rule in response.json()], ["buy"])
+        etag = response["ETag"]
+        self.assertTrue(response["Cache-Control"].startswith("public, max-age="))
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/tracking_rules/", HTTP_IF_NONE_MATCH=f'"other", W/{etag}')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_rule_change_yields_new_etag(self):
+        rule = self.create_rule(listen_event="click", fire_event="buy")
+        etag = self.client.get("/api/tracking_rules/")["ETag"]
+        rule.active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            rule.save()
+        response = self.client.get("/api/tracking_rules/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json(), [])
+
+
+# =====================
+# MÉTRICAS
+# =====================
+class MetricsTests(StateDirMixin, SimpleTestCase):
+    def test_prometheus_format(self):
+        from collections import defaultdict
+
+        from .metrics import BUCKETS, render_prometheus
+
+        buckets = [0] * (len(BUCKETS) + 1)
+        buckets[0], buckets[-1] = 2, 1
+        text = render_prometheus({
+            "counters": defaultdict(float, {("events_total", (("reason", 'a"b'),)): 3.0}),
+            "histograms": {("collect_seconds", ()): [buckets, 20.5, 3]},
+            "gauges": defaultdict(float, {"backlog": 4.5}),
+        })
+        lines = text.splitlines()
+        self.assertIn("# TYPE clarotrack_events_total counter", lines)
+        self.assertIn('clarotrack_events_total{reason="a\\"b"} 3', lines)
+        self.assertIn('clarotrack_collect_seconds_bucket{le="0.0005"} 2', lines)
+        self.assertIn('clarotrack_collect_seconds_bucket{le="10.0"} 2', lines)
+        self.assertIn('clarotrack_collect_seconds_bucket{le="+Inf"} 3', lines)
+        self.assertIn("clarotrack_collect_seconds_sum 20.5", lines)
+        self.assertIn("clarotrack_collect_seconds_count 3", lines)
+        self.assertIn("clarotrack_backlog 4.5", lines)
+
+    def test_collect_keeps_counters_of_dead_workers(self):
+        from . import metrics
+
+        dead_pid = 4194305
+        state = {"counters": [["test_dead_total", [], 5]], "histograms": [], "gauges": [["test_gauge", 9]]}
+        with open(os.path.join(metrics.metrics_dir(), f"{dead_pid}.json"), "w") as f:
+            json.dump(state, f)
+        metrics.inc("test_live_total", 2, kind="x")
+        metrics.observe("test_seconds", 0.003)
+
+        for _ in range(2):
+            total = metrics.collect()
+            self.assertEqual(total["counters"][("test_dead_total", ())], 5)
+            self.assertNotIn("test_gauge", total["gauges"])
+        self.assertEqual(total["counters"][("test_live_total", (("kind", "x"),))], 2)
+        self.assertEqual(total["histograms"][("test_seconds", ())][2], 1)
+        self.assertFalse(os.path.exists(os.path.join(metrics.metrics_dir(), f"{dead_pid}.json")))
+
+    def test_metrics_endpoint(self):
+        response = self.client.get("/api/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+
+
+# =====================
+# BENCHMARKS
+# =====================
+class BenchmarkTests(TestCase):
+    def test_traffic_is_reproducible(self):
+        import itertools
+
+        from .bench import traffic
+
+        first = list(itertools.islice(traffic(seed=3), 50))
+        second = list(itertools.islice(traffic(seed=3), 50))
+        strip = lambda events: [{k: v for k, v in e.items() if k not in ("ts", "params")} for e in events]
+        self.assertEqual(strip(first), strip(second))
+        self.assertEqual(len({event["ts"] for event in first}), 50)
+
+    def test_stub_counts_events(self):
+        from .bench import GA4StubServer
+        from .ga4 import GA4Dispatcher
+
+        server = GA4StubServer().start()
+        self.addCleanup(server.shutdown)
+        with override_settings(GA4_COLLECT_URL=server.url, GA4_MEASUREMENT_ID="G-T", GA4_API_SECRET="s"):
+            status = GA4Dispatcher(max_events=2).send("c1", [("a", {}), ("b", {}), ("c", {})])
+        self.assertEqual(status, 204)
+        self.assertEqual(server.stats(), {"requests": 2, "events": 3, "statuses": {"204": 2}})
+
+    def test_compare_flags_regressions(self):
+        from .bench import compare, percentile
+
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+        self.assertIsNone(percentile([], 99))
+        baseline = {"benchmarks": {"x": {"events_per_sec": 1000, "latency": {"p99_ms": 10}}}}
+        current = {"benchmarks": {"x": {"events_per_sec": 950, "latency": {"p99_ms": 12}}}}
+        self.assertEqual(compare(baseline, current), [("x", "p99_ms", 10, 12)])
+        self.assertEqual(compare(baseline, current, tolerance=0.5), [])
+
+    def test_benchmark_command_writes_results_and_checks_baseline(self):
+        from django.core.management.base import CommandError
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        output = os.path.join(directory, "results.json")
+        args = ["--only", "build_batch", "ga4_send", "--rounds", "3", "--batch-size", "5"]
+        call_command("benchmark", *args, "--output", output, stdout=StringIO())
+        with open(output) as f:
+            results = json.load(f)
+        self.assertEqual(set(results["benchmarks"]), {"build_batch", "ga4_send"})
+        self.assertEqual(results["benchmarks"]["ga4_send"]["stub"]["events"], 15)
+
+        results["benchmarks"]["build_batch"]["events_per_sec"] = 1e12
+        with open(output, "w") as f:
+            json.dump(results, f)
+        with self.assertRaises(CommandError):
+            call_command("benchmark", *args, "--baseline", output, stdout=StringIO())
+
+
+# =====================
+# CARGA CON COPY (PostgreSQL)
+# =====================
+class CopyLoaderTests(TestCase):
+    def events(self, n=3):
+        now = timezone.now()
+        return [
+            Event(aid=f"a{i}", event="click", path=f"/p\t{i}", user_agent=None, created_at=now)
+            for i in range(n)
+        ]
+
+    def test_copy_text_escaping(self):
+        from .storage import _copy_text
+
+        self.assertEqual(_copy_text(None), "\\N")
+        self.assertEqual(_copy_text("a\tb\nc\\d\r"), "a\\tb\\nc\\\\d\\r")
+        self.assertEqual(_copy_text(date(2026, 1, 2)), "2026-01-02")
+
+    def test_copy_sql_lists_columns(self):
+        from .storage import COPY_FIELDS, copy_sql
+
+        sql = copy_sql()
+        self.assertTrue(sql.startswith('COPY "tracking_event" ('))
+        self.assertTrue(sql.endswith(") FROM STDIN"))
+        self.assertEqual(sql.count(","), len(COPY_FIELDS) - 1)
+
+    def test_other_databases_use_bulk_create(self):
+        from .storage import use_copy, write_events
+
+        self.assertIs(use_copy(), connection.vendor == "postgresql")
+        write_events(self.events())
+        self.assertEqual(Event.objects.count(), 3)
+
+    @override_settings(EVENT_COPY_BATCH_SIZE=2)
+    def test_copy_write_batches_rows(self):
+        from .storage import COPY_FIELDS, _copy_write
+
+        for driver in ("psycopg", "psycopg2"):
+            with self.subTest(driver=driver), mock.patch("tracking.storage.connection") as conn, \
+                    mock.patch("tracking.storage.copy_sql", return_value="COPY t FROM STDIN"):
+                raw = conn.cursor.return_value.__enter__.return_value.cursor
+                if driver == "psycopg2":
+                    del raw.copy
+                _copy_write(self.events())
+                if driver == "psycopg":
+                    self.assertEqual(raw.copy.call_count, 2)
+                    copy = raw.copy.return_value.__enter__.return_value
+                    rows = [call.args[0] for call in copy.write_row.call_args_list]
+                    self.assertEqual(len(rows), 3)
+                    self.assertEqual(len(rows[0]), len(COPY_FIELDS))
+                else:
+                    self.assertEqual(raw.copy_expert.call_count, 2)
+                    text = raw.copy_expert.call_args_list[0].args[1].getvalue()
+                    self.assertEqual(text.count("\n"), 2)
+                    self.assertIn("/p\\t0", text)
+                    self.assertIn("\\N", text)
+
+
+# =====================
+# SQLITE DE ALTA CONCURRENCIA
+# =====================
+class SqliteHighConcurrencyTests(StateDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        from . import storage
+
+        # El archivo del lock vive en el directorio de estado de cada test
+        storage._writer_pid = None
+        self.addCleanup(setattr, storage, "_writer_pid", None)
+
+    def try_lock(self):
+        import fcntl
+
+        with open(os.path.join(self.state_dir, "sqlite-writer.lock"), "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            fcntl.flock(f, fcntl.LOCK_UN)
+            return True
+
+    @override_settings(SQLITE_HIGH_CONCURRENCY=True)
+    def test_writes_are_serialized_with_a_file_lock(self):
+        from .storage import single_writer, writer_lock
+
+        self.assertIs(single_writer(), True)
+        with writer_lock():
+            self.assertIs(self.try_lock(), False)
+        self.assertIs(self.try_lock(), True)
+
+    def test_lock_is_a_no_op_by_default(self):
+        from .storage import writer_lock
+
+        with writer_lock():
+            self.assertFalse(os.path.exists(os.path.join(self.state_dir, "sqlite-writer.lock")))
+
+    def test_settings_enable_wal_and_require_write_behind(self):
+        import subprocess
+        import sys
+
+        from django.conf import settings
+
+        script = (
+            "import core.settings as s; o = s.DATABASES['default'].get('OPTIONS', {});"
+            "print(s.EVENT_WRITE_BEHIND, o.get('transaction_mode'), 'journal_mode=WAL' in o.get('init_command', ''))"
+        )
+        env = {
+            key: value for key, value in os.environ.items()
+            if not key.startswith(("DATABASE", "SQLITE_", "EVENT_"))
+        }
+        env.update(DJANGO_SECRET_KEY="x", SQLITE_HIGH_CONCURRENCY="1", EVENT_SPOOL_DIR=self.state_dir)
+
+        def run(**extra):
+            return subprocess.run(
+                [sys.executable, "-c", script], cwd=settings.BASE_DIR,
+                env={**env, **extra}, capture_output=True, text=True,
+            )
+
+        result = run()
+        self.assertEqual(result.stdout.split(), ["True", "IMMEDIATE", "True"])
+        result = run(EVENT_WRITE_BEHIND="0")
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("ImproperlyConfigured", result.stderr)
@@ -1,8 +1,25 @@
+from django.conf import settings
 from django.urls import path
-from .views import collect_event, tracking_rules, clarotrack_static_proxy
+from .views import (
+    collect_event, collect_batch, collect_event_async, collect_batch_async,
+    tracking_rules, tracking_status, event_stats, prometheus_metrics,
+    clarotrack_static_proxy, clarotrack_bundle,
+)
+
+# Bajo ASGI (core/asgi.py) el ingest usa las vistas async
+if getattr(settings, "TRACKING_ASYNC_COLLECT", False):
+    collect_views = (collect_event_async, collect_batch_async)
+else:
+    collect_views = (collect_event, collect_batch)
 
 urlpatterns = [
-    path('collect/', collect_event),
+    path('collect/', collect_views[0]),
+    path('collect/batch/', collect_views[1]),
     path("tracking_rules/", tracking_rules),
+    path('status/', tracking_status),
+    path('metrics', prometheus_metrics),
+    path('metrics/', prometheus_metrics),
+    path('stats/', event_stats),
     path('static/tracking/clarotrack.js', clarotrack_static_proxy),
+    path('static/tracking/clarotrack.<str:bundle_hash>.js', clarotrack_bundle),
 ]
@@ -1,221 +1,424 @@
 
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from .models import Event, TrackingRule, GA4Rule
+from . import metrics
+from .ga4 import async_client
+from .sinks import dispatch_hits, is_ga4_sink, mirror_events
+from .buffer import apersist_events, persist_events
+from .bundle import current_bundle, get_bundle, loader_script, negotiate
+from .rollups import ROLLUP_MODELS, query_rollups
+from .rules import ga4_rules, tracking_rules_payload
+from .policies import KEPT, aggregate_events, apply_policies, partition_by_policy, policies
+from .dedupe import DUPLICATE, drop_duplicates, remember
+from .limits import RATE_LIMITED, admit, limit_aids, retry_after_seconds, shed_response
+from .ingest import build_batch, build_event, match_ga4_rules, parse_batch_body
 import json
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-import requests
 from django.conf import settings
-import uuid
 import logging
-from django.views.decorators.cache import never_cache
-from django.http import HttpResponse
-import os
+from django.http import HttpResponse, HttpResponseNotModified, HttpResponseRedirect
+from django.views.decorators.http import require_GET
+import time
+from datetime import timedelta, timezone as dt_timezone
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 logger = logging.getLogger(__name__)
 
-@never_cache
-def clarotrack_static_proxy(request):
-    file_path = os.path.join(
-        settings.BASE_DIR,
-        'tracking',
-        'static',
-        'tracking',
-        'clarotrack.js'
-    )
+STATS_DIMENSIONS = ("path", "utm_source", "utm_medium", "utm_campaign")
 
-    with open(file_path, 'r', encoding='utf-8') as f:
-        response = HttpResponse(
-            f.read(),
-            content_type='application/javascript'
-        )
+TRACKING_RULES_CACHE_CONTROL = f"public, max-age={getattr(settings, 'TRACKING_RULES_MAX_AGE', 60)}"
+
+def parse_stats_datetime(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
 
-    # 🔥 Headers ANTI Cloudflare
-    response['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-    response['Pragma'] = 'no-cache'
-    response['Expires'] = '0'
 
+def clarotrack_static_proxy(request):
+    """
+    Loader corto (TTL bajo) que apunta al bundle versionado actual.
+    """
+    bundle = current_bundle.get()
+    response = HttpResponse(
+        loader_script(bundle.hash),
+        content_type='application/javascript'
+    )
+    response['Cache-Control'] = f"public, max-age={getattr(settings, 'CLAROTRACK_LOADER_MAX_AGE', 60)}"
     return response
 
-def send_event_to_ga4(event_name, client_id, params=None):
-    url = "https://www.google-analytics.com/mp/collect"
-    
-    # Asegurar que client_id sea string válido
-    if not client_id or client_id == "anonymous":
-        client_id = str(uuid.uuid4())
-
-    payload = {
-        "client_id": str(client_id),  # Forzar string
-        "events": [
-            {
-                "name": event_name,
-                "params": params or {}
-            }
-        ]
-    }
-
-    print("➡️ Enviando a GA4:")
-    print("   URL:", url)
-    print("   Measurement ID:", settings.GA4_MEASUREMENT_ID)
-    print("   Event:", event_name)
-    print("   Client ID:", client_id)
-    print("   Params:", params)
-    print("   Payload completo:", json.dumps(payload, indent=2))
 
-    try:
-        response = requests.post(
-            url,
-            params={
-                "measurement_id": settings.GA4_MEASUREMENT_ID,
-                "api_secret": settings.GA4_API_SECRET,
-            },
-            json=payload,
-            timeout=5
-        )
+def clarotrack_bundle(request, bundle_hash):
+    """
+    Bundle inmutable clarotrack.<hash>.js, servido precomprimido.
+    """
+    bundle = get_bundle(bundle_hash)
+    if bundle is None:
+        # Hash viejo que ya no está en memoria: mandar al actual
+        response = HttpResponseRedirect(f"clarotrack.{current_bundle.get().hash}.js")
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    body, encoding = negotiate(bundle, request.META.get('HTTP_ACCEPT_ENCODING', ''))
+
+    response = HttpResponse(body, content_type='application/javascript')
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Vary'] = 'Accept-Encoding'
+    response['ETag'] = f'"{bundle.hash}"'
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
-        print("⬅️ GA4 response status:", response.status_code)
-        print("⬅️ GA4 response body:", response.text)
-        
-        # GA4 devuelve 204 si todo está OK (sin body)
-        if response.status_code == 204:
-            print("✅ Evento enviado exitosamente")
-        else:
-            print("⚠️ Status code inesperado")
-            
-        return response.status_code
-        
-    except Exception as e:
-        print("❌ Error enviando a GA4:", str(e))
-        return 500
-
-def get_value_by_path(data, path):
-    """
-    Lee valores anidados usando dot-notation
-    Ej: ecommerce.items
-    """
-    value = data
-    for key in path.split('.'):
-        if isinstance(value, dict):
-            value = value.get(key)
-        else:
-            return None
-    return value
+def stage(name):
+    return metrics.timer("collect_stage_seconds", stage=name)
 
 
 @api_view(['POST'])
 def collect_event(request):
-    logger.warning("🔥 collect_event EJECUTADO")
-    logger.warning(f"🔥 METHOD: {request.method}")
-    logger.warning(f"🔥 DATA RAW: {request.body}")
-    data = request.data or {}
-
-    event_name = data.get("event")
-    path = data.get("path") or data.get("page_location")
-    aid = data.get("aid") or data.get("client_id") or str(uuid.uuid4())
-    
-    logger.warning(f"📋 Event name: {event_name}")
-    logger.warning(f"📋 Path: {path}")
-    logger.warning(f"📋 AID: {aid}")
-    
-    if not event_name:
-        return Response({"error": "missing event"}, status=400)
-
-    # 1️⃣ Guardar evento
-    event = Event.objects.create(
-        aid=aid or "anonymous",
-        event=event_name,
-        path=path or "/",
-        user_agent=request.META.get("HTTP_USER_AGENT", "")
+    with metrics.timer("collect_request_seconds", endpoint="collect"):
+        return _collect_event(request)
+
+
+def _collect_event(request):
+    with stage("parse"):
+        data = request.data or {}
+    metrics.inc("events_received_total", endpoint="collect")
+
+    with stage("limits"):
+        rejected = admit(request, 1)
+    if rejected:
+        return rejected
+
+    try:
+        with stage("build"):
+            event = build_event(data, request.META.get("HTTP_USER_AGENT", ""))
+    except ValueError as e:
+        metrics.inc("events_rejected_total", endpoint="collect")
+        return Response({"error": str(e)}, status=400)
+    logger.debug("📋 Event name: %s", event.event)
+
+    # 0️⃣ Duplicados (reenvíos del dataLayer, reintentos de red)
+    with stage("dedupe"):
+        pairs, duplicates = drop_duplicates([(event, data)])
+    if not pairs:
+        return Response({"status": DUPLICATE})
+
+    with stage("limits"):
+        pairs, waits = limit_aids(pairs)
+    if not pairs:
+        return shed_response(RATE_LIMITED, retry_after=waits[0])
+
+    # Política de ingesta (drop / muestreo / solo contadores)
+    with stage("policy"):
+        kept, outcomes = apply_policies(pairs)
+    if not kept:
+        remember(pairs)
+        return Response({"status": outcomes[0]})
+
+    # 1️⃣ Guardar evento (write-behind si está activo); recién entonces
+    # cuenta para la deduplicación
+    with stage("persist"):
+        persist_events([event])
+    with stage("dedupe"):
+        remember(pairs)
+    metrics.inc("events_accepted_total", endpoint="collect")
+
+    # 2️⃣ Reglas GA4 (índice en memoria, sin consultas)
+    with stage("rules"):
+        hits = match_ga4_rules([(event, data)])
+
+    # 3️⃣ Encolar en los sinks (el envío ocurre en segundo plano)
+    with stage("sink_enqueue"):
+        for fire_event, _, _, sink in hits:
+            metrics.inc("ga4_rules_matched_total", fire_event=fire_event, sink=sink)
+        dispatch_hits(hits)
+        mirror_events([(event, data)])
+
+    return Response({"status": "ok"})
+
+@api_view(['POST'])
+def collect_batch(request):
+    """
+    Recibe un lote de eventos (array JSON o NDJSON), los guarda con un solo
+    bulk_create y evalúa las reglas GA4 una vez por lote.
+    """
+    with metrics.timer("collect_request_seconds", endpoint="batch"):
+        return _collect_batch(request)
+
+
+def mark_filtered(results, pairs, split, status):
+    """
+    Aplica `split` (drop_duplicates, limit_aids) a los pares del lote y
+    marca los descartados en `results` con `status`. Los limitados llevan
+    además `retry_after` (segundos).
+    Devuelve (pares que siguen, cantidad descartada).
+    """
+    valid = [result for result in results if result["status"] == "ok"]
+    pairs, flags = split(pairs)
+    for result, flag in zip(valid, flags):
+        if flag:
+            result["status"] = status
+            if status == RATE_LIMITED:
+                result["retry_after"] = retry_after_seconds(flag)
+    return pairs, sum(1 for flag in flags if flag)
+
+
+def _collect_batch(request):
+    try:
+        with stage("parse"):
+            items = parse_batch_body(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return Response({"error": "invalid batch body"}, status=400)
+
+    max_events = getattr(settings, "COLLECT_BATCH_MAX_EVENTS", 500)
+    if len(items) > max_events:
+        return Response(
+            {"error": f"batch too large (max {max_events} events)"},
+            status=413
+        )
+
+    metrics.inc("events_received_total", len(items), endpoint="batch")
+    with stage("limits"):
+        rejected = admit(request, len(items))
+    if rejected:
+        return rejected
+
+    with stage("build"):
+        results, pairs = build_batch(items, request.META.get("HTTP_USER_AGENT", ""))
+
+    # 0️⃣ Duplicados, límites por aid y políticas antes de escribir nada (las
+    # claves de deduplicación se registran después de guardar)
+    with stage("dedupe"):
+        pairs, duplicates = mark_filtered(results, pairs, drop_duplicates, DUPLICATE)
+    with stage("limits"):
+        pairs, limited = mark_filtered(results, pairs, limit_aids, RATE_LIMITED)
+    admitted = pairs
+
+    with stage("policy"):
+        valid = [result for result in results if result["status"] == "ok"]
+        pairs, outcomes = apply_policies(pairs)
+        for result, outcome in zip(valid, outcomes):
+            result["status"] = outcome
+
+    # 1️⃣ Guardar todo el lote en una sola escritura
+    with stage("persist"):
+        persist_events([event for event, _ in pairs])
+    with stage("dedupe"):
+        remember(admitted)
+    metrics.inc("events_accepted_total", len(pairs), endpoint="batch")
+
+    # 2️⃣ Reglas GA4 (índice en memoria, una pasada por lote)
+    with stage("rules"):
+        hits = match_ga4_rules(pairs)
+
+    with stage("sink_enqueue"):
+        for fire_event, _, _, sink in hits:
+            metrics.inc("ga4_rules_matched_total", fire_event=fire_event, sink=sink)
+        dispatch_hits(hits)
+        mirror_events(pairs)
+
+    return Response({
+        "status": "ok",
+        "received": len(items),
+        "accepted": len(pairs),
+        "filtered": sum(1 for outcome in outcomes if outcome != KEPT),
+        "duplicates": duplicates,
+        "rate_limited": limited,
+        "results": results,
+    })
+
+# =====================
+# PIPELINE ASYNC (ASGI)
+# =====================
+async def ingest_async(items, user_agent):
+    """
+    Mismo flujo que collect_batch sin bloquear el event loop: índices en
+    memoria, ORM async y envío GA4 con httpx en segundo plano.
+    """
+    policy_index = await policies.aget()
+    rules_index = await ga4_rules.aget()
+
+    with stage("build"):
+        results, pairs = build_batch(items, user_agent)
+
+    # 0️⃣ Duplicados, límites por aid y políticas de ingesta
+    with stage("dedupe"):
+        pairs, duplicates = mark_filtered(results, pairs, drop_duplicates, DUPLICATE)
+    with stage("limits"):
+        pairs, limited = mark_filtered(results, pairs, limit_aids, RATE_LIMITED)
+    admitted = pairs
+
+    with stage("policy"):
+        valid = [result for result in results if result["status"] == "ok"]
+        pairs, aggregated, outcomes = partition_by_policy(pairs, policy_index)
+        for result, outcome in zip(valid, outcomes):
+            result["status"] = outcome
+    aggregate_events(aggregated)
+
+    # 1️⃣ Guardar
+    start = time.perf_counter()
+    await apersist_events([event for event, _ in pairs])
+    metrics.observe("collect_stage_seconds", time.perf_counter() - start, stage="persist")
+    with stage("dedupe"):
+        remember(admitted)
+    metrics.inc("events_accepted_total", len(pairs), endpoint="async")
+
+    # 2️⃣ Reglas GA4 → envío concurrente (no se espera la respuesta de GA4)
+    with stage("rules"):
+        hits = match_ga4_rules(pairs, rules_index)
+    for fire_event, _, _, sink in hits:
+        metrics.inc("ga4_rules_matched_total", fire_event=fire_event, sink=sink)
+    with stage("sink_enqueue"):
+        # GA4 va por httpx en el loop; el resto de sinks por sus colas
+        async_client.schedule([hit[:3] for hit in hits if is_ga4_sink(hit[3])])
+        dispatch_hits([hit for hit in hits if not is_ga4_sink(hit[3])])
+        mirror_events(pairs)
+    return results, len(pairs), outcomes, duplicates, limited
+
+
+@csrf_exempt
+async def collect_event_async(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "method not allowed"}, status=405)
+    try:
+        with stage("parse"):
+            data = json.loads(request.body or b"{}")
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({"error": "invalid JSON"}, status=400)
+    metrics.inc("events_received_total", endpoint="async")
+
+    with stage("limits"):
+        rejected = admit(request, 1)
+    if rejected:
+        return rejected
+
+    results, _, _, _, _ = await ingest_async(
+        [data], request.META.get("HTTP_USER_AGENT", "")
     )
-    logger.warning(f"✅ Evento guardado ID: {event.id}")
+    if results[0]["status"] == "error":
+        return JsonResponse({"error": results[0]["error"]}, status=400)
+    if results[0]["status"] == RATE_LIMITED:
+        return shed_response(RATE_LIMITED, retry_after=results[0]["retry_after"])
+    return JsonResponse({"status": results[0]["status"]})
 
-    # 2️⃣ Buscar reglas GA4
-    ga4_rules = GA4Rule.objects.filter(
-        listen_event=event.event,
-        active=True
+
+@csrf_exempt
+async def collect_batch_async(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "method not allowed"}, status=405)
+    try:
+        with stage("parse"):
+            items = parse_batch_body(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({"error": "invalid batch body"}, status=400)
+    metrics.inc("events_received_total", len(items), endpoint="async")
+
+    max_events = getattr(settings, "COLLECT_BATCH_MAX_EVENTS", 500)
+    if len(items) > max_events:
+        return JsonResponse(
+            {"error": f"batch too large (max {max_events} events)"},
+            status=413
+        )
+
+    with stage("limits"):
+        rejected = admit(request, len(items))
+    if rejected:
+        return rejected
+
+    results, accepted, outcomes, duplicates, limited = await ingest_async(
+        items, request.META.get("HTTP_USER_AGENT", "")
     )
-    
-    logger.warning(f"🔍 Reglas encontradas para '{event.event}': {ga4_rules.count()}")
-    
-    # 👀 Mostrar TODAS las reglas disponibles
-    all_rules = GA4Rule.objects.all()
-    logger.warning(f"📚 Total reglas en DB: {all_rules.count()}")
-    for r in all_rules:
-        logger.warning(f"   - ID:{r.id} | listen='{r.listen_event}' | fire='{r.fire_event}' | active={r.active}")
-
-    for rule in ga4_rules:
-        logger.warning(f"🎯 Procesando regla ID: {rule.id}")
-
-        if rule.url_contains and rule.url_contains not in event.path:
-            logger.warning(f"⏭️ Saltando (URL '{event.path}' no contiene '{rule.url_contains}')")
-            continue
-
-        # 3️⃣ Params map
-        params = {}
-        params_map = rule.params_map or {}
-        if isinstance(params_map, str):
-            try:
-                params_map = json.loads(params_map)
-            except Exception:
-                params_map = {}
-
-        event_params = data.get("params", data)
-
-        for ga4_param, source_path in params_map.items():
-
-            # 1️⃣ VALOR CONSTANTE
-            if isinstance(source_path, str) and source_path.startswith("$const:"):
-                params[ga4_param] = source_path.replace("$const:", "")
-                continue
-
-            # 2️⃣ VALOR DINÁMICO (dot-notation)
-            value = get_value_by_path(event_params, source_path)
-            if value is not None:
-                params[ga4_param] = value
-
-
-        # 4️⃣ Campos mínimos GA4
-        params.update({
-            "page_location": event.path,
-            "engagement_time_msec": 1,
-            "debug_mode": True
-        })
-
-        # 5️⃣ Enviar a GA4
-        logger.warning(f"🚀 LLAMANDO send_event_to_ga4...")
-        logger.warning(f"   GA4_MEASUREMENT_ID existe: {hasattr(settings, 'GA4_MEASUREMENT_ID')}")
-        logger.warning(f"   GA4_API_SECRET existe: {hasattr(settings, 'GA4_API_SECRET')}")
-        
-        if hasattr(settings, "GA4_MEASUREMENT_ID") and hasattr(settings, "GA4_API_SECRET"):
-            logger.warning(f"   Measurement ID: {settings.GA4_MEASUREMENT_ID}")
-            send_event_to_ga4(
-                event_name=rule.fire_event,
-                client_id=event.aid,
-                params=params
-            )
-        else:
-            logger.error("❌ Credenciales GA4 NO configuradas")
+    return JsonResponse({
+        "status": "ok",
+        "received": len(items),
+        "accepted": accepted,
+        "filtered": sum(1 for outcome in outcomes if outcome != KEPT),
+        "duplicates": duplicates,
+        "rate_limited": limited,
+        "results": results,
+    })
+
+
+@require_GET
+def tracking_rules(request):
+    """
+    Reglas activas para clarotrack.js. El JSON se arma una vez por versión
+    de TrackingRule y se responde 304 si el cliente ya tiene ese ETag.
+    """
+    body, etag = tracking_rules_payload.get()
+
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH", "")
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in tags or "*" in tags:
+            response = HttpResponseNotModified()
+            response["ETag"] = etag
+            response["Cache-Control"] = TRACKING_RULES_CACHE_CONTROL
+            return response
+
+    response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    response["Cache-Control"] = TRACKING_RULES_CACHE_CONTROL
+    return response
 
-    return Response({"status": "ok"})
 
 @api_view(['GET'])
-def tracking_rules(request):
-    rules = TrackingRule.objects.filter(active=True)
-    data = []
-    for r in rules:
-        data.append({
-            "listen_event": r.listen_event,
-            "selector": r.selector,
-            "url_contains": r.url_contains,
-            "fire_event": r.fire_event,
-            "params_map": r.params_map,
-            "custom_js": r.custom_js
-        })
-    return Response(data)
+def tracking_status(request):
+    """
+    Estado del proceso: profundidad de cola GA4, descartes y latencias.
+    """
+    return Response(metrics.snapshot())
 
 
+@require_GET
+def prometheus_metrics(request):
+    """
+    Métricas de todos los workers en formato de texto de Prometheus.
+    """
+    return HttpResponse(
+        metrics.render_prometheus(),
+        content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
+@api_view(['GET'])
+def event_stats(request):
+    """
+    Conteos por minuto u hora, leídos solo de las tablas de rollup.
 
+    Parámetros: granularity (minute|hour), start, end (ISO 8601), event,
+    path, utm_source, utm_medium, utm_campaign y group_by (lista separada
+    por comas de path y campos utm).
+    """
+    params = request.query_params
+    granularity = params.get("granularity", "hour")
+    if granularity not in ROLLUP_MODELS:
+        return Response({"error": "granularity must be minute or hour"}, status=400)
 
+    try:
+        end = parse_stats_datetime(params.get("end")) or timezone.now()
+        start = parse_stats_datetime(params.get("start")) or end - timedelta(hours=24)
+    except ValueError:
+        return Response({"error": "invalid start/end"}, status=400)
+
+    group_by = [f for f in params.get("group_by", "").split(",") if f]
+    if any(f not in STATS_DIMENSIONS for f in group_by):
+        return Response({"error": f"group_by must be in {', '.join(STATS_DIMENSIONS)}"}, status=400)
+
+    filters = {f: params[f] for f in STATS_DIMENSIONS if f in params}
+    buckets = query_rollups(
+        granularity, start, end,
+        event=params.get("event"), filters=filters, group_by=group_by,
+    )
+    return Response({
+        "granularity": granularity,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "buckets": buckets,
+    })